@@ -4,27 +4,46 @@ import logging
 import os
 import queue
 import socket
-import struct
 import threading
 import time
 
 import bjoern
 import falcon
+import numpy as np
 from falcon_cors import CORS
+from prometheus_client import Counter
+from prometheus_client import Gauge
+from prometheus_client import Histogram
+from prometheus_client import REGISTRY
+from prometheus_client import start_http_server
 
 from gamutrf.__init__ import __version__
 from gamutrf.birdseye_rssi import BirdsEyeRSSI
 from gamutrf.birdseye_rssi import FLOAT_SIZE
 from gamutrf.birdseye_rssi import MAX_RSSI
+from gamutrf.birdseye_rssi import RSSI_HEADER
 from gamutrf.birdseye_rssi import RSSI_UDP_ADDR
 from gamutrf.birdseye_rssi import RSSI_UDP_PORT
+from gamutrf.compression import CODECS
+from gamutrf.compression import CompressionOptions
+from gamutrf.compression import ZST_LEVEL
 from gamutrf.mqtt_reporter import MQTTReporter
 from gamutrf.sdr_recorder import get_recorder
 from gamutrf.sdr_recorder import RECORDER_MAP
+from gamutrf.sigwindows import FreqExclusions
 
 WORKER_NAME = os.getenv("WORKER_NAME", socket.gethostbyname(socket.gethostname()))
 ORCHESTRATOR = os.getenv("ORCHESTRATOR", "orchestrator")
 ANTENNA = os.getenv("ANTENNA", "")
+REQUEST_TTL = 60
+REQUEST_QUEUED = "queued"
+REQUEST_COALESCED = "coalesced"
+REQUEST_REJECTED = "rejected"
+RSSI_RECV_BYTES = 2**16
+RSSI_RCVBUF_BYTES = 2**22
+RSSI_PERCENTILES = (50, 90, 99)
+COMPRESSION_RATIO_BUCKETS = (1, 1.25, 1.5, 2, 3, 4, 8, 16, float("inf"))
+COMPRESSION_MBPS_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, float("inf"))
 
 
 def argument_parser():
@@ -76,6 +95,31 @@ def argument_parser():
     parser.add_argument(
         "--qsize", help="Max request queue size", default=int(2), type=int
     )
+    parser.add_argument(
+        "--request_ttl",
+        help="Seconds a queued request may wait before it is dropped (0 to wait forever)",
+        default=REQUEST_TTL,
+        type=float,
+    )
+    parser.add_argument(
+        "--post_qsize",
+        help="Max recordings waiting for post processing, before recording blocks",
+        default=int(4),
+        type=int,
+    )
+    parser.add_argument(
+        "--post_workers",
+        help="Number of threads post processing recordings",
+        default=int(1),
+        type=int,
+    )
+    parser.add_argument(
+        "--promport",
+        dest="promport",
+        type=int,
+        default=9000,
+        help="Prometheus client port",
+    )
     parser.add_argument(
         "--mqtt_server",
         help="MQTT server to report RSSI",
@@ -84,7 +128,7 @@ def argument_parser():
     )
     parser.add_argument(
         "--rssi_interval",
-        help="rate limit in seconds for RSSI updates to MQTT",
+        help="interval in seconds over which RSSI values are aggregated, for each update to MQTT",
         default=1.0,
         type=float,
     )
@@ -97,6 +141,45 @@ def argument_parser():
     parser.add_argument(
         "--rssi_threshold", help="RSSI reporting threshold", default=-45, type=float
     )
+    parser.add_argument(
+        "--zst_frame_secs",
+        help="if not 0, write seekable zst recordings with an index, in frames of this many seconds of samples",
+        default=0,
+        type=float,
+    )
+    parser.add_argument(
+        "--compression",
+        help="compress recordings with zstd, or none (e.g. for hot storage, where disk is cheaper than CPU)",
+        default="zstd",
+        choices=CODECS,
+        type=str,
+    )
+    parser.add_argument(
+        "--zst_level",
+        help="zstd compression level",
+        default=ZST_LEVEL,
+        type=int,
+    )
+    parser.add_argument(
+        "--zst_threads",
+        help="if not 0, compress with this many zstd worker threads",
+        default=0,
+        type=int,
+    )
+    zst_long_parser = parser.add_mutually_exclusive_group(required=False)
+    zst_long_parser.add_argument(
+        "--zst_long",
+        dest="zst_long",
+        action="store_true",
+        default=False,
+        help="use zstd long distance matching",
+    )
+    zst_long_parser.add_argument(
+        "--no-zst_long",
+        dest="zst_long",
+        action="store_false",
+        help="do not use zstd long distance matching",
+    )
     arg_parser = parser.add_mutually_exclusive_group(required=False)
     arg_parser.add_argument(
         "--agc", dest="agc", action="store_true", default=True, help="use AGC"
@@ -127,6 +210,248 @@ def argument_parser():
     return parser
 
 
+def init_prom_vars(registry=REGISTRY):
+    prom_vars = {
+        "sdr_record_seconds": Counter(
+            "sdr_record_seconds",
+            "seconds the SDR has spent recording",
+            registry=registry,
+        ),
+        "sdr_duty_cycle": Gauge(
+            "sdr_duty_cycle",
+            "fraction of time the SDR has spent recording since startup",
+            registry=registry,
+        ),
+        "post_process_backlog": Gauge(
+            "post_process_backlog",
+            "recordings waiting for or in post processing",
+            registry=registry,
+        ),
+        "post_process_seconds": Histogram(
+            "post_process_seconds",
+            "seconds to post process a recording",
+            registry=registry,
+        ),
+        "request_queue_depth": Gauge(
+            "request_queue_depth",
+            "recording requests queued",
+            registry=registry,
+        ),
+        "request_wait_seconds": Histogram(
+            "request_wait_seconds",
+            "seconds recording requests waited in the queue",
+            registry=registry,
+        ),
+        "record_requests": Counter(
+            "record_requests",
+            "recording requests by outcome (queued, coalesced, preempted, expired, rejected)",
+            labelnames=("outcome",),
+            registry=registry,
+        ),
+        "rssi_datagrams_lost": Counter(
+            "rssi_datagrams_lost",
+            "RSSI datagrams lost, by gaps in sequence numbers",
+            registry=registry,
+        ),
+        "recording_raw_bytes": Counter(
+            "recording_raw_bytes",
+            "bytes of samples recorded, before compression",
+            registry=registry,
+        ),
+        "recording_compressed_bytes": Counter(
+            "recording_compressed_bytes",
+            "bytes of recordings written, after compression",
+            registry=registry,
+        ),
+        "recording_compression_ratio": Histogram(
+            "recording_compression_ratio",
+            "ratio of raw to compressed bytes per recording",
+            buckets=COMPRESSION_RATIO_BUCKETS,
+            registry=registry,
+        ),
+        "recording_compression_mbps": Histogram(
+            "recording_compression_mbps",
+            "MB of samples per second of compression per recording",
+            buckets=COMPRESSION_MBPS_BUCKETS,
+            registry=registry,
+        ),
+    }
+    return prom_vars
+
+
+class ScheduledRequest:
+    def __init__(self, request, priority, seq, now, ttl):
+        self.request = request
+        self.priority = priority
+        self.seq = seq
+        self.queued_time = now
+        self.expire_time = None
+        if ttl:
+            self.expire_time = now + ttl
+
+    def key(self):
+        # highest priority first, then first queued.
+        return (-self.priority, self.seq)
+
+    def expired(self, now):
+        return self.expire_time is not None and now >= self.expire_time
+
+    def overlaps(self, request):
+        # only requests at the same sample rate can share a recording (which
+        # is lengthened for the longer of the two), with each center
+        # frequency within the other request's band.
+        sample_rate = self.request.get("sample_rate", 0)
+        if request.get("sample_rate", 0) != sample_rate:
+            return False
+        return abs(self.request["center_freq"] - request["center_freq"]) <= (
+            sample_rate / 2
+        )
+
+    def coalesce(self, request, priority, now, ttl):
+        self.request["sample_count"] = max(
+            self.request["sample_count"], request["sample_count"]
+        )
+        self.priority = max(self.priority, priority)
+        if ttl:
+            self.expire_time = now + ttl
+
+
+def decode_rssi(data):
+    """Return the sequence number, timestamp and float32 RSSI values in a
+    datagram from BirdsEyeRSSI (None if it is malformed)."""
+    if len(data) < RSSI_HEADER.size:
+        return None
+    seq, timestamp, count = RSSI_HEADER.unpack_from(data)
+    if len(data) != RSSI_HEADER.size + count * FLOAT_SIZE:
+        return None
+    return (
+        seq,
+        timestamp,
+        np.frombuffer(data, dtype=np.float32, offset=RSSI_HEADER.size),
+    )
+
+
+class RSSIStats:
+    """Aggregate RSSI values over a reporting interval."""
+
+    def __init__(self, threshold, percentiles=RSSI_PERCENTILES):
+        self.threshold = threshold
+        self.percentiles = percentiles
+        self.values = []
+
+    def add(self, values):
+        # copies, so the caller may reuse its receive buffer.
+        values = values[np.isfinite(values) & (values <= MAX_RSSI)]
+        if values.size:
+            self.values.append(values)
+
+    def summary(self):
+        """Return stats for values added since the last summary (None if
+        there were none, or none over the threshold), and start again."""
+        if not self.values:
+            return None
+        values = np.concatenate(self.values)
+        self.values = []
+        rssi_max = float(values.max())
+        if rssi_max < self.threshold:
+            return None
+        stats = {
+            "rssi": rssi_max,
+            "rssi_mean": float(values.mean(dtype=np.float64)),
+            "rssi_count": int(values.size),
+        }
+        for percentile, value in zip(
+            self.percentiles, np.percentile(values, self.percentiles)
+        ):
+            stats[f"rssi_p{percentile}"] = float(value)
+        return stats
+
+
+class RequestScheduler:
+    """Queue of recording requests, served highest priority first, then in order.
+
+    A request overlapping one already queued at the same sample rate is
+    coalesced into it, rather than recording the same signal twice. When the
+    queue is full, a request preempts the newest of the lowest priority
+    requests queued, if that is lower priority than it. Requests queued for
+    longer than ttl seconds are dropped, rather than recorded late.
+    """
+
+    def __init__(self, maxsize, prom_vars, ttl=0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.queue_depth = prom_vars["request_queue_depth"]
+        self.wait_seconds = prom_vars["request_wait_seconds"]
+        self.record_requests = prom_vars["record_requests"]
+        self.scheduled = []
+        self.seq = 0
+        self.cond = threading.Condition()
+
+    def _expire(self, now):
+        live = [scheduled for scheduled in self.scheduled if not scheduled.expired(now)]
+        expired = len(self.scheduled) - len(live)
+        if expired:
+            self.record_requests.labels(outcome="expired").inc(expired)
+            self.scheduled = live
+            self.queue_depth.set(len(self.scheduled))
+
+    def _put(self, request, priority, now):
+        for scheduled in self.scheduled:
+            if scheduled.overlaps(request):
+                scheduled.coalesce(request, priority, now, self.ttl)
+                self.record_requests.labels(outcome="coalesced").inc()
+                return REQUEST_COALESCED
+        if len(self.scheduled) >= self.maxsize:
+            lowest = max(self.scheduled, key=lambda scheduled: scheduled.key())
+            if lowest.priority >= priority:
+                self.record_requests.labels(outcome="rejected").inc()
+                return REQUEST_REJECTED
+            self.scheduled.remove(lowest)
+            self.record_requests.labels(outcome="preempted").inc()
+        self.seq += 1
+        self.scheduled.append(
+            ScheduledRequest(request, priority, self.seq, now, self.ttl)
+        )
+        self.record_requests.labels(outcome="queued").inc()
+        return REQUEST_QUEUED
+
+    def put(self, request, priority=0):
+        """Schedule a request, returning REQUEST_QUEUED, REQUEST_COALESCED or REQUEST_REJECTED."""
+        now = time.time()
+        with self.cond:
+            self._expire(now)
+            status = self._put(request, priority, now)
+            self.queue_depth.set(len(self.scheduled))
+            self.cond.notify()
+        return status
+
+    def get(self):
+        """Wait for, and return, the next request to record."""
+        with self.cond:
+            while True:
+                now = time.time()
+                self._expire(now)
+                if self.scheduled:
+                    break
+                self.cond.wait()
+            scheduled = min(self.scheduled, key=lambda scheduled: scheduled.key())
+            self.scheduled.remove(scheduled)
+            self.queue_depth.set(len(self.scheduled))
+        self.wait_seconds.observe(now - scheduled.queued_time)
+        return scheduled.request
+
+    def qsize(self):
+        with self.cond:
+            self._expire(time.time())
+            return len(self.scheduled)
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def full(self):
+        return self.qsize() >= self.maxsize
+
+
 class Endpoints:
     @staticmethod
     def on_get(_req, resp):
@@ -159,47 +484,66 @@ class Info:
 class Record:
     def __init__(self, arguments, q, sdr_recorder):
         self.arguments = arguments
+        self.freq_exclusions = FreqExclusions.parse(arguments.freq_excluded)
         self.q = q
         self.sdr_recorder = sdr_recorder
 
-    def on_get(self, _req, resp, center_freq, sample_count, sample_rate):
+    def on_get(self, req, resp, center_freq, sample_count, sample_rate):
         # TODO check if chosen SDR can do the supplied sample_count
         resp.content_type = falcon.MEDIA_JSON
         resp.status = falcon.HTTP_400
+        priority = req.get_param_as_int("priority", default=0)
 
-        status = None
-        if self.q.full():
-            status = "Request queue is full"
-        else:
-            status = self.sdr_recorder.validate_request(
-                self.arguments.freq_excluded, center_freq, sample_count, sample_rate
-            )
+        status = self.sdr_recorder.validate_request(
+            self.freq_exclusions, center_freq, sample_count, sample_rate
+        )
 
         if status is None:
-            self.q.put(
+            queued = self.q.put(
                 {
                     "center_freq": int(center_freq),
                     "sample_count": int(sample_count),
                     "sample_rate": int(sample_rate),
-                }
+                },
+                priority=priority,
             )
-            status = "Requsted recording"
-            resp.status = falcon.HTTP_200
+            if queued == REQUEST_REJECTED:
+                status = "Request queue is full"
+            else:
+                status = "Requsted recording"
+                if queued == REQUEST_COALESCED:
+                    status = "Coalesced with queued recording"
+                resp.status = falcon.HTTP_200
 
         resp.text = json.dumps({"status": status})
 
 
 class API:
-    def __init__(self, arguments):
+    def __init__(self, arguments, prom_vars):
         self.arguments = arguments
+        self.prom_vars = prom_vars
         self.mqtt_reporter = MQTTReporter(
             self.arguments.name,
             self.arguments.mqtt_server,
             ORCHESTRATOR,
             True,
         )
-        self.q = queue.Queue(self.arguments.qsize)
+        self.q = RequestScheduler(
+            self.arguments.qsize, prom_vars, ttl=self.arguments.request_ttl
+        )
+        # recordings are post processed while the SDR makes the next one.
+        self.post_q = queue.Queue(self.arguments.post_qsize)
+        self.post_backlog = 0
+        self.record_seconds = 0
+        self.post_lock = threading.Lock()
+        self.report_lock = threading.Lock()
         self.sdr_recorder = get_recorder(self.arguments.sdr)
+        self.compression = CompressionOptions(
+            codec=self.arguments.compression,
+            level=self.arguments.zst_level,
+            threads=self.arguments.zst_threads,
+            long_distance=self.arguments.zst_long,
+        )
         self.start_time = time.time()
         cors = CORS(allow_all_origins=True)
         self.app = falcon.App(middleware=[cors.middleware])
@@ -218,7 +562,7 @@ class API:
                 self.serve_recording(record_func)
 
     def record(self, center_freq, sample_count, sample_rate=20e6):
-        return self.sdr_recorder.run_recording(
+        return self.sdr_recorder.capture_recording(
             self.arguments.path,
             sample_rate,
             sample_count,
@@ -229,45 +573,109 @@ class API:
             self.arguments.sigmf,
             self.arguments.sdr,
             self.arguments.antenna,
+            zst_frame_secs=self.arguments.zst_frame_secs,
+            compression=self.compression,
         )
 
+    def update_post_backlog(self, change):
+        with self.post_lock:
+            self.post_backlog += change
+            self.prom_vars["post_process_backlog"].set(self.post_backlog)
+
+    def observe_compression(self, stats):
+        if not stats or not stats["raw_bytes"]:
+            return
+        self.prom_vars["recording_raw_bytes"].inc(stats["raw_bytes"])
+        self.prom_vars["recording_compressed_bytes"].inc(stats["compressed_bytes"])
+        if stats["compressed_bytes"]:
+            self.prom_vars["recording_compression_ratio"].observe(
+                stats["raw_bytes"] / stats["compressed_bytes"]
+            )
+        if stats["seconds"]:
+            self.prom_vars["recording_compression_mbps"].observe(
+                stats["raw_bytes"] / 1e6 / stats["seconds"]
+            )
+        logging.info("compression stats: %s", stats)
+
     def serve_recording(self, record_func):
         record_args = self.q.get()
         logging.info(f"got a request: {record_args}")
-        record_status = record_func(**record_args)
+        record_start_time = time.time()
+        record_status, _sample_file, post_args = record_func(**record_args)
+        record_seconds = time.time() - record_start_time
+        self.record_seconds += record_seconds
+        self.prom_vars["sdr_record_seconds"].inc(record_seconds)
+        self.prom_vars["sdr_duty_cycle"].set(
+            self.record_seconds / (time.time() - self.start_time)
+        )
         if record_status == -1:
             # TODO this only kills the thread, not the main process
             return
-        record_args.update(vars(self.arguments))
-        self.mqtt_reporter.publish("gamutrf/record", record_args)
-        self.mqtt_reporter.log(
-            self.arguments.path, "record", self.start_time, record_args
-        )
+        self.observe_compression(getattr(self.sdr_recorder, "compression_stats", None))
+        self.update_post_backlog(1)
+        # blocks if post processing has fallen too far behind.
+        self.post_q.put((record_args, post_args))
 
-    def report_rssi(self, record_args, reported_rssi, reported_time):
-        logging.info(f'reporting RSSI {reported_rssi} for {record_args["center_freq"]}')
-        record_args.update({"rssi": reported_rssi, "time": reported_time})
+    def post_process(self, record_args, post_args):
+        post_start_time = time.time()
+        try:
+            if post_args is not None:
+                self.sdr_recorder.post_process_recording(**post_args)
+            record_args.update(vars(self.arguments))
+            with self.report_lock:
+                self.mqtt_reporter.publish("gamutrf/record", record_args)
+                self.mqtt_reporter.log(
+                    self.arguments.path, "record", self.start_time, record_args
+                )
+        except Exception as err:  # pylint: disable=broad-except
+            logging.error("post processing %s failed: %s", record_args, err)
+        self.prom_vars["post_process_seconds"].observe(time.time() - post_start_time)
+        self.update_post_backlog(-1)
+
+    def run_post_processor(self):
+        logging.info("run post processor")
+        while True:
+            record_args, post_args = self.post_q.get()
+            self.post_process(record_args, post_args)
+
+    def report_rssi(self, record_args, rssi_stats, reported_time):
+        logging.info(f'reporting RSSI {rssi_stats} for {record_args["center_freq"]}')
+        record_args.update(rssi_stats)
+        record_args.update({"time": reported_time})
         record_args.update(vars(self.arguments))
-        self.mqtt_reporter.publish("gamutrf/rssi", record_args)
-        self.mqtt_reporter.log(
-            self.arguments.path, "rssi", self.start_time, record_args
-        )
+        with self.report_lock:
+            self.mqtt_reporter.publish("gamutrf/rssi", record_args)
+            self.mqtt_reporter.log(
+                self.arguments.path, "rssi", self.start_time, record_args
+            )
 
     def process_rssi(self, record_args, sock):
-        last_rssi_time = 0
+        # each datagram carries many RSSI values, which are aggregated and
+        # reported once per interval.
+        buffer = bytearray(RSSI_RECV_BYTES)
+        rssi_stats = RSSIStats(self.arguments.rssi_threshold)
+        last_rssi_time = time.time()
+        rssi_time = last_rssi_time
+        next_seq = None
         while self.q.empty():
-            rssi_raw, _ = sock.recvfrom(FLOAT_SIZE)
-            rssi = struct.unpack("f", rssi_raw)[0]
-            if rssi < self.arguments.rssi_threshold:
-                continue
-            if rssi > MAX_RSSI:
+            nbytes = sock.recv_into(buffer)
+            datagram = decode_rssi(memoryview(buffer)[:nbytes])
+            if datagram is None:
+                logging.debug("malformed RSSI datagram of %u bytes", nbytes)
                 continue
+            seq, rssi_time, values = datagram
+            if next_seq is not None and seq > next_seq:
+                self.prom_vars["rssi_datagrams_lost"].inc(seq - next_seq)
+            next_seq = seq + 1
+            rssi_stats.add(values)
             now = time.time()
-            now_diff = now - last_rssi_time
-            if now_diff < self.arguments.rssi_interval:
+            if now - last_rssi_time < self.arguments.rssi_interval:
                 continue
-            self.report_rssi(record_args, rssi, now)
             last_rssi_time = now
+            summary = rssi_stats.summary()
+            if summary is not None:
+                # the time the latest values were sent, rather than received.
+                self.report_rssi(record_args, summary, rssi_time)
 
     def serve_rssi(self):
         record_args = self.q.get()
@@ -289,6 +697,8 @@ class API:
             f"serving RSSI for {center_freq}Hz over threshold {self.arguments.rssi_threshold} with AGC {self.arguments.agc}"
         )
         with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            # room for bursts of datagrams while reports are published.
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RSSI_RCVBUF_BYTES)
             sock.bind((RSSI_UDP_ADDR, RSSI_UDP_PORT))
             self.process_rssi(record_args, sock)
         logging.info("RSSI stream stopped")
@@ -312,6 +722,10 @@ class API:
         return dict(zip(p, funcs))
 
     def run(self):
+        start_http_server(self.arguments.promport)
+        for _ in range(self.arguments.post_workers):
+            threading.Thread(target=self.run_post_processor, daemon=True).start()
+
         logging.info("starting recorder thread")
         recorder_thread = threading.Thread(
             target=self.run_recorder, args=(self.record,)
@@ -328,5 +742,5 @@ def main():
     level_int = {"CRITICAL": 50, "ERROR": 40, "WARNING": 30, "INFO": 20, "DEBUG": 10}
     level = level_int.get(arguments.loglevel.upper(), 0)
     logging.basicConfig(level=level, format="%(asctime)s %(message)s")
-    app = API(arguments)
+    app = API(arguments, init_prom_vars())
     app.run()
@@ -1,9 +1,13 @@
+import socket
+import struct
 import sys
+import time
+
+import numpy as np
 
 try:
     from gnuradio import blocks
     from gnuradio import gr
-    from gnuradio import network
 except ModuleNotFoundError:
     print(
         "Run from outside a supported environment, please run via Docker (https://github.com/IQTLabs/gamutRF#readme)"
@@ -16,6 +20,40 @@ FLOAT_SIZE = 4
 RSSI_UDP_ADDR = "127.0.0.1"
 RSSI_UDP_PORT = 2001
 MAX_RSSI = 100
+# RSSI values per datagram.
+RSSI_VECTOR_LEN = 8192
+# datagram header: sequence number, time sent (seconds since epoch), and
+# number of float32 RSSI values following.
+RSSI_HEADER = struct.Struct("<QdI")
+
+
+class rssi_udp_sink(gr.sync_block):
+    """Send vectors of RSSI values as UDP datagrams, each after an RSSI_HEADER."""
+
+    def __init__(self, vlen, addr, port):
+        gr.sync_block.__init__(
+            self, name="rssi_udp_sink", in_sig=[(np.float32, vlen)], out_sig=None
+        )
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.connect((addr, port))
+        self.seq = 0
+
+    def work(self, input_items, output_items):
+        now = time.time()
+        for vector in input_items[0]:
+            try:
+                self.sock.send(
+                    RSSI_HEADER.pack(self.seq, now, len(vector)) + vector.tobytes()
+                )
+            except OSError:
+                # as with any UDP sink, nobody may be listening yet.
+                pass
+            self.seq += 1
+        return len(input_items[0])
+
+    def stop(self):
+        self.sock.close()
+        return True
 
 
 class BirdsEyeRSSI(gr.top_block):
@@ -35,9 +73,8 @@ class BirdsEyeRSSI(gr.top_block):
             blocks.nlog10_ff(10, 1, 0),
             blocks.add_const_ff(-34),
             blocks.keep_one_in_n(gr.sizeof_float, int(self.rssi_throttle)),
-            network.udp_sink(
-                gr.sizeof_float, 1, RSSI_UDP_ADDR, RSSI_UDP_PORT, 0, 32768, False
-            ),
+            blocks.stream_to_vector(gr.sizeof_float, RSSI_VECTOR_LEN),
+            rssi_udp_sink(RSSI_VECTOR_LEN, RSSI_UDP_ADDR, RSSI_UDP_PORT),
         ]
 
         last_block = rssi_blocks[0]
@@ -0,0 +1,244 @@
+"""Long-lived SDR capture worker.
+
+Keeps an SDR open between recordings. Reads one JSON request per line on
+stdin, e.g.
+
+    {"file": "x.s16.zst", "freq": 100e6, "rate": 20e6, "count": 20e6,
+     "gain": 30, "agc": false, "zst_frame_bytes": 0, "codec": "zstd",
+     "zst_level": 1, "zst_threads": 0, "zst_long": false}
+
+retunes only what changed since the last request, streams "count" complex
+int16 samples to a zstd compressor (or straight to the file, if codec is
+"none"), and replies with one JSON line, {"last_error": ""} on success
+(with the samples recorded and compression stats). A line is also written
+at startup, with last_error set if the SDR could not be opened.
+"""
+import argparse
+import json
+import logging
+import queue
+import sys
+import threading
+from urllib.parse import urlparse
+
+import numpy as np
+import zstandard
+
+from gamutrf.compression import CompressionOptions
+
+CAPTURE_CHUNK_SAMPLES = 2**16
+COMPRESS_QUEUE_CHUNKS = 64
+READ_TIMEOUT_US = int(1e6)
+
+
+class FileSource:
+    """Stand-in for an SDR, reading samples from a file (from the start again at EOF)."""
+
+    def __init__(self, path):
+        self.infile = open(path, "rb")
+
+    def tune(self, center_freq, sample_rate, gain, agc):
+        return
+
+    def start(self):
+        return
+
+    def read(self, buffer):
+        view = memoryview(buffer).cast("B")
+        size = self.infile.readinto(view)
+        if not size:
+            self.infile.seek(0)
+            size = self.infile.readinto(view)
+            if not size:
+                raise IOError("empty file source")
+        # only whole samples.
+        samples = size // (2 * buffer.itemsize)
+        self.infile.seek(samples * 2 * buffer.itemsize - size, 1)
+        return samples
+
+    def stop(self):
+        return
+
+    def close(self):
+        self.infile.close()
+
+
+class SoapySource:
+    """An SDR opened with SoapySDR (e.g. driver bladerf or lime)."""
+
+    def __init__(self, driver, soapy=None):
+        if soapy is None:
+            import SoapySDR as soapy  # pylint: disable=import-outside-toplevel,import-error
+
+        self.soapy = soapy
+        self.device = soapy.Device({"driver": driver})
+        self.stream = self.device.setupStream(
+            soapy.SOAPY_SDR_RX, soapy.SOAPY_SDR_CS16, [0]
+        )
+        self.tuning = {}
+        self.overflows = 0
+        self.timeouts = 0
+
+    def tune(self, center_freq, sample_rate, gain, agc):
+        rx = self.soapy.SOAPY_SDR_RX
+        # each setting change can take the device a while, so skip unchanged ones.
+        if self.tuning.get("sample_rate") != sample_rate:
+            self.device.setSampleRate(rx, 0, sample_rate)
+            self.device.setBandwidth(rx, 0, sample_rate)
+        if self.tuning.get("center_freq") != center_freq:
+            self.device.setFrequency(rx, 0, center_freq)
+        if self.tuning.get("agc") != agc:
+            self.device.setGainMode(rx, 0, agc)
+        if not agc and gain is not None and self.tuning.get("gain") != gain:
+            self.device.setGain(rx, 0, gain)
+        self.tuning = {
+            "sample_rate": sample_rate,
+            "center_freq": center_freq,
+            "agc": agc,
+            "gain": gain,
+        }
+
+    def start(self):
+        self.device.activateStream(self.stream)
+
+    def read(self, buffer):
+        result = self.device.readStream(
+            self.stream, [buffer], len(buffer) // 2, timeoutUs=READ_TIMEOUT_US
+        )
+        # samples were dropped or late, but the stream is still running.
+        if result.ret == self.soapy.SOAPY_SDR_OVERFLOW:
+            self.overflows += 1
+            logging.warning("readStream overflow (%u so far)", self.overflows)
+            return 0
+        if result.ret == self.soapy.SOAPY_SDR_TIMEOUT:
+            self.timeouts += 1
+            logging.warning("readStream timeout (%u so far)", self.timeouts)
+            return 0
+        if result.ret < 0:
+            raise IOError(f"readStream failed: {self.soapy.errToStr(result.ret)}")
+        return result.ret
+
+    def stop(self):
+        self.device.deactivateStream(self.stream)
+
+    def close(self):
+        self.device.closeStream(self.stream)
+
+
+def get_source(sdr):
+    url = urlparse(sdr)
+    if url.scheme == "file":
+        return FileSource(url.path)
+    return SoapySource(sdr)
+
+
+def compress_chunks(filename, chunks, zst_frame_bytes, compression, results):
+    chunk = True
+    try:
+        writer = compression.writer(filename, zst_frame_bytes)
+        try:
+            while chunk is not None:
+                chunk = chunks.get()
+                if chunk is not None:
+                    writer.write(chunk)
+        finally:
+            results["compression"] = writer.close()
+    except (OSError, zstandard.ZstdError) as err:
+        results["error"] = err
+        # keep draining, so the capture is never blocked.
+        while chunk is not None:
+            chunk = chunks.get()
+
+
+def capture(source, request):
+    """Record a request's samples to its file, returning the number of samples
+    and compression stats."""
+    count = int(request["count"])
+    compression = CompressionOptions.from_request(request)
+    source.tune(
+        float(request["freq"]),
+        float(request["rate"]),
+        request.get("gain", None),
+        bool(request.get("agc", False)),
+    )
+    chunks = queue.Queue(COMPRESS_QUEUE_CHUNKS)
+    results = {}
+    compress_thread = threading.Thread(
+        target=compress_chunks,
+        args=(
+            request["file"],
+            chunks,
+            int(request.get("zst_frame_bytes", 0)),
+            compression,
+            results,
+        ),
+    )
+    compress_thread.start()
+    remaining = count
+    try:
+        source.start()
+        try:
+            while remaining and "error" not in results:
+                buffer = np.empty(
+                    min(remaining, CAPTURE_CHUNK_SAMPLES) * 2, dtype=np.int16
+                )
+                samples = source.read(buffer)
+                chunks.put(memoryview(buffer[: samples * 2]).cast("B"))
+                remaining -= samples
+        finally:
+            source.stop()
+    finally:
+        chunks.put(None)
+        compress_thread.join()
+    if "error" in results:
+        raise results["error"]
+    return (count - remaining, results["compression"])
+
+
+def reply(status):
+    print(json.dumps(status), flush=True)
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(
+        description="record from an SDR held open, for requests on stdin"
+    )
+    parser.add_argument(
+        "--sdr",
+        required=True,
+        type=str,
+        help="SoapySDR driver (e.g. bladerf, lime), or file:<path> to read samples from a file",
+    )
+    return parser
+
+
+def main():
+    args = argument_parser().parse_args()
+    try:
+        source = get_source(args.sdr)
+    except Exception as err:  # pylint: disable=broad-except
+        reply({"last_error": f"cannot open {args.sdr}: {err}"})
+        return 1
+    reply({"last_error": ""})
+    try:
+        for line in sys.stdin:
+            try:
+                request = json.loads(line)
+                samples, compression_stats = capture(source, request)
+            except (KeyError, ValueError, TypeError, OSError, RuntimeError) as err:
+                reply({"last_error": str(err)})
+                continue
+            reply(
+                {
+                    "last_error": "",
+                    "samples": samples,
+                    "compression": compression_stats,
+                }
+            )
+    finally:
+        source.close()
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,105 @@
+import time
+
+import zstandard
+
+from gamutrf.seekable_zstd import SeekableZstdWriter
+from gamutrf.seekable_zstd import zst_index_file
+
+CODECS = ("zstd", "none")
+ZST_LEVEL = 1
+
+
+class CompressionOptions:
+    """How recordings are compressed: with zstd at level, using threads
+    worker threads (0 for none) and optionally long distance matching, or
+    not at all (codec "none")."""
+
+    def __init__(self, codec="zstd", level=ZST_LEVEL, threads=0, long_distance=False):
+        if codec not in CODECS:
+            raise ValueError(f"unknown codec {codec}, must be one of {CODECS}")
+        self.codec = codec
+        self.level = level
+        self.threads = threads
+        self.long_distance = long_distance
+
+    @classmethod
+    def from_request(cls, request):
+        return cls(
+            codec=request.get("codec", "zstd"),
+            level=int(request.get("zst_level", ZST_LEVEL)),
+            threads=int(request.get("zst_threads", 0)),
+            long_distance=bool(request.get("zst_long", False)),
+        )
+
+    def request(self):
+        return {
+            "codec": self.codec,
+            "zst_level": self.level,
+            "zst_threads": self.threads,
+            "zst_long": self.long_distance,
+        }
+
+    def ext(self):
+        if self.codec == "zstd":
+            return ".zst"
+        return ""
+
+    def compressor(self):
+        params = zstandard.ZstdCompressionParameters.from_level(
+            self.level,
+            threads=self.threads,
+            enable_ldm=self.long_distance,
+            write_checksum=True,
+            write_content_size=True,
+        )
+        return zstandard.ZstdCompressor(compression_params=params)
+
+    def writer(self, filename, frame_bytes=0):
+        return RecordingWriter(filename, self, frame_bytes)
+
+
+class RecordingWriter:
+    """Write a recording's samples to a file, compressed as set by options
+    (in seekable frames of frame_bytes, if set)."""
+
+    def __init__(self, filename, options, frame_bytes=0):
+        self.filename = filename
+        self.outfile = open(filename, "wb")
+        self.raw_bytes = 0
+        self.seconds = 0
+        self.seekable = None
+        if options.codec == "none":
+            self.writer = self.outfile
+        elif frame_bytes:
+            self.seekable = SeekableZstdWriter(
+                self.outfile, frame_bytes, compressor=options.compressor()
+            )
+            self.writer = self.seekable
+        else:
+            self.writer = options.compressor().stream_writer(
+                self.outfile, closefd=False
+            )
+
+    def write(self, data):
+        data = memoryview(data).cast("B")
+        start_time = time.perf_counter()
+        self.writer.write(data)
+        self.seconds += time.perf_counter() - start_time
+        self.raw_bytes += len(data)
+
+    def close(self):
+        """Finish writing, returning stats for the recording."""
+        start_time = time.perf_counter()
+        if self.seekable is not None:
+            self.seekable.flush()
+            self.seekable.write_index(zst_index_file(self.filename))
+        elif self.writer is not self.outfile:
+            self.writer.close()
+        compressed_bytes = self.outfile.tell()
+        self.outfile.close()
+        self.seconds += time.perf_counter() - start_time
+        return {
+            "raw_bytes": self.raw_bytes,
+            "compressed_bytes": compressed_bytes,
+            "seconds": self.seconds,
+        }
@@ -0,0 +1,277 @@
+#!/usr/bin/python3
+import collections
+import json
+import logging
+
+import numpy as np
+import pandas as pd
+
+from gamutrf.utils import SCAN_FRES
+
+FFT_COLS = ["ts", "freq", "db", "sweep_start"]
+RUNNING_FFT_MAX_SLOTS = 64
+
+
+def fft_df(ts, freq, db, sweep_start):
+    """Wrap FFT columns in a DataFrame without copying them."""
+    return pd.DataFrame(
+        {"ts": ts, "freq": freq, "db": db, "sweep_start": sweep_start}, copy=False
+    )
+
+
+def decode_json_lines(lines):
+    """Decode scanner JSON FFT lines straight into column arrays.
+
+    Each line's buckets (a dict of frequency string to dB) are copied into
+    arrays preallocated for the whole batch, rather than one dict per bucket.
+
+    Args:
+        lines: list of str, JSON FFT lines as published by the scanner.
+    Returns:
+        (pandas.DataFrame with FFT_COLS columns, scan config of last line).
+    """
+    records = [json.loads(line) for line in lines]
+    total = sum(len(record["buckets"]) for record in records)
+    ts = np.empty(total, dtype=np.float64)
+    freq = np.empty(total, dtype=np.float64)
+    db = np.empty(total, dtype=np.float32)
+    sweep_start = np.empty(total, dtype=np.float64)
+    scan_config = None
+    pos = 0
+    for record in records:
+        buckets = record["buckets"]
+        count = len(buckets)
+        end = pos + count
+        ts[pos:end] = float(record["ts"])
+        sweep_start[pos:end] = float(record["sweep_start"])
+        freq[pos:end] = np.fromiter(buckets.keys(), dtype=np.float64, count=count)
+        db[pos:end] = np.fromiter(buckets.values(), dtype=np.float32, count=count)
+        scan_config = record["config"]
+        pos = end
+    return (fft_df(ts, freq, db, sweep_start), scan_config)
+
+
+class FFTFrameAccumulator:
+    """Accumulate FFT buckets for one sweep into a fixed grid of SCAN_FRES slots.
+
+    The grid spans the scan config's freq_start to freq_end, so memory is
+    bounded by the grid size, and each chunk costs time proportional to
+    the frequency span it covers rather than the size of the frame so far.
+    """
+
+    def __init__(self, fres=SCAN_FRES):
+        self.fres = fres
+        self.grid = None
+        self.grid_start = 0
+        self.db_sum = None
+        self.db_count = None
+        self.ts = None
+        self.sweep_start = None
+        self.out_of_range = 0
+        self.late = 0
+
+    def reset_grid(self, freq_start, freq_end):
+        self.grid = (freq_start, freq_end)
+        self.grid_start = int(round(freq_start / self.fres))
+        slots = int(round(freq_end / self.fres)) - self.grid_start + 1
+        self.db_sum = np.zeros(slots, dtype=np.float64)
+        self.db_count = np.zeros(slots, dtype=np.int64)
+        self.ts = np.zeros(slots, dtype=np.float64)
+        self.sweep_start = None
+
+    def frame(self):
+        """Return the current sweep as a frame (or None if empty) and clear the grid."""
+        slots = np.flatnonzero(self.db_count)
+        frame_df = None
+        if len(slots):
+            frame_df = fft_df(
+                self.ts[slots],
+                (slots + self.grid_start) * self.fres,
+                self.db_sum[slots] / self.db_count[slots],
+                np.full(len(slots), self.sweep_start),
+            )
+        self.db_sum.fill(0)
+        self.db_count.fill(0)
+        self.ts.fill(0)
+        return frame_df
+
+    def add_sweep(self, ts, freq, db):
+        slots = np.rint(freq / self.fres).astype(np.int64) - self.grid_start
+        in_range = (slots >= 0) & (slots < len(self.db_count))
+        if not in_range.all():
+            self.out_of_range += len(slots) - np.count_nonzero(in_range)
+            slots = slots[in_range]
+            ts = ts[in_range]
+            db = db[in_range]
+        if not len(slots):
+            return
+        slot_min = slots.min()
+        span_slots = slots - slot_min
+        span = span_slots.max() + 1
+        window = slice(slot_min, slot_min + span)
+        self.db_sum[window] += np.bincount(span_slots, weights=db, minlength=span)
+        self.db_count[window] += np.bincount(span_slots, minlength=span)
+        self.ts[slots] = ts
+
+    def add(self, df, scan_config):
+        """Add a chunk of FFT buckets.
+
+        Args:
+            df: pandas.DataFrame with FFT_COLS columns.
+            scan_config: dict, scan config including freq_start and freq_end.
+        Returns:
+            list of frame DataFrames, for sweeps this chunk completed.
+        """
+        frames = []
+        grid = (scan_config["freq_start"], scan_config["freq_end"])
+        if grid != self.grid:
+            if self.sweep_start is not None:
+                logging.info("scan config changed, dropping partial sweep")
+            self.reset_grid(*grid)
+        ts = df["ts"].to_numpy()
+        freq = df["freq"].to_numpy()
+        db = df["db"].to_numpy()
+        sweep_starts = df["sweep_start"].to_numpy()
+        chunk_sweep_starts = np.unique(sweep_starts)
+        for sweep_start in chunk_sweep_starts:
+            if self.sweep_start is not None and sweep_start < self.sweep_start:
+                self.late += np.count_nonzero(sweep_starts == sweep_start)
+                continue
+            if self.sweep_start is not None and sweep_start != self.sweep_start:
+                frame_df = self.frame()
+                if frame_df is not None:
+                    frames.append(frame_df)
+            self.sweep_start = sweep_start
+            if len(chunk_sweep_starts) == 1:
+                self.add_sweep(ts, freq, db)
+            else:
+                rows = sweep_starts == sweep_start
+                self.add_sweep(ts[rows], freq[rows], db[rows])
+        return frames
+
+
+def resample_fft(df, fres=SCAN_FRES):
+    """Resample FFT buckets to fres bins in one pass.
+
+    Equivalent to rounding freq to fres, averaging dB per bin and keeping
+    the first row of every other column per bin, sorted by frequency.
+
+    Args:
+        df: pandas.DataFrame with at least freq (Hz) and db columns.
+        fres: float, resolution to resample to in Hz.
+    Returns:
+        pandas.DataFrame with freq (MHz) first, then the other columns of df.
+    """
+    freq_bins = np.rint(df["freq"].to_numpy() / fres).astype(np.int64)
+    bin_min = freq_bins.min()
+    bins = freq_bins - bin_min
+    db_count = np.bincount(bins)
+    db_sum = np.bincount(bins, weights=df["db"].to_numpy())
+    occupied = np.flatnonzero(db_count)
+    rows = np.arange(len(bins))
+    # where a bin has duplicate rows, the last assignment (the first row) wins.
+    first_rows = np.empty(len(db_count), dtype=np.int64)
+    first_rows[bins[::-1]] = rows[::-1]
+    first_rows = first_rows[occupied]
+    cols = {"freq": (occupied + bin_min) * fres / 1e6}
+    for col in df.columns:
+        if col == "freq":
+            continue
+        if col == "db":
+            cols[col] = db_sum[occupied] / db_count[occupied]
+        else:
+            cols[col] = df[col].to_numpy()[first_rows]
+    return pd.DataFrame(cols, copy=False)
+
+
+class RunningFFTMean:
+    """Running mean of resampled FFT frames over a time window.
+
+    Each frame (sweep) occupies one slot holding its dB per SCAN_FRES bin.
+    Per-bin sums and counts over all live slots are kept up to date, so
+    adding a frame or expiring an old one costs O(bins), and memory is
+    bounded by bins * max_slots (if max_slots is not 0). If sweeps are so
+    fast that the window holds more than max_slots, the mean is over only
+    the last max_slots sweeps.
+    """
+
+    def __init__(self, window_secs, max_slots=RUNNING_FFT_MAX_SLOTS, fres=SCAN_FRES):
+        self.window_secs = window_secs
+        self.max_slots = max_slots
+        self.fres = fres
+        self.truncated = False
+        self.grid = None
+        self.grid_start = 0
+        self.slots = collections.deque()
+        self.db_sum = None
+        self.db_count = None
+
+    def reset_grid(self, freq_start, freq_end):
+        self.grid = (freq_start, freq_end)
+        self.grid_start = int(round(freq_start / self.fres))
+        bins = int(round(freq_end / self.fres)) - self.grid_start + 1
+        self.slots.clear()
+        self.truncated = False
+        self.db_sum = np.zeros(bins, dtype=np.float64)
+        self.db_count = np.zeros(bins, dtype=np.int64)
+
+    def expire_slot(self):
+        _, slot_db = self.slots.popleft()
+        present = ~np.isnan(slot_db)
+        self.db_sum[present] -= slot_db[present]
+        self.db_count -= present
+        return slot_db
+
+    def add(self, df, scan_config):
+        """Add a frame, and expire frames older than the window.
+
+        Args:
+            df: pandas.DataFrame with ts, freq (MHz, resampled to fres) and db columns.
+            scan_config: dict, scan config including freq_start and freq_end.
+        """
+        grid = (scan_config["freq_start"], scan_config["freq_end"])
+        if grid != self.grid:
+            self.reset_grid(*grid)
+        now = df["ts"].max()
+        slot_db = None
+        while self.slots and self.slots[0][0] < now - self.window_secs:
+            slot_db = self.expire_slot()
+        if self.max_slots and len(self.slots) >= self.max_slots:
+            if not self.truncated:
+                self.truncated = True
+                logging.warning(
+                    "running FFT mean limited to %u sweeps (%.1fs, not %.1fs)",
+                    self.max_slots,
+                    now - self.slots[0][0],
+                    self.window_secs,
+                )
+            while len(self.slots) >= self.max_slots:
+                slot_db = self.expire_slot()
+        if slot_db is None:
+            slot_db = np.empty(len(self.db_sum), dtype=np.float32)
+        slot_db.fill(np.nan)
+        bins = np.rint(df["freq"].to_numpy() * 1e6 / self.fres).astype(np.int64)
+        bins -= self.grid_start
+        in_range = (bins >= 0) & (bins < len(slot_db))
+        db = df["db"].to_numpy()[in_range]
+        bins = bins[in_range]
+        present = ~np.isnan(db)
+        bins = bins[present]
+        slot_db[bins] = db[present]
+        # take the dB actually stored, in case of duplicate bins.
+        self.db_sum[bins] += slot_db[bins]
+        self.db_count[bins] += 1
+        self.slots.append((now, slot_db))
+
+    def mean(self):
+        """Return the running mean as a DataFrame of freq (MHz) and db columns."""
+        if self.db_count is None:
+            return pd.DataFrame({"freq": [], "db": []})
+        bins = np.flatnonzero(self.db_count)
+        return pd.DataFrame(
+            {
+                "freq": (bins + self.grid_start) * self.fres / 1e6,
+                "db": self.db_sum[bins] / self.db_count[bins],
+            },
+            copy=False,
+        )
@@ -0,0 +1,287 @@
+import collections
+import concurrent.futures
+import json
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from gamutrf.sigwindows import FreqExclusions
+
+RECORDER_CONNECT_TIMEOUT = 1
+RECORDER_INFO_TTL = 60
+RECORDER_QSIZE = 2
+RECORDER_OUTCOMES = 20
+RECORDER_LATENCY_ALPHA = 0.2
+# Recorders with latencies this close are ranked equally.
+RECORDER_LATENCY_BUCKET = 0.1
+# api.Record's status when its request queue is full (other 400 responses
+# are validation failures, which say nothing about how busy a recorder is).
+RECORDER_QUEUE_FULL = "Request queue is full"
+
+
+class RecorderState:
+    """What sigfinder knows about one recorder: recordings it has accepted
+    that have not yet completed, and its recent request outcomes and latency."""
+
+    def __init__(self, slots):
+        self.slots = slots
+        self.in_flight = collections.deque()
+        self.outcomes = collections.deque(maxlen=RECORDER_OUTCOMES)
+        self.latency = 0
+
+    def expire(self, now):
+        while self.in_flight and self.in_flight[0] <= now:
+            self.in_flight.popleft()
+
+    def free(self, now):
+        self.expire(now)
+        return max(self.slots - len(self.in_flight), 0)
+
+    def failure_rate(self):
+        if not self.outcomes:
+            return 0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def add_outcome(self, ok, latency):
+        self.outcomes.append(ok)
+        self.latency += RECORDER_LATENCY_ALPHA * (latency - self.latency)
+
+    def add_recording(self, now, duration):
+        """Reserve a slot, returning when the recording should complete."""
+        # Recorders process their queue serially, so a new recording completes
+        # one duration after the last recording already accepted.
+        start = now
+        if self.in_flight:
+            start = max(now, self.in_flight[-1])
+        self.in_flight.append(start + duration)
+        return self.in_flight[-1]
+
+    def remove_recording(self, token):
+        try:
+            self.in_flight.remove(token)
+        except ValueError:
+            # already expired.
+            pass
+
+    def fill(self, now, duration):
+        # The recorder rejected a request, so assume it is busy for at least
+        # another recording.
+        self.expire(now)
+        while len(self.in_flight) < self.slots:
+            self.add_recording(now, duration)
+
+
+class RecorderStateTable:
+    """Live state of all recorders, used to assign signals to recorders
+    that can take them."""
+
+    def __init__(self, recorders, qsize=RECORDER_QSIZE):
+        # A recorder runs one recording while up to qsize more are queued.
+        self.states = {recorder: RecorderState(qsize + 1) for recorder in recorders}
+        self.lock = threading.Lock()
+
+    def free(self, now=None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            return {
+                recorder: state.free(now) for recorder, state in self.states.items()
+            }
+
+    def rank(self):
+        """Sort key per recorder: least failing, then least busy, then fastest."""
+        now = time.time()
+        with self.lock:
+            return {
+                recorder: (
+                    round(state.failure_rate(), 1),
+                    state.slots - state.free(now),
+                    round(state.latency / RECORDER_LATENCY_BUCKET),
+                )
+                for recorder, state in self.states.items()
+            }
+
+    def in_flight(self, recorder):
+        with self.lock:
+            state = self.states[recorder]
+            state.expire(time.time())
+            return len(state.in_flight)
+
+    def failure_rate(self, recorder):
+        with self.lock:
+            return self.states[recorder].failure_rate()
+
+    def record_requested(self, recorder, duration, now=None):
+        """Reserve a slot for a request, returning a token for record_response()."""
+        if now is None:
+            now = time.time()
+        with self.lock:
+            return self.states[recorder].add_recording(now, duration)
+
+    def record_response(
+        self, recorder, ok, latency, duration, token=None, rejected=False
+    ):
+        now = time.time()
+        with self.lock:
+            state = self.states[recorder]
+            state.add_outcome(ok, latency)
+            if ok:
+                return
+            # Forget the optimistic reservation for the failed request.
+            if token is not None:
+                state.remove_recording(token)
+            if rejected:
+                state.fill(now, duration)
+
+
+class RecorderDispatcher:
+    """Send info and record requests to recorders concurrently.
+
+    Requests share a pooled HTTP session and run on a thread pool, so one
+    slow or dead recorder cannot stall the caller. Each recorder's frequency
+    exclusions are cached for info_ttl seconds (including a failure to fetch
+    them, so a dead recorder is only retried once the TTL expires).
+    """
+
+    def __init__(
+        self,
+        recorders,
+        prom_vars,
+        connect_timeout=RECORDER_CONNECT_TIMEOUT,
+        read_timeout=RECORDER_CONNECT_TIMEOUT,
+        info_ttl=RECORDER_INFO_TTL,
+        qsize=RECORDER_QSIZE,
+    ):
+        self.recorders = recorders
+        self.recorder_states = RecorderStateTable(recorders, qsize)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.info_ttl = info_ttl
+        self.request_latency = prom_vars["recorder_request_latency"]
+        self.request_failures = prom_vars["recorder_request_failures"]
+        self.worker_record_request = prom_vars["worker_record_request"]
+        self.recorder_in_flight = prom_vars["recorder_in_flight"]
+        pool_size = max(len(recorders), 1) * 2
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = concurrent.futures.ThreadPoolExecutor(pool_size)
+        self.info_cache = {}
+        self.info_lock = threading.Lock()
+
+    def request(self, recorder, recorder_args, read_timeout=None):
+        if read_timeout is None:
+            read_timeout = self.read_timeout
+        request_type = recorder_args.split("/")[0]
+        url = f"{recorder}/v1/{recorder_args}"
+        start_time = time.time()
+        try:
+            resp = self.session.get(url, timeout=(self.connect_timeout, read_timeout))
+            logging.debug(str(resp))
+        except requests.exceptions.RequestException as err:
+            logging.debug(str(err))
+            resp = None
+        self.request_latency.labels(worker=recorder, request=request_type).observe(
+            time.time() - start_time
+        )
+        if not resp:
+            self.request_failures.labels(worker=recorder, request=request_type).inc()
+        return resp
+
+    def _fetch_freq_excluded(self, recorder):
+        resp = self.request(recorder, "info")
+        if resp is None or resp.status_code != 200:
+            return None
+        try:
+            excluded = json.loads(resp.text).get("freq_excluded", None)
+        except ValueError as err:
+            logging.error("invalid info from %s: %s", recorder, err)
+            return None
+        if excluded is None:
+            return None
+        try:
+            return FreqExclusions.parse(excluded)
+        except ValueError as err:
+            logging.error("invalid freq_excluded from %s: %s", recorder, err)
+            return None
+
+    def freq_exclusions(self):
+        """Return {recorder: exclusions} for recorders whose info is known."""
+        now = time.time()
+        with self.info_lock:
+            stale = [
+                recorder
+                for recorder in self.recorders
+                if now - self.info_cache.get(recorder, (0, None))[0] > self.info_ttl
+            ]
+        futures = {
+            self.executor.submit(self._fetch_freq_excluded, recorder): recorder
+            for recorder in stale
+        }
+        for future in concurrent.futures.as_completed(futures):
+            with self.info_lock:
+                self.info_cache[futures[future]] = (now, future.result())
+        with self.info_lock:
+            return {
+                recorder: excluded
+                for recorder, (_, excluded) in self.info_cache.items()
+                if excluded is not None and recorder in self.recorders
+            }
+
+    def invalidate(self, recorder):
+        with self.info_lock:
+            self.info_cache.pop(recorder, None)
+
+    @staticmethod
+    def queue_full(resp):
+        if resp is None or resp:
+            return False
+        try:
+            return json.loads(resp.text).get("status", None) == RECORDER_QUEUE_FULL
+        except (ValueError, AttributeError):
+            return False
+
+    def _record(
+        self, recorder, recorder_args, signal_hz, duration, token, read_timeout
+    ):
+        start_time = time.time()
+        resp = self.request(recorder, recorder_args, read_timeout)
+        self.recorder_states.record_response(
+            recorder,
+            bool(resp),
+            time.time() - start_time,
+            duration,
+            token=token,
+            rejected=self.queue_full(resp),
+        )
+        self.recorder_in_flight.labels(worker=recorder).set(
+            self.recorder_states.in_flight(recorder)
+        )
+        if resp:
+            self.worker_record_request.labels(worker=recorder).set(signal_hz)
+        elif resp is None:
+            self.invalidate(recorder)
+        return resp
+
+    def record(self, recorder, signal_hz, record_samples, record_bps, read_timeout):
+        """Request a recording without waiting for the recorder to respond."""
+        recorder_args = f"record/{signal_hz}/{record_samples}/{record_bps}"
+        duration = record_samples / record_bps
+        token = self.recorder_states.record_requested(recorder, duration)
+        return self.executor.submit(
+            self._record,
+            recorder,
+            recorder_args,
+            signal_hz,
+            duration,
+            token,
+            read_timeout,
+        )
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
@@ -0,0 +1,257 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import threading
+import time
+
+from gamutrf.utils import is_nondot_file
+
+POLL_INTERVAL = 1
+# Directory mtimes are only updated every clock tick, so a directory modified
+# this recently may have changed again without its mtime changing.
+MTIME_SLACK_NS = int(1e9)
+PROCESSED_INDEX = ".processed_recordings"
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+INOTIFY_EVENT = struct.Struct("iIII")
+INOTIFY_READ_SIZE = 64 * 1024
+
+
+class Inotify:
+    """Minimal inotify(7) binding (Linux only), via libc."""
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.libc.inotify_add_watch.argtypes = (
+            ctypes.c_int,
+            ctypes.c_char_p,
+            ctypes.c_uint32,
+        )
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+    def add_watch(self, path, mask):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    def read(self, timeout):
+        """Return a list of (wd, mask, name) events, waiting up to timeout seconds."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, INOTIFY_READ_SIZE)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, name_len = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset : offset + name_len].rstrip(b"\0")
+            offset += name_len
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class RecordingWatcher:
+    """Find recordings as they are completed under a directory.
+
+    Recordings are written to a dotfile and renamed when complete, so only
+    non-dot recording files are reported, each once. The first poll()
+    reports existing recordings. After that, inotify reports new ones
+    without listing any directory; where inotify is unavailable, only
+    directories whose mtime has changed are listed.
+    """
+
+    def __init__(self, path, poll_interval=POLL_INTERVAL, use_inotify=True):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.seen = set()
+        self.dir_mtimes = {}
+        self.watches = {}
+        self.scanned = False
+        self.inotify = None
+        if use_inotify:
+            try:
+                self.inotify = Inotify()
+            except (AttributeError, OSError) as err:
+                logging.info("inotify not available (%s), polling %s", err, path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+
+    def _new_file(self, filename):
+        if filename in self.seen or not is_nondot_file(filename):
+            return False
+        self.seen.add(filename)
+        return True
+
+    def _watch(self, dirname):
+        try:
+            wd = self.inotify.add_watch(
+                dirname, IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ONLYDIR
+            )
+        except OSError as err:
+            logging.warning("cannot watch %s: %s", dirname, err)
+            return
+        self.watches[wd] = dirname
+
+    def _scan_dir(self, dirname):
+        """List a directory (and any new subdirectories) for new recordings."""
+        if self.inotify is not None:
+            # watch before listing, so no recording can be missed in between.
+            self._watch(dirname)
+        try:
+            self.dir_mtimes[dirname] = os.stat(dirname).st_mtime_ns
+            entries = list(os.scandir(dirname))
+        except OSError:
+            self.dir_mtimes.pop(dirname, None)
+            return []
+        recordings = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.path not in self.dir_mtimes:
+                    recordings.extend(self._scan_dir(entry.path))
+            elif self._new_file(entry.path):
+                recordings.append(entry.path)
+        return recordings
+
+    def _scan(self):
+        self.scanned = True
+        return self._scan_dir(self.path)
+
+    def _poll_dirs(self, timeout):
+        time.sleep(timeout)
+        recordings = []
+        for dirname, mtime in list(self.dir_mtimes.items()):
+            try:
+                changed = (
+                    os.stat(dirname).st_mtime_ns != mtime
+                    or time.time_ns() - mtime < MTIME_SLACK_NS
+                )
+            except OSError:
+                del self.dir_mtimes[dirname]
+                continue
+            if changed:
+                recordings.extend(self._scan_dir(dirname))
+        return recordings
+
+    def _read_events(self, timeout):
+        recordings = []
+        for wd, mask, name in self.inotify.read(timeout):
+            if mask & IN_Q_OVERFLOW:
+                # events were lost, so fall back to listing everything once.
+                logging.warning("inotify queue overflow, rescanning %s", self.path)
+                self.dir_mtimes = {}
+                recordings.extend(self._scan())
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            dirname = self.watches.get(wd, None)
+            if dirname is None or not name:
+                continue
+            filename = os.path.join(dirname, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    recordings.extend(self._scan_dir(filename))
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and self._new_file(filename):
+                recordings.append(filename)
+        return recordings
+
+    def poll(self, timeout=None):
+        """Return recordings completed since the last poll, waiting up to timeout seconds."""
+        if not self.scanned:
+            return self._scan()
+        if timeout is None:
+            timeout = self.poll_interval
+        if self.inotify is not None:
+            return self._read_events(timeout)
+        return self._poll_dirs(timeout)
+
+
+class ProcessedIndex:
+    """Persistent set of recordings already processed, one path per line
+    (relative to the watched directory), so a restart need not reprocess them."""
+
+    def __init__(self, index_file, root):
+        self.index_file = index_file
+        self.root = root
+        self.processed = set()
+        self.lock = threading.Lock()
+        if os.path.exists(index_file):
+            with open(index_file, "rb") as f:
+                data = f.read()
+            # drop a partial last line, from an interrupted write.
+            complete = data.rfind(b"\n") + 1
+            if complete < len(data):
+                os.truncate(index_file, complete)
+            self.processed = set(data[:complete].decode("utf8").splitlines())
+        self.outfile = open(index_file, "a", encoding="utf8")
+
+    def _key(self, recording):
+        return os.path.relpath(recording, self.root)
+
+    def __contains__(self, recording):
+        with self.lock:
+            return self._key(recording) in self.processed
+
+    def __len__(self):
+        with self.lock:
+            return len(self.processed)
+
+    def add(self, recording):
+        key = self._key(recording)
+        with self.lock:
+            if key in self.processed:
+                return
+            self.processed.add(key)
+            self.outfile.write(key + "\n")
+            self.outfile.flush()
+
+    def retain(self, recordings):
+        """Forget processed recordings not in recordings (e.g. deleted since)."""
+        keys = {self._key(recording) for recording in recordings}
+        with self.lock:
+            if self.processed <= keys:
+                return
+            self.processed &= keys
+            self.outfile.close()
+            tmp_file = os.path.join(
+                os.path.dirname(self.index_file),
+                "." + os.path.basename(self.index_file) + ".tmp",
+            )
+            with open(tmp_file, "w", encoding="utf8") as f:
+                f.writelines(key + "\n" for key in sorted(self.processed))
+            os.replace(tmp_file, self.index_file)
+            self.outfile = open(self.index_file, "a", encoding="utf8")
+
+    def close(self):
+        with self.lock:
+            self.outfile.close()
@@ -1,9 +1,18 @@
 #!/usr/bin/env python3
 
 import gzip
+import mmap
+import os
+import queue
+import threading
 import zstandard
 import numpy as np
 
+from gamutrf.seekable_zstd import read_zst_index
+from gamutrf.seekable_zstd import SeekableZstdReader
+
+READ_AHEAD_BUFFERS = 2
+
 
 def get_reader(filename):
     # nosemgrep:github.workflows.config.useless-inner-function
@@ -22,11 +31,169 @@ def get_reader(filename):
     if filename.endswith(".gz"):
         return gzip_reader
     if filename.endswith(".zst"):
+        zst_index = read_zst_index(filename)
+        if zst_index is not None:
+            return lambda x: SeekableZstdReader(x, zst_index)
         return zst_reader
 
     return default_reader
 
 
+def readinto_full(infile, buf):
+    """Fill buf from infile, unless EOF is reached, returning the number of bytes read."""
+    view = memoryview(buf)
+    read = 0
+    while read < len(view):
+        count = infile.readinto(view[read:])
+        if not count:
+            break
+        read += count
+    return read
+
+
+class ReadAhead:
+    """Read (and decompress) a recording in chunks on background threads.
+
+    Each worker owns READ_AHEAD_BUFFERS reusable buffers, so memory use is
+    bounded and no buffers are allocated per chunk. Chunks are returned in
+    order, as memoryviews that are only valid until the next chunk is
+    requested. Seekable recordings can be read by several workers, each
+    reading every workers'th chunk; other recordings use one worker.
+    """
+
+    def __init__(self, filename, read_size, skip_bytes=0, max_bytes=0, workers=1):
+        self.filename = filename
+        self.reader = get_reader(filename)
+        self.read_size = read_size
+        self.skip_bytes = skip_bytes
+        self.max_bytes = max_bytes
+        if read_zst_index(filename) is None and filename.endswith(".zst"):
+            workers = 1
+        elif filename.endswith(".gz"):
+            workers = 1
+        self.workers = max(workers, 1)
+        self.stop_event = threading.Event()
+        self.free_queues = []
+        self.filled_queues = []
+        self.threads = []
+
+    def __enter__(self):
+        for i in range(self.workers):
+            free_queue = queue.Queue()
+            for _ in range(READ_AHEAD_BUFFERS):
+                free_queue.put(bytearray(self.read_size))
+            filled_queue = queue.Queue()
+            thread = threading.Thread(
+                target=self.read_worker, args=(i, free_queue, filled_queue)
+            )
+            self.free_queues.append(free_queue)
+            self.filled_queues.append(filled_queue)
+            self.threads.append(thread)
+            thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop_event.set()
+        for free_queue in self.free_queues:
+            free_queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def read_worker(self, i, free_queue, filled_queue):
+        try:
+            with self.reader(self.filename) as infile:
+                offset = self.skip_bytes + i * self.read_size
+                end = None
+                if self.max_bytes:
+                    end = self.skip_bytes + self.max_bytes
+                if offset:
+                    infile.seek(offset)
+                while not self.stop_event.is_set():
+                    size = self.read_size
+                    if end is not None:
+                        size = min(size, end - offset)
+                    if size <= 0:
+                        break
+                    buf = free_queue.get()
+                    if buf is None:
+                        break
+                    if self.workers > 1:
+                        infile.seek(offset)
+                    count = readinto_full(infile, memoryview(buf)[:size])
+                    filled_queue.put((buf, count))
+                    if count < size:
+                        break
+                    offset += self.workers * self.read_size
+        except Exception as err:  # pylint: disable=broad-except
+            filled_queue.put((err, 0))
+            return
+        filled_queue.put((None, 0))
+
+    def __iter__(self):
+        chunk = 0
+        while True:
+            i = chunk % self.workers
+            buf, count = self.filled_queues[i].get()
+            if isinstance(buf, Exception):
+                raise buf
+            if buf is None or not count:
+                return
+            yield memoryview(buf)[:count]
+            self.free_queues[i].put(buf)
+            chunk += 1
+
+
+def is_compressed(filename):
+    return filename.endswith(".gz") or filename.endswith(".zst")
+
+
+def iq_to_complex(x1d, out=None):
+    """Convert interleaved I/Q samples to csingles, without temporary arrays.
+
+    Args:
+        x1d: numpy array of sample_dtype (with i and q fields).
+        out: optional numpy array of csingles to convert into (at least as long as x1d).
+    Returns:
+        numpy array of csingles.
+    """
+    if out is None:
+        out = np.empty(len(x1d), dtype=np.csingle)
+    else:
+        out = out[: len(x1d)]
+    out.real = x1d["i"]
+    out.imag = x1d["q"]
+    return out
+
+
+def read_mmap_recording(
+    filename, sample_dtype, chunk_samples, skip_samples, max_samples, reuse_buffer
+):
+    """Iterate over an uncompressed recording via mmap, converting views over the file."""
+    if os.path.getsize(filename) < sample_dtype.itemsize:
+        return
+    with open(filename, "rb") as infile:
+        with mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            samples = np.frombuffer(
+                mm, dtype=sample_dtype, count=len(mm) // sample_dtype.itemsize
+            )
+            try:
+                end = len(samples)
+                if max_samples:
+                    end = min(end, skip_samples + max_samples)
+                out = None
+                if reuse_buffer:
+                    out = np.empty(chunk_samples, dtype=np.csingle)
+                for offset in range(skip_samples, end, chunk_samples):
+                    yield iq_to_complex(
+                        samples[offset : min(offset + chunk_samples, end)], out
+                    )
+            finally:
+                # release the view, so the mmap can be closed.
+                del samples
+
+
 def read_recording(
     filename,
     sample_rate,
@@ -35,6 +202,8 @@ def read_recording(
     sample_secs=1.0,
     skip_sample_secs=0,
     max_sample_secs=0,
+    reuse_buffer=False,
+    read_ahead_workers=1,
 ):
     """Read an I/Q recording and iterate over it, returning 1-D numpy arrays of csingles, of size sample_rate * sample_secs.
 
@@ -46,31 +215,41 @@ def read_recording(
         sample_secs: float, number of seconds worth of samples per iteration.
         skip_sample_secs: float, number of seconds worth of samples to skip initially.
         max_sample_secs: float, maximum number of seconds of samples to read (or None for all).
+        reuse_buffer: bool, if True, each iteration overwrites the array returned by the previous one.
+        read_ahead_workers: int, number of threads decompressing ahead (only seekable zst recordings can use more than one).
     Returns:
         numpy arrays of csingles.
     """
+    if not is_compressed(filename):
+        yield from read_mmap_recording(
+            filename,
+            sample_dtype,
+            int(sample_rate * sample_secs),
+            int(sample_rate * skip_sample_secs),
+            int(sample_rate * max_sample_secs) if max_sample_secs else 0,
+            reuse_buffer,
+        )
+        return
     read_size = int(sample_rate * sample_secs) * sample_len
-    reader = get_reader(filename)
-    samples_remaining = 0
+    max_bytes = 0
     if max_sample_secs:
-        samples_remaining = int(sample_rate * max_sample_secs)
-    with reader(filename) as infile:
-        if skip_sample_secs:
-            infile.seek(int(sample_rate * skip_sample_secs) * sample_len)
-        while True:
-            if max_sample_secs and not samples_remaining:
-                break
-            sample_buffer = infile.read(read_size)
-            buffered_samples = int(len(sample_buffer) / sample_len)
-            if buffered_samples == 0:
-                break
-            if max_sample_secs:
-                if buffered_samples <= samples_remaining:
-                    samples_remaining -= buffered_samples
-                else:
-                    buffered_samples = samples_remaining
-                    samples_remaining = 0
+        max_bytes = int(sample_rate * max_sample_secs) * sample_len
+    out = None
+    if reuse_buffer:
+        out = np.empty(int(sample_rate * sample_secs), dtype=np.csingle)
+    with ReadAhead(
+        filename,
+        read_size,
+        skip_bytes=int(sample_rate * skip_sample_secs) * sample_len,
+        max_bytes=max_bytes,
+        workers=read_ahead_workers,
+    ) as chunks:
+        for sample_buffer in chunks:
             x1d = np.frombuffer(
-                sample_buffer, dtype=sample_dtype, count=buffered_samples
+                sample_buffer,
+                dtype=sample_dtype,
+                count=len(sample_buffer) // sample_len,
             )
-            yield x1d["i"] + np.csingle(1j) * x1d["q"]
+            if not len(x1d):
+                break
+            yield iq_to_complex(x1d, out)
@@ -3,21 +3,23 @@ import json
 import logging
 import os
 import subprocess
+import sys
 import tempfile
+import threading
 import time
 from urllib.parse import urlparse
 
 import sigmf
 import numpy as np
-import matplotlib
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 
-from gamutrf.sigwindows import freq_excluded
-from gamutrf.sigwindows import parse_freq_excluded
+from gamutrf.compression import CompressionOptions
+from gamutrf.seekable_zstd import zst_index_file
+from gamutrf.sigwindows import FreqExclusions
+from gamutrf.spectrogram_image import write_spectrogram_png
 from gamutrf.utils import (
     ETTUS_ANT,
     ETTUS_ARGS,
-    MPL_BACKEND,
     WIDTH,
     HEIGHT,
     DPI,
@@ -28,9 +30,43 @@ IMSHOW_INTERPOLATION = os.getenv("IMSHOW_INTERPOLATION", "bilinear")
 NFFT = int(os.getenv("NFFT", "0"))
 NFFT_OVERLAP = 512
 SAMPLE_TYPE = "s16"
+SAMPLE_LEN = 4
 MIN_SAMPLE_RATE = int(1e6)
 MAX_SAMPLE_RATE = int(30 * 1e6)
 FFT_FILE = "/dev/shm/fft.dat"  # nosec
+FIFO_READ_BYTES = 2**20
+FFT_CHUNK_FRAMES = 4096
+
+
+def read_fft_columns(fft_file, nfft, max_columns, chunk_frames=FFT_CHUNK_FRAMES):
+    """Return the FFT frames in fft_file as an nfft x columns array.
+
+    Frequencies are rolled so DC is in the middle, and each column is the
+    max of ceil(frames / max_columns) consecutive frames. The file is read
+    chunk_frames at a time, so it need not fit in memory.
+    """
+    frame_count = os.path.getsize(fft_file) // (nfft * np.dtype(np.float32).itemsize)
+    if not frame_count:
+        return None
+    frames = np.memmap(fft_file, dtype=np.float32, mode="r", shape=(frame_count, nfft))
+    pool = -(-frame_count // max_columns)
+    columns = -(-frame_count // pool)
+    chunk_frames = max(chunk_frames // pool, 1) * pool
+    shift = nfft // 2
+    i = np.empty((nfft, columns), dtype=np.float32)
+    for start in range(0, frame_count, chunk_frames):
+        chunk = frames[start : start + chunk_frames]
+        pooled_frames = len(chunk) // pool * pool
+        pooled = chunk[:pooled_frames].reshape(-1, pool, nfft).max(axis=1)
+        if pooled_frames < len(chunk):
+            pooled = np.vstack((pooled, chunk[pooled_frames:].max(axis=0)))
+        column = start // pool
+        chunk_columns = slice(column, column + len(pooled))
+        # equivalent to np.roll(pooled.T, shift, 0), without the copy.
+        i[:shift, chunk_columns] = pooled[:, nfft - shift :].T
+        i[shift:, chunk_columns] = pooled[:, : nfft - shift].T
+    del frames
+    return i
 
 
 class SDRRecorder:
@@ -38,6 +74,8 @@ class SDRRecorder:
         self.tmpdir = tempfile.TemporaryDirectory()
         self.zst_fifo = os.path.join(self.tmpdir.name, "zstfifo")
         os.mkfifo(self.zst_fifo)
+        # stats for the last recording's compression, if known.
+        self.compression_stats = None
 
     @staticmethod
     def validate_request(freqs_excluded, center_freq, sample_count, sample_rate):
@@ -46,7 +84,9 @@ class SDRRecorder:
                 int(float(arg))
             except ValueError:
                 return "Invalid values in request"
-        if freq_excluded(int(center_freq), parse_freq_excluded(freqs_excluded)):
+        if not isinstance(freqs_excluded, FreqExclusions):
+            freqs_excluded = FreqExclusions.parse(freqs_excluded)
+        if freqs_excluded.excluded(int(center_freq)):
             return "Requested frequency is excluded"
         if int(sample_rate) < MIN_SAMPLE_RATE or int(sample_rate) > MAX_SAMPLE_RATE:
             return "sample rate {sample_rate} out of range {MIN_SAMPLE_RATE} to {MAX_SAMPLE_RATE}"
@@ -56,32 +96,85 @@ class SDRRecorder:
         return None
 
     @staticmethod
-    def get_sample_file(path, epoch_time, center_freq, sample_rate, sdr, antenna, gain):
+    def get_sample_file(
+        path, epoch_time, center_freq, sample_rate, sdr, antenna, gain, ext=".zst"
+    ):
         return os.path.join(
             path,
-            f"gamutrf_recording_{sdr}_{antenna}_gain{gain}_{epoch_time}_{int(center_freq)}Hz_{int(sample_rate)}sps.{SAMPLE_TYPE}.zst",
+            f"gamutrf_recording_{sdr}_{antenna}_gain{gain}_{epoch_time}_{int(center_freq)}Hz_{int(sample_rate)}sps.{SAMPLE_TYPE}{ext}",
         )
 
+    @staticmethod
+    def get_image_file(sample_file, ext):
+        if sample_file.endswith(".zst"):
+            sample_file = sample_file[: -len(".zst")]
+        return sample_file + ext
+
     def record_args(
         self, sample_file, sample_rate, sample_count, center_freq, gain, agc, rxb
     ):
         raise NotImplementedError
 
+    def unblock_fifo(self):
+        # If the recorder failed without opening the FIFO, open it
+        # ourselves so the compressor sees EOF.
+        try:
+            os.close(os.open(self.zst_fifo, os.O_WRONLY | os.O_NONBLOCK))
+        except OSError:
+            pass
+
+    def write_fifo(self, writer, errors):
+        try:
+            with open(self.zst_fifo, "rb") as fifo:
+                while True:
+                    data = fifo.read(FIFO_READ_BYTES)
+                    if not data:
+                        break
+                    writer.write(data)
+        except Exception as err:  # pylint: disable=broad-except
+            errors.append(err)
+
     def write_recording(
-        self, sample_file, sample_rate, sample_count, center_freq, gain, agc, rxb
+        self,
+        sample_file,
+        sample_rate,
+        sample_count,
+        center_freq,
+        gain,
+        agc,
+        rxb,
+        zst_frame_secs=0,
+        compression=None,
     ):
+        if compression is None:
+            compression = CompressionOptions()
         record_status = -1
+        self.compression_stats = None
         args = self.record_args(
             self.zst_fifo, sample_rate, sample_count, center_freq, gain, agc, rxb
         )
         dotfile = os.path.join(
             os.path.dirname(sample_file), "." + os.path.basename(sample_file)
         )
-        zstd_args = ["nice", "zstd", "-1", self.zst_fifo, "-o", dotfile]
         logging.info("starting recording: %s", args)
-        with subprocess.Popen(zstd_args, stdin=subprocess.DEVNULL) as zstd_proc:
+        # compress in process, as the recorder writes samples to the FIFO.
+        writer = compression.writer(
+            dotfile, int(sample_rate * zst_frame_secs) * SAMPLE_LEN
+        )
+        errors = []
+        fifo_thread = threading.Thread(target=self.write_fifo, args=(writer, errors))
+        fifo_thread.start()
+        try:
             record_status = subprocess.check_call(args)
-            zstd_proc.communicate()
+        finally:
+            self.unblock_fifo()
+            fifo_thread.join()
+            compression_stats = writer.close()
+        if errors:
+            raise errors[0]
+        self.compression_stats = compression_stats
+        if os.path.exists(zst_index_file(dotfile)):
+            os.rename(zst_index_file(dotfile), zst_index_file(sample_file))
         if os.path.exists(dotfile):
             os.rename(dotfile, sample_file)
         return record_status
@@ -90,19 +183,6 @@ class SDRRecorder:
     def fft_spectrogram(
         sample_file, fft_file, sample_count, sample_rate, center_freq, nfft
     ):
-        def matplotlib_gc(fig, im):
-            im.remove()
-            fig.clear()
-            plt.close()
-            plt.cla()
-            plt.clf()
-
-        def get_fig(width, height):
-            fig = plt.figure()
-            fig.set_size_inches(width, height)
-            axes = fig.add_subplot(111)
-            return (fig, axes)
-
         def imshow(axes, i, extent):
             return axes.imshow(
                 i,
@@ -114,44 +194,51 @@ class SDRRecorder:
             )
 
         def plot_fft(i, sample_file, extent):
-            png_file = sample_file.replace(".zst", ".png")
+            png_file = SDRRecorder.get_image_file(sample_file, ".png")
             logging.info("generating spectrogram: %s", png_file)
-            fig, axes = get_fig(WIDTH, HEIGHT)
+            # not a pyplot figure, so spectrograms can be plotted concurrently.
+            fig = Figure(figsize=(WIDTH, HEIGHT))
+            axes = fig.add_subplot(111)
             axes.set_xlabel("time (s)")
             axes.set_ylabel("freq (MHz)")
             axes.axis("auto")
             axes.minorticks_on()
             im = imshow(axes, i, extent)
-            plt.colorbar(im, ax=axes)
-            plt.sci(im)
-            plt.savefig(png_file, dpi=DPI)
-            matplotlib_gc(fig, im)
+            fig.colorbar(im, ax=axes)
+            fig.savefig(png_file, dpi=DPI)
 
-        def plot_ds_fft(i, sample_file, extent):
-            ds_png_file = sample_file.replace(".zst", ".ds.png")
+        def plot_ds_fft(i, sample_file):
+            ds_png_file = SDRRecorder.get_image_file(sample_file, ".ds.png")
             logging.info("generating downsampled spectrogram: %s", ds_png_file)
-            fig, axes = get_fig(DS_PIXELS / DPI, DS_PIXELS / DPI)
-            axes.set_axis_off()
-            axes.get_xaxis().set_visible(False)
-            axes.get_yaxis().set_visible(False)
-            im = imshow(axes, i, extent)
-            plt.sci(im)
-            plt.subplots_adjust(left=0, right=1, bottom=0, top=1)
-            plt.savefig(ds_png_file, dpi=DPI)
-            matplotlib_gc(fig, im)
+            # bare image, so no figure needed (flip, as plotted with origin lower).
+            write_spectrogram_png(
+                ds_png_file, np.flipud(i), "turbo", size=(DS_PIXELS, DS_PIXELS)
+            )
 
         if os.path.exists(fft_file):
-            matplotlib.use(MPL_BACKEND)
-            i = np.memmap(fft_file, dtype=np.float32, mode="r+")
-            i = np.roll(i.reshape(-1, nfft).swapaxes(0, 1), int(nfft / 2), 0)
-            fc = center_freq / 1e6
-            fo = sample_rate / 1e6 / 2
-            extent = (0, sample_count / sample_rate, fc - fo, fc + fo)
-            plot_fft(i, sample_file, extent)
-            plot_ds_fft(i, sample_file, extent)
-            os.remove(fft_file)
-
-    def run_recording(
+            try:
+                # no more than one column per pixel of the full size image, which
+                # the downsampled image is also resized from.
+                i = read_fft_columns(fft_file, nfft, WIDTH * DPI)
+                if i is not None:
+                    fc = center_freq / 1e6
+                    fo = sample_rate / 1e6 / 2
+                    extent = (0, sample_count / sample_rate, fc - fo, fc + fo)
+                    plot_fft(i, sample_file, extent)
+                    plot_ds_fft(i, sample_file)
+            finally:
+                os.remove(fft_file)
+
+    @staticmethod
+    def get_fft_file(sample_file):
+        # beside FFT_FILE, so it can be renamed without copying. The backlog
+        # waiting for post processing is bounded by the post processing queue.
+        return os.path.join(
+            os.path.dirname(FFT_FILE),
+            "fft." + os.path.basename(sample_file) + ".dat",
+        )
+
+    def capture_recording(
         self,
         path,
         sample_rate,
@@ -163,50 +250,211 @@ class SDRRecorder:
         sigmf_,
         sdr,
         antenna,
+        zst_frame_secs=0,
+        compression=None,
     ):
+        """Make a recording, returning its status, filename, and the arguments
+        for post_process_recording() (None if recording failed)."""
+        if compression is None:
+            compression = CompressionOptions()
         epoch_time = str(int(time.time()))
         meta_time = datetime.datetime.utcnow().isoformat() + "Z"
         sample_file = self.get_sample_file(
-            path, epoch_time, center_freq, sample_rate, sdr, antenna, gain
+            path,
+            epoch_time,
+            center_freq,
+            sample_rate,
+            sdr,
+            antenna,
+            gain,
+            ext=compression.ext(),
         )
         record_status = -1
+        post_args = None
         try:
             record_status = self.write_recording(
-                sample_file, sample_rate, sample_count, center_freq, gain, agc, rxb
+                sample_file,
+                sample_rate,
+                sample_count,
+                center_freq,
+                gain,
+                agc,
+                rxb,
+                zst_frame_secs=zst_frame_secs,
+                compression=compression,
             )
-            if NFFT:
-                self.fft_spectrogram(
-                    sample_file, FFT_FILE, sample_count, sample_rate, center_freq, NFFT
-                )
-
-            if sigmf_:
-                meta = sigmf.SigMFFile(
-                    data_file=sample_file,
-                    global_info={
-                        sigmf.SigMFFile.DATATYPE_KEY: SAMPLE_TYPE,
-                        sigmf.SigMFFile.SAMPLE_RATE_KEY: sample_rate,
-                        sigmf.SigMFFile.VERSION_KEY: sigmf.__version__,
-                    },
-                )
-                meta.add_capture(
-                    0,
-                    metadata={
-                        sigmf.SigMFFile.FREQUENCY_KEY: center_freq,
-                        sigmf.SigMFFile.DATETIME_KEY: meta_time,
-                    },
-                )
-                meta.tofile(sample_file + ".sigmf-meta")
-        except subprocess.CalledProcessError as err:
+            post_args = {
+                "sample_file": sample_file,
+                "sample_rate": sample_rate,
+                "sample_count": sample_count,
+                "center_freq": center_freq,
+                "meta_time": meta_time,
+                "sigmf_": sigmf_,
+                "fft_file": None,
+            }
+            if NFFT and os.path.exists(FFT_FILE):
+                # move the FFT aside, so the next recording can write another.
+                post_args["fft_file"] = self.get_fft_file(sample_file)
+                os.rename(FFT_FILE, post_args["fft_file"])
+        except (subprocess.CalledProcessError, OSError) as err:
             logging.debug("record failed: %s", err)
         logging.info("record status: %d", record_status)
+        return (record_status, sample_file, post_args)
+
+    def post_process_recording(
+        self,
+        sample_file,
+        sample_rate,
+        sample_count,
+        center_freq,
+        meta_time,
+        sigmf_,
+        fft_file,
+    ):
+        """Write the spectrogram and SigMF metadata for a recording."""
+        if fft_file:
+            self.fft_spectrogram(
+                sample_file, fft_file, sample_count, sample_rate, center_freq, NFFT
+            )
+
+        if sigmf_:
+            meta = sigmf.SigMFFile(
+                data_file=sample_file,
+                global_info={
+                    sigmf.SigMFFile.DATATYPE_KEY: SAMPLE_TYPE,
+                    sigmf.SigMFFile.SAMPLE_RATE_KEY: sample_rate,
+                    sigmf.SigMFFile.VERSION_KEY: sigmf.__version__,
+                },
+            )
+            meta.add_capture(
+                0,
+                metadata={
+                    sigmf.SigMFFile.FREQUENCY_KEY: center_freq,
+                    sigmf.SigMFFile.DATETIME_KEY: meta_time,
+                },
+            )
+            meta.tofile(sample_file + ".sigmf-meta")
+
+    def run_recording(self, *args, **kwargs):
+        """Make a recording and post process it, returning its status and filename."""
+        record_status, sample_file, post_args = self.capture_recording(*args, **kwargs)
+        if post_args is not None:
+            self.post_process_recording(**post_args)
         return (record_status, sample_file)
 
 
-class EttusRecorder(SDRRecorder):
+class WorkerRecorder(SDRRecorder):
+    """Record with a long-lived worker process, which keeps the SDR open
+    between recordings. Each recording is one JSON request line written to
+    the worker, which replies with one JSON status line."""
+
     def __init__(self):
         super().__init__()
         self.worker_subprocess = None
         self.last_worker_line = None
+
+    def worker_args(self, sample_rate, gain, agc, rxb):
+        raise NotImplementedError
+
+    def worker_request(
+        self,
+        sample_file,
+        dotfile,
+        sample_rate,
+        sample_count,
+        center_freq,
+        gain,
+        agc,
+        rxb,
+        zst_frame_secs,
+        compression,
+    ):
+        raise NotImplementedError
+
+    def worker_read(self):
+        self.last_worker_line = (
+            self.worker_subprocess.stdout.readline().decode("utf-8").strip()
+        )
+        logging.info(self.last_worker_line)
+        return json.loads(self.last_worker_line)
+
+    def worker_write(self, request):
+        self.worker_subprocess.stdin.write(
+            ("%s\n" % json.dumps(request)).encode("utf-8")
+        )
+        self.worker_subprocess.stdin.flush()
+
+    def start_worker(self, sample_rate, gain, agc, rxb):
+        args = self.worker_args(sample_rate, gain, agc, rxb)
+        logging.info("starting worker subprocess: %s", args)
+        self.worker_subprocess = subprocess.Popen(
+            args, stdin=subprocess.PIPE, stdout=subprocess.PIPE
+        )
+        return self.worker_read()
+
+    def stop_worker(self):
+        if self.worker_subprocess:
+            self.worker_subprocess.kill()
+            self.worker_subprocess.wait()
+            self.worker_subprocess = None
+
+    def write_recording(
+        self,
+        sample_file,
+        sample_rate,
+        sample_count,
+        center_freq,
+        gain,
+        agc,
+        rxb,
+        zst_frame_secs=0,
+        compression=None,
+    ):
+        if compression is None:
+            compression = CompressionOptions()
+        record_status = -1
+        self.compression_stats = None
+        dotfile = os.path.join(
+            os.path.dirname(sample_file), "." + os.path.basename(sample_file)
+        )
+        request = self.worker_request(
+            sample_file,
+            dotfile,
+            sample_rate,
+            sample_count,
+            center_freq,
+            gain,
+            agc,
+            rxb,
+            zst_frame_secs,
+            compression,
+        )
+        try:
+            if self.worker_subprocess is None:
+                self.start_worker(sample_rate, gain, agc, rxb)
+            logging.info("starting recording: %s", request)
+            self.worker_write(request)
+            status = self.worker_read()
+            if not status.get("last_error"):
+                record_status = 0
+                self.compression_stats = status.get("compression", None)
+        except (
+            subprocess.SubprocessError,
+            BrokenPipeError,
+            json.decoder.JSONDecodeError,
+        ) as e:
+            logging.error(e)
+            self.stop_worker()
+        if record_status == 0 and os.path.exists(dotfile):
+            if os.path.exists(zst_index_file(dotfile)):
+                os.rename(zst_index_file(dotfile), zst_index_file(sample_file))
+            os.rename(dotfile, sample_file)
+        return record_status
+
+
+class EttusRecorder(WorkerRecorder):
+    def __init__(self):
+        super().__init__()
         # TODO: troubleshoot why this doesn't find an Ettus initially, still.
         # subprocess.call(['uhd_find_devices'])
 
@@ -249,53 +497,131 @@ class EttusRecorder(SDRRecorder):
             )
         return (args, json_args)
 
-    def write_recording(
-        self, sample_file, sample_rate, sample_count, center_freq, gain, agc, rxb
+    def worker_args(self, sample_rate, gain, agc, rxb):
+        args, _ = self.record_args(None, sample_rate, 0, None, gain, agc, rxb)
+        return args
+
+    def worker_request(
+        self,
+        sample_file,
+        dotfile,
+        sample_rate,
+        sample_count,
+        center_freq,
+        gain,
+        agc,
+        rxb,
+        zst_frame_secs,
+        compression,
     ):
         # Ettus doesn't need a wrapper, it can do its own zst compression.
-        record_status = -1
-        args, json_args = self.record_args(
+        if zst_frame_secs:
+            logging.warning("seekable zst recordings not supported for Ettus")
+        if compression.request() != CompressionOptions().request():
+            logging.warning("compression options not supported for Ettus")
+        _, json_args = self.record_args(
             sample_file, sample_rate, sample_count, center_freq, gain, agc, rxb
         )
+        return json_args
 
-        try:
 
-            def worker_read():
-                self.last_worker_line = (
-                    self.worker_subprocess.stdout.readline().decode("utf-8").strip()
-                )
-                logging.info(self.last_worker_line)
+class CaptureWorkerRecorder(WorkerRecorder):
+    """Record with gamutrf.capture_worker, which holds the SDR open and
+    compresses samples itself, so recordings start without opening and
+    initializing the SDR each time. Falls back to running record_args
+    per recording if the worker cannot open the SDR."""
 
-            def worker_write(s):
-                self.worker_subprocess.stdin.write(("%s\n" % s).encode("utf-8"))
-                self.worker_subprocess.stdin.flush()
+    capture_sdr = None
 
-            if self.worker_subprocess is None:
-                logging.info("starting worker subprocess: %s", args)
-                self.worker_subprocess = subprocess.Popen(
-                    args, stdin=subprocess.PIPE, stdout=subprocess.PIPE
-                )
-                worker_read()
-
-            logging.info("starting recording: %s", json_args)
-            worker_write(json.dumps(json_args))
-            worker_read()
-            last_error = json.loads(self.last_worker_line).get("last_error")
-            if not last_error:
-                record_status = 0
-        except (
-            subprocess.SubprocessError,
-            BrokenPipeError,
-            json.decoder.JSONDecodeError,
-        ) as e:
-            logging.error(e)
-            if self.worker_subprocess:
-                self.worker_subprocess.kill()
-                self.worker_subprocess = None
-        return record_status
+    def __init__(self):
+        super().__init__()
+        self.worker_failed = False
+
+    def worker_args(self, sample_rate, gain, agc, rxb):
+        return [
+            sys.executable,
+            "-m",
+            "gamutrf.capture_worker",
+            "--sdr",
+            self.capture_sdr,
+        ]
 
+    def worker_request(
+        self,
+        sample_file,
+        dotfile,
+        sample_rate,
+        sample_count,
+        center_freq,
+        gain,
+        agc,
+        rxb,
+        zst_frame_secs,
+        compression,
+    ):
+        request = {
+            "file": dotfile,
+            "freq": center_freq,
+            "rate": sample_rate,
+            "count": sample_count,
+            "gain": gain,
+            "agc": agc,
+            "zst_frame_bytes": int(sample_rate * zst_frame_secs) * SAMPLE_LEN,
+        }
+        request.update(compression.request())
+        return request
+
+    def start_worker(self, sample_rate, gain, agc, rxb):
+        status = super().start_worker(sample_rate, gain, agc, rxb)
+        if status.get("last_error"):
+            self.stop_worker()
+            self.worker_failed = True
+            logging.error("capture worker failed to start: %s", status["last_error"])
+        return status
+
+    def write_recording(
+        self,
+        sample_file,
+        sample_rate,
+        sample_count,
+        center_freq,
+        gain,
+        agc,
+        rxb,
+        zst_frame_secs=0,
+        compression=None,
+    ):
+        if self.worker_subprocess is None and not self.worker_failed:
+            try:
+                self.start_worker(sample_rate, gain, agc, rxb)
+            except (
+                OSError,
+                subprocess.SubprocessError,
+                json.decoder.JSONDecodeError,
+            ) as e:
+                logging.error("capture worker failed to start: %s", e)
+                self.stop_worker()
+                self.worker_failed = True
+        if self.worker_failed:
+            write_recording = super(WorkerRecorder, self).write_recording
+        else:
+            write_recording = super().write_recording
+        return write_recording(
+            sample_file,
+            sample_rate,
+            sample_count,
+            center_freq,
+            gain,
+            agc,
+            rxb,
+            zst_frame_secs=zst_frame_secs,
+            compression=compression,
+        )
+
+
+class BladeRecorder(CaptureWorkerRecorder):
+    capture_sdr = "bladerf"
 
-class BladeRecorder(SDRRecorder):
     def record_args(
         self, sample_file, sample_rate, sample_count, center_freq, gain, agc, _rxb
     ):
@@ -330,7 +656,9 @@ class BladeRecorder(SDRRecorder):
         )
 
 
-class LimeRecorder(SDRRecorder):
+class LimeRecorder(CaptureWorkerRecorder):
+    capture_sdr = "lime"
+
     def record_args(
         self, sample_file, sample_rate, sample_count, center_freq, gain, agc, _rxb
     ):
@@ -372,6 +700,15 @@ class FileTestRecorder(SDRRecorder):
         return args
 
 
+class FileCaptureRecorder(CaptureWorkerRecorder, FileTestRecorder):
+    """Stand-in for a CaptureWorkerRecorder SDR, with a file as the sample source."""
+
+    def __init__(self, test_file):
+        super().__init__()
+        self.test_file = test_file
+        self.capture_sdr = test_file
+
+
 RECORDER_MAP = {
     "ettus": EttusRecorder,
     "bladerf": BladeRecorder,
@@ -0,0 +1,129 @@
+import io
+import json
+import os
+
+import zstandard
+
+from gamutrf.utils import ZST_INDEX_EXT
+
+
+def zst_index_file(filename):
+    return filename + ZST_INDEX_EXT
+
+
+def read_zst_index(filename):
+    """Return the frame index of a seekable zstd file, or None if it has none."""
+    index_file = zst_index_file(filename)
+    if not os.path.exists(index_file):
+        return None
+    with open(index_file, encoding="utf8") as f:
+        return json.load(f)
+
+
+class SeekableZstdWriter:
+    """Write zstd as independent frames of frame_bytes of uncompressed data.
+
+    Each frame can be decompressed on its own, so a reader with the frame
+    index (see index()) can start decompressing at any frame.
+    """
+
+    def __init__(self, outfile, frame_bytes, level=1, compressor=None):
+        self.outfile = outfile
+        self.frame_bytes = frame_bytes
+        if compressor is None:
+            compressor = zstandard.ZstdCompressor(level=level, write_content_size=True)
+        self.compressor = compressor
+        self.buffer = bytearray()
+        self.frames = []
+        self.offset = 0
+        self.total_bytes = 0
+
+    def _write_frame(self, data):
+        frame = self.compressor.compress(data)
+        self.outfile.write(frame)
+        self.frames.append((self.offset, len(frame)))
+        self.offset += len(frame)
+        self.total_bytes += len(data)
+
+    def write(self, data):
+        self.buffer += data
+        start = 0
+        while len(self.buffer) - start >= self.frame_bytes:
+            self._write_frame(bytes(self.buffer[start : start + self.frame_bytes]))
+            start += self.frame_bytes
+        del self.buffer[:start]
+
+    def flush(self):
+        if self.buffer:
+            self._write_frame(bytes(self.buffer))
+            self.buffer.clear()
+        self.outfile.flush()
+
+    def index(self):
+        return {
+            "frame_bytes": self.frame_bytes,
+            "total_bytes": self.total_bytes,
+            "frames": self.frames,
+        }
+
+    def write_index(self, index_file):
+        with open(index_file, "w", encoding="utf8") as f:
+            json.dump(self.index(), f)
+
+
+class SeekableZstdReader(io.RawIOBase):
+    """Read a seekable zstd file, decompressing only the frames needed."""
+
+    def __init__(self, filename, index):
+        super().__init__()
+        self.infile = open(filename, "rb")
+        self.frame_bytes = index["frame_bytes"]
+        self.total_bytes = index["total_bytes"]
+        self.frames = index["frames"]
+        self.decompressor = zstandard.ZstdDecompressor()
+        self.pos = 0
+        self.frame = None
+        self.frame_data = b""
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += self.total_bytes
+        self.pos = min(max(offset, 0), self.total_bytes)
+        return self.pos
+
+    def _load_frame(self, frame):
+        if frame != self.frame:
+            frame_offset, frame_size = self.frames[frame]
+            self.infile.seek(frame_offset)
+            self.frame_data = self.decompressor.decompress(self.infile.read(frame_size))
+            self.frame = frame
+        return self.frame_data
+
+    def readinto(self, b):
+        view = memoryview(b).cast("B")
+        size = min(len(view), self.total_bytes - self.pos)
+        read = 0
+        while read < size:
+            frame, frame_pos = divmod(self.pos, self.frame_bytes)
+            frame_data = self._load_frame(frame)
+            count = min(size - read, len(frame_data) - frame_pos)
+            view[read : read + count] = frame_data[frame_pos : frame_pos + count]
+            read += count
+            self.pos += count
+        return read
+
+    def close(self):
+        if not self.closed:
+            self.infile.close()
+        super().close()
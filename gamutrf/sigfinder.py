@@ -1,9 +1,10 @@
 import argparse
 import concurrent.futures
-import json
 import logging
+import multiprocessing
 import os
 import pathlib
+import queue
 import subprocess
 import tempfile
 import threading
@@ -12,30 +13,37 @@ import time
 import bjoern
 import falcon
 import jinja2
-import numpy as np
-import pandas as pd
 import requests
 import schedule
 import zmq
-import zstandard
 
 from prometheus_client import Counter
 from prometheus_client import Gauge
+from prometheus_client import Histogram
 from prometheus_client import start_http_server
 
+from gamutrf.fft_frames import decode_json_lines
+from gamutrf.fft_frames import FFTFrameAccumulator
+from gamutrf.fft_frames import resample_fft
+from gamutrf.fft_frames import RunningFFTMean
+from gamutrf.fft_frames import RUNNING_FFT_MAX_SLOTS
+from gamutrf.recorder_dispatch import RecorderDispatcher
+from gamutrf.recorder_dispatch import RECORDER_CONNECT_TIMEOUT
+from gamutrf.recorder_dispatch import RECORDER_INFO_TTL
+from gamutrf.recorder_dispatch import RECORDER_QSIZE
 from gamutrf.sigwindows import calc_db
 from gamutrf.sigwindows import choose_record_signal
 from gamutrf.sigwindows import choose_recorders
 from gamutrf.sigwindows import get_center
-from gamutrf.sigwindows import graph_fft_peaks
-from gamutrf.sigwindows import parse_freq_excluded
+from gamutrf.sigwindows import FFTGraph
 from gamutrf.sigwindows import scipy_find_sig_windows
 from gamutrf.sigwindows import ROLLING_FACTOR
 from gamutrf.utils import rotate_file_n, SCAN_FRES
 
 MB = int(1.024e6)
 FFT_BUFFER_TIME = 1
-BUFF_FILE = "scanfftbuffer.txt.zst"  # nosec
+FFT_QUEUE_SIZE = 32
+FFT_PROXY_BATCH_BYTES = 4 * MB
 PEAK_TRIGGER = int(os.environ.get("PEAK_TRIGGER", "0"))
 PIN_TRIGGER = int(os.environ.get("PIN_TRIGGER", "17"))
 if PEAK_TRIGGER == 1:
@@ -154,6 +162,25 @@ def init_prom_vars():
             "bin_freq_count", "count of signals in each bin", labelnames=("bin_mhz",)
         ),
         "frame_counter": Counter("frame_counter", "number of frames processed"),
+        "recorder_request_latency": Histogram(
+            "recorder_request_latency",
+            "recorder request latency in seconds",
+            labelnames=("worker", "request"),
+        ),
+        "recorder_in_flight": Gauge(
+            "recorder_in_flight",
+            "recordings accepted by each recorder and not yet expected complete",
+            labelnames=("worker",),
+        ),
+        "recorder_request_failures": Counter(
+            "recorder_request_failures",
+            "recorder requests that failed or were rejected",
+            labelnames=("worker", "request"),
+        ),
+        "fft_graph_skipped": Counter(
+            "fft_graph_skipped",
+            "number of FFT graphs skipped because the renderer was busy",
+        ),
     }
     return prom_vars
 
@@ -170,16 +197,74 @@ def update_prom_vars(peak_dbs, new_bins, old_bins, prom_vars):
         old_bins_prom.labels(bin_freq=obin).inc()
 
 
-def process_fft(args, scan_config, prom_vars, df, lastbins, running_df, last_dfs):
+def fft_graph_renderer(args, graph_queue):
+    fft_graph = FFTGraph(args.nfftplots)
+    last_dfs = []
+    while True:
+        item = graph_queue.get()
+        if item is None:
+            break
+        df, mean_running_df, signals, scan_config = item
+        rotate_file_n(args.fftgraph, args.nfftgraph)
+        try:
+            fft_graph.render(
+                args.fftgraph, df, mean_running_df, signals, last_dfs, scan_config
+            )
+        except (OSError, ValueError) as err:
+            logging.error("could not render %s: %s", args.fftgraph, err)
+        if args.nfftplots:
+            last_dfs.append((df.freq.to_numpy(), df.db.to_numpy()))
+            last_dfs = last_dfs[-args.nfftplots :]
+    fft_graph.close()
+
+
+class FFTGraphRenderer:
+    """Render FFT graphs in a separate process, so that a slow render never
+    delays frame processing. Only the most recent frame is kept pending; if
+    the renderer is still busy when a new frame arrives, the pending frame is
+    replaced and counted as skipped."""
+
+    def __init__(self, args, prom_vars):
+        self.fft_graph_skipped = prom_vars["fft_graph_skipped"]
+        self.graph_queue = multiprocessing.Queue(1)
+        self.process = multiprocessing.Process(
+            target=fft_graph_renderer, args=(args, self.graph_queue), daemon=True
+        )
+        self.process.start()
+
+    def submit(self, df, mean_running_df, signals, scan_config):
+        item = (df[["freq", "db", "ts"]], mean_running_df, signals, scan_config)
+        try:
+            self.graph_queue.put_nowait(item)
+            return
+        except queue.Full:
+            pass
+        try:
+            self.graph_queue.get_nowait()
+            self.fft_graph_skipped.inc()
+        except queue.Empty:
+            pass
+        try:
+            self.graph_queue.put_nowait(item)
+        except queue.Full:
+            self.fft_graph_skipped.inc()
+
+    def stop(self, timeout=10):
+        try:
+            self.graph_queue.get_nowait()
+        except queue.Empty:
+            pass
+        self.graph_queue.put(None)
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+def process_fft(
+    args, scan_config, prom_vars, df, lastbins, running_mean, graph_renderer=None
+):
     global PEAK_DBS
-    # resample to SCAN_FRES
-    # ...first frequency
-    df["freq"] = (df["freq"] / SCAN_FRES).round() * SCAN_FRES / 1e6
-    df = df.set_index("freq")
-    # ...then power
-    df["db"] = df.groupby(["freq"])["db"].mean()
-    df = df.reset_index().drop_duplicates(subset=["freq"])
-    df = df.sort_values("freq")
+    df = resample_fft(df, SCAN_FRES)
     df = calc_db(df, args.db_rolling_factor)
     freqdiffs = df.freq - df.freq.shift()
     mindiff = freqdiffs.min()
@@ -218,34 +303,10 @@ def process_fft(args, scan_config, prom_vars, df, lastbins, running_df, last_dfs
         time.sleep(led_sleep)
         GPIO.output(PIN_TRIGGER, GPIO.LOW)
 
-    if running_df is None:
-        running_df = df
-    else:
-        now = time.time()
-        running_df = running_df[running_df.ts >= (now - args.running_fft_secs)]
-        running_df = pd.concat(running_df, df)
-    mean_running_df = running_df[["freq", "db"]].groupby(["freq"]).mean().reset_index()
-    sample_count_df = df[["freq"]].copy()
-    sample_count_df["freq"] = np.floor(sample_count_df["freq"])
-    # nosemgrep
-    sample_count_df["size"] = sample_count_df.groupby("freq").transform("size")
-    sample_count_df["size"] = abs(
-        sample_count_df["size"].mean() - sample_count_df["size"]
-    )
-    sample_count_df["size"].iat[0] = 0
-    sample_count_df["size"].iat[-1] = 0
-
-    if args.fftgraph:
-        rotate_file_n(args.fftgraph, args.nfftgraph)
-        graph_fft_peaks(
-            args.fftgraph,
-            df,
-            mean_running_df,
-            sample_count_df,
-            signals,
-            last_dfs,
-            scan_config,
-        )
+    running_mean.add(df, scan_config)
+    mean_running_df = running_mean.mean()
+    if graph_renderer is not None:
+        graph_renderer.submit(df, mean_running_df, signals, scan_config)
 
     ts = df["ts"].max()
     for peak_freq, peak_db in signals:
@@ -290,84 +351,121 @@ def recorder_req(recorder, recorder_args, timeout):
         return None
 
 
-def get_freq_exclusions(args):
-    recorder_freq_exclusions = {}
-    for recorder in args.recorder:
-        req = recorder_req(recorder, "info", args.record_secs)
-        if req is None or req.status_code != 200:
-            continue
-        excluded = json.loads(req.text).get("freq_excluded", None)
-        if excluded is None:
-            continue
-        recorder_freq_exclusions[recorder] = parse_freq_excluded(excluded)
-    return recorder_freq_exclusions
-
-
-def call_record_signals(args, lastbins_history, prom_vars):
+def call_record_signals(args, lastbins_history, dispatcher):
     if lastbins_history:
         signals = []
         for bins in lastbins_history:
             signals.extend(list(bins))
-        recorder_freq_exclusions = get_freq_exclusions(args)
-        recorder_count = len(recorder_freq_exclusions)
-        record_signals = choose_record_signal(
-            signals, recorder_count * args.max_recorder_signals
+        recorder_freq_exclusions = dispatcher.freq_exclusions()
+        recorder_free = dispatcher.recorder_states.free()
+        recorder_capacity = sum(
+            min(args.max_recorder_signals, recorder_free[recorder])
+            for recorder in recorder_freq_exclusions
         )
+        if not recorder_capacity:
+            logging.info("no recorder capacity available")
+            return
+        record_signals = choose_record_signal(signals, recorder_capacity)
         for signal, recorder in choose_recorders(
-            record_signals, recorder_freq_exclusions, args.max_recorder_signals
+            record_signals,
+            recorder_freq_exclusions,
+            args.max_recorder_signals,
+            recorder_free=recorder_free,
+            recorder_rank=dispatcher.recorder_states.rank(),
         ):
             signal_hz = int(signal * 1e6)
             record_bps = int(args.record_bw_msps * MB)
             record_samples = int(record_bps * args.record_secs)
-            recorder_args = f"record/{signal_hz}/{record_samples}/{record_bps}"
-            resp = recorder_req(recorder, recorder_args, args.record_secs)
-            if resp:
-                worker_record_request = prom_vars["worker_record_request"]
-                worker_record_request.labels(worker=recorder).set(signal_hz)
+            dispatcher.record(
+                recorder, signal_hz, record_samples, record_bps, args.record_secs
+            )
 
 
 def zstd_file(uncompressed_file):
     subprocess.check_call(["/usr/bin/zstd", "--force", "--rm", uncompressed_file])
 
 
+def decode_fft_buffer(fft_buf):
+    complete = fft_buf.rfind(b"\n") + 1
+    if not complete:
+        return (0, None, None)
+    df, scan_config = decode_json_lines(fft_buf[:complete].decode("utf8").splitlines())
+    return (complete, df, scan_config)
+
+
 def process_fft_lines(
     args,
     prom_vars,
-    buff_file,
+    fft_queue,
     executor,
-    proxy_result,
+    proxy,
     live_file,
+):
+    graph_renderer = None
+    if args.fftgraph:
+        graph_renderer = FFTGraphRenderer(args, prom_vars)
+    dispatcher = RecorderDispatcher(
+        args.recorder,
+        prom_vars,
+        connect_timeout=args.recorder_connect_timeout,
+        read_timeout=args.recorder_connect_timeout,
+        info_ttl=args.recorder_info_ttl,
+        qsize=args.recorder_qsize,
+    )
+    try:
+        process_fft_log(
+            args,
+            prom_vars,
+            fft_queue,
+            executor,
+            proxy,
+            live_file,
+            graph_renderer,
+            dispatcher,
+        )
+    finally:
+        if graph_renderer is not None:
+            graph_renderer.stop()
+        dispatcher.close()
+
+
+def process_fft_log(
+    args,
+    prom_vars,
+    fft_queue,
+    executor,
+    proxy,
+    live_file,
+    graph_renderer,
+    dispatcher,
 ):
     lastfreq = 0
-    fftbuffer = None
+    accumulator = FFTFrameAccumulator()
+    running_mean = RunningFFTMean(
+        args.running_fft_secs, max_slots=args.running_fft_max_slots
+    )
     lastbins_history = []
     lastbins = set()
     frame_counter = prom_vars["frame_counter"]
-    txt_buf = ""
+    fft_buf = b""
     last_fft_report = 0
     fft_packets = 0
-    last_sweep_start = 0
-    context = zstandard.ZstdDecompressor()
-    running_df = None
-    last_dfs = []
     scan_config = None
 
     while True:
         if os.path.exists(args.log):
             logging.info(f"{args.log} exists, will append first")
-            mode = "a"
+            mode = "ab"
         else:
             logging.info(f"opening {args.log}")
-            mode = "w"
+            mode = "wb"
         openlogts = int(time.time())
-        with open(args.log, mode=mode, encoding="utf-8") as l:
+        with open(args.log, mode=mode) as l:
             while True:
                 if not live_file.exists():
                     return
-                if not proxy_result.running():
-                    logging.error(
-                        "FFT proxy stopped running: %s", proxy_result.result()
-                    )
+                if not proxy.is_alive():
+                    logging.error("FFT proxy stopped running: %s", proxy.exitcode)
                     return
                 now = int(time.time())
                 if now - last_fft_report > FFT_BUFFER_TIME * 2:
@@ -378,103 +476,54 @@ def process_fft_lines(
                     )
                     fft_packets = 0
                     last_fft_report = now
-                if os.path.exists(buff_file):
-                    logging.info(
-                        "read %u bytes of FFT data", os.stat(buff_file).st_size
-                    )
-                    with context.stream_reader(open(buff_file, "rb")) as bf:
-                        txt_buf += bf.read().decode("utf8")
-                    fft_packets += 1
-                    os.remove(buff_file)
-                else:
-                    schedule.run_pending()
-                    sleep_time = 1
-                    time.sleep(sleep_time)
-                    continue
-                lines = txt_buf.splitlines()
-                if not len(lines) > 1:
+                schedule.run_pending()
+                try:
+                    fft_chunk = fft_queue.get(timeout=FFT_BUFFER_TIME)
+                except queue.Empty:
                     continue
-                if txt_buf.endswith("\n"):
-                    l.write(txt_buf)
-                    txt_buf = ""
-                elif lines:
-                    last_line = lines[-1]
-                    l.write(txt_buf[: -len(last_line)])
-                    txt_buf = last_line
-                    lines = lines[:-1]
+                logging.info("read %u bytes of FFT data", len(fft_chunk))
+                fft_buf += fft_chunk
+                fft_packets += 1
                 try:
-                    records = []
-                    for line in lines:
-                        line = line.strip()
-                        record = json.loads(line)
-                        ts = float(record["ts"])
-                        sweep_start = float(record["sweep_start"])
-                        buckets = record["buckets"]
-                        scan_config = record["config"]
-                        records.extend(
-                            [
-                                {
-                                    "ts": ts,
-                                    "freq": float(freq),
-                                    "db": float(db),
-                                    "sweep_start": sweep_start,
-                                }
-                                for freq, db in buckets.items()
-                            ]
-                        )
-                    df = pd.DataFrame(records)
+                    consumed, df, new_scan_config = decode_fft_buffer(fft_buf)
                 except ValueError as err:
                     logging.error(str(err))
+                    fft_buf = b""
+                    continue
+                l.write(fft_buf[:consumed])
+                fft_buf = fft_buf[consumed:]
+                if df is None:
                     continue
+                if new_scan_config is not None:
+                    scan_config = new_scan_config
                 df = df[(now - df.ts).abs() < 60]
-                freq_start = scan_config["freq_start"]
-                freq_end = scan_config["freq_end"]
                 if df.size:
                     lastfreq = df.freq.iat[-1]
-                max_sweep_start = df["sweep_start"].max()
                 rotatelognow = False
-                if max_sweep_start != last_sweep_start:
-                    if fftbuffer is None:
-                        frame_df = df
-                    else:
-                        frame_df = pd.concat(
-                            [fftbuffer, df[df["sweep_start"] == last_sweep_start]]
-                        )
-                        fftbuffer = df[df["sweep_start"] != last_sweep_start]
-                    last_sweep_start = max_sweep_start
+                for frame_df in accumulator.add(df, scan_config):
                     frame_counter.inc()
                     logging.info(
                         "frame with sweep_start %us ago",
                         now - frame_df["sweep_start"].min(),
                     )
-                    new_lastbins, last_df = process_fft(
+                    new_lastbins, _ = process_fft(
                         args,
                         scan_config,
                         prom_vars,
                         frame_df,
                         lastbins,
-                        running_df,
-                        last_dfs,
+                        running_mean,
+                        graph_renderer,
                     )
-                    if args.nfftplots:
-                        last_dfs = last_dfs[-args.nfftplots :]
-                        last_dfs.append((last_df.freq, last_df.db))
-                    else:
-                        last_dfs = []
                     if new_lastbins is not None:
                         lastbins = new_lastbins
                         if lastbins:
                             lastbins_history = [lastbins] + lastbins_history
                             lastbins_history = lastbins_history[: args.history]
-                        call_record_signals(args, lastbins_history, prom_vars)
+                        call_record_signals(args, lastbins_history, dispatcher)
                     rotate_age = now - openlogts
                     if rotate_age > args.rotatesecs:
                         rotatelognow = True
-                else:
-                    if fftbuffer is None:
-                        fftbuffer = df
-                    else:
-                        fftbuffer = pd.concat([fftbuffer, df])
                 if rotatelognow:
                     break
         rotate_file_n(".".join((args.log, "zst")), args.nlog, require_initial=False)
@@ -483,52 +532,55 @@ def process_fft_lines(
         executor.submit(zstd_file, new_log)
 
 
-def fft_proxy(
-    args, buff_file, buffer_time=FFT_BUFFER_TIME, live_file=None, poll_timeout=1
-):
+def fft_proxy(args, fft_queue, live_file=None, poll_timeout=1):
     zmq_addr = f"tcp://{args.logaddr}:{args.logport}"
     logging.info("connecting to %s", zmq_addr)
     zmq_context = zmq.Context()
     socket = zmq_context.socket(zmq.SUB)
     socket.connect(zmq_addr)
     socket.setsockopt_string(zmq.SUBSCRIBE, "")
+    # Don't block exit on FFT data the processor will never read.
+    fft_queue.cancel_join_thread()
     packets_sent = 0
-    last_packet_sent_time = time.time()
-    tmp_buff_file = os.path.basename(buff_file)
-    tmp_buff_file = buff_file.replace(tmp_buff_file, "." + tmp_buff_file)
-    if os.path.exists(tmp_buff_file):
-        os.remove(tmp_buff_file)
-    context = zstandard.ZstdCompressor()
-    shutdown = False
-    while not shutdown:
-        with open(tmp_buff_file, "wb") as zbf:
-            with context.stream_writer(zbf) as bf:
-                while not shutdown:
-                    shutdown = live_file is not None and not live_file.exists()
-                    try:
-                        sock_txt = socket.recv(flags=zmq.NOBLOCK)
-                    except zmq.error.Again:
-                        time.sleep(poll_timeout)
-                        continue
-                    bf.write(sock_txt)
-                    now = time.time()
-                    if (
-                        shutdown or now - last_packet_sent_time > buffer_time
-                    ) and not os.path.exists(buff_file):
-                        if packets_sent == 0:
-                            logging.info("recording first FFT packet")
-                        packets_sent += 1
-                        last_packet_sent_time = now
-                        break
-        os.rename(tmp_buff_file, buff_file)
+
+    def live():
+        return live_file is None or live_file.exists()
+
+    while live():
+        if not socket.poll(poll_timeout * 1e3):
+            continue
+        # Batch whatever has already arrived, so the processor wakes once for it.
+        fft_chunks = []
+        fft_chunks_len = 0
+        while fft_chunks_len < FFT_PROXY_BATCH_BYTES:
+            try:
+                sock_txt = socket.recv(flags=zmq.NOBLOCK)
+            except zmq.error.Again:
+                break
+            fft_chunks.append(sock_txt)
+            fft_chunks_len += len(sock_txt)
+        if packets_sent == 0:
+            logging.info("recording first FFT packet")
+        packets_sent += 1
+        fft_chunk = b"".join(fft_chunks)
+        while live():
+            try:
+                fft_queue.put(fft_chunk, timeout=poll_timeout)
+                break
+            except queue.Full:
+                logging.info("FFT queue full, waiting for FFT processing")
+    socket.close()
+    zmq_context.term()
 
 
 def find_signals(args, prom_vars, executor, live_file):
-    buff_file = os.path.join(args.buff_path, BUFF_FILE)
-    if os.path.exists(buff_file):
-        os.remove(buff_file)
-    proxy_result = executor.submit(fft_proxy, args, buff_file, live_file=live_file)
-    process_fft_lines(args, prom_vars, buff_file, executor, proxy_result, live_file)
+    fft_queue = multiprocessing.Queue(FFT_QUEUE_SIZE)
+    proxy = multiprocessing.Process(
+        target=fft_proxy, args=(args, fft_queue), kwargs={"live_file": live_file}
+    )
+    proxy.start()
+    process_fft_lines(args, prom_vars, fft_queue, executor, proxy, live_file)
+    proxy.join()
 
 
 def argument_parser():
@@ -607,6 +659,27 @@ def argument_parser():
     parser.add_argument(
         "--record_secs", default=10, type=int, help="record time duration in seconds"
     )
+    parser.add_argument(
+        "--recorder_connect_timeout",
+        dest="recorder_connect_timeout",
+        default=RECORDER_CONNECT_TIMEOUT,
+        type=float,
+        help="timeout in seconds to connect to a recorder, and for recorder info requests",
+    )
+    parser.add_argument(
+        "--recorder_info_ttl",
+        dest="recorder_info_ttl",
+        default=RECORDER_INFO_TTL,
+        type=float,
+        help="seconds to cache each recorder's frequency exclusions",
+    )
+    parser.add_argument(
+        "--recorder_qsize",
+        dest="recorder_qsize",
+        default=RECORDER_QSIZE,
+        type=int,
+        help="request queue size of recorders (see gamutrf-api --qsize)",
+    )
     parser.add_argument(
         "--promport",
         dest="promport",
@@ -650,11 +723,11 @@ def argument_parser():
         help="Number of seconds for running FFT average",
     )
     parser.add_argument(
-        "--buff_path",
-        dest="buff_path",
-        type=str,
-        default="/dev/shm",  # nosec
-        help="Path for FFT buffer file",
+        "--running_fft_max_slots",
+        dest="running_fft_max_slots",
+        type=int,
+        default=RUNNING_FFT_MAX_SLOTS,
+        help="Max number of sweeps in the running FFT average, bounding its memory (or 0 for no limit)",
     )
     parser.add_argument(
         "--db_rolling_factor",
@@ -685,7 +758,7 @@ def main():
         live_file = pathlib.Path(os.path.join(tmpdir, "live_file"))
         live_file.touch()
 
-        with concurrent.futures.ProcessPoolExecutor(2) as executor:
+        with concurrent.futures.ProcessPoolExecutor(1) as executor:
             x = threading.Thread(
                 target=find_signals,
                 args=(
@@ -1,4 +1,5 @@
 #!/usr/bin/python3
+import bisect
 import logging
 import random
 import os
@@ -90,26 +91,63 @@ def read_csv(args):
             frames += 1
 
 
-def choose_recorders(signals, recorder_freq_exclusions, max_recorder_signals):
+def recorder_limit(recorder, max_recorder_signals, recorder_free):
+    if recorder_free is None:
+        return max_recorder_signals
+    return min(max_recorder_signals, recorder_free.get(recorder, 0))
+
+
+def assigned_rank(rank, assigned):
+    """Return a recorder's rank, counting signals already assigned to it as busy."""
+    return (rank[0], rank[1] + assigned) + tuple(rank[2:])
+
+
+def choose_recorders(
+    signals,
+    recorder_freq_exclusions,
+    max_recorder_signals,
+    recorder_free=None,
+    recorder_rank=None,
+):
+    """Assign signals to recorders.
+
+    If given, recorder_free limits each recorder to the number of recordings it
+    can currently accept, and recorder_rank orders recorders by preference (the
+    lowest rank among free recorders is chosen, otherwise a random one). Ranks
+    are (failure rate, busy slots, latency) tuples, and each signal assigned to
+    a recorder counts as another busy slot, so signals are spread over
+    recorders of similar rank.
+    """
     suitable_recorders = defaultdict(set)
-    for signal in sorted(signals):
-        for recorder, excluded in sorted(recorder_freq_exclusions.items()):
-            if not freq_excluded(signal, excluded):
-                suitable_recorders[signal].add(recorder)
+    signals = np.array(sorted(signals))
+    for recorder, excluded in sorted(recorder_freq_exclusions.items()):
+        if not isinstance(excluded, FreqExclusions):
+            excluded = FreqExclusions(excluded)
+        for signal in signals[~excluded.mask(signals)].tolist():
+            suitable_recorders[signal].add(recorder)
     recorder_assignments = []
     busy_count = defaultdict(int)
     for signal, recorders in sorted(suitable_recorders.items(), key=lambda x: x[1]):
         if not recorders:
             continue
-        busy_recorders = set(
+        free_recorders = set(
             recorder
-            for recorder, count in busy_count.items()
-            if count >= max_recorder_signals
+            for recorder in recorders
+            if busy_count[recorder]
+            < recorder_limit(recorder, max_recorder_signals, recorder_free)
         )
-        free_recorders = recorders - busy_recorders
         if not free_recorders:
             continue
-        recorder = random.choice(list(free_recorders))  # nosec
+        if recorder_rank is not None:
+            ranks = {
+                recorder: assigned_rank(recorder_rank[recorder], busy_count[recorder])
+                for recorder in free_recorders
+            }
+            best_rank = min(ranks.values())
+            free_recorders = [
+                recorder for recorder, rank in ranks.items() if rank == best_rank
+            ]
+        recorder = random.choice(sorted(free_recorders))  # nosec
         busy_count[recorder] += 1
         recorder_assignments.append((signal, recorder))
     return recorder_assignments
@@ -131,7 +169,66 @@ def parse_freq_excluded(freq_exclusions_raw):
     return tuple(freq_exclusions)
 
 
+class FreqExclusions:
+    """Compiled frequency exclusions.
+
+    Exclusions (as returned by parse_freq_excluded, where None is an open
+    bound) are sorted and merged into disjoint closed intervals, so a
+    frequency can be checked with a binary search, and an array of
+    frequencies with a single vectorized search.
+    """
+
+    def __init__(self, freq_exclusions=()):
+        intervals = sorted(
+            (
+                -np.inf if freq_min is None else freq_min,
+                np.inf if freq_max is None else freq_max,
+            )
+            for freq_min, freq_max in freq_exclusions
+        )
+        merged = []
+        for freq_min, freq_max in intervals:
+            if merged and freq_min <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], freq_max)
+            else:
+                merged.append([freq_min, freq_max])
+        self.intervals = tuple((freq_min, freq_max) for freq_min, freq_max in merged)
+        self.starts = [freq_min for freq_min, _ in self.intervals]
+        self.ends = [freq_max for _, freq_max in self.intervals]
+        self.starts_array = np.array(self.starts, dtype=np.float64)
+        self.ends_array = np.array(self.ends, dtype=np.float64)
+
+    @classmethod
+    def parse(cls, freq_exclusions_raw):
+        return cls(parse_freq_excluded(freq_exclusions_raw))
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def __eq__(self, other):
+        if isinstance(other, FreqExclusions):
+            return self.intervals == other.intervals
+        return NotImplemented
+
+    def __repr__(self):
+        return f"FreqExclusions({self.intervals})"
+
+    def excluded(self, freq):
+        i = bisect.bisect_right(self.starts, freq) - 1
+        return i >= 0 and freq <= self.ends[i]
+
+    def mask(self, freqs):
+        """Return a boolean array, True where freqs are excluded."""
+        freqs = np.asarray(freqs, dtype=np.float64)
+        if not self.intervals:
+            return np.zeros(freqs.shape, dtype=bool)
+        i = np.searchsorted(self.starts_array, freqs, side="right") - 1
+        return (i >= 0) & (freqs <= self.ends_array[np.maximum(i, 0)])
+
+
 def freq_excluded(freq, freq_exclusions):
+    if isinstance(freq_exclusions, FreqExclusions):
+        return freq_exclusions.excluded(freq)
     for freq_min, freq_max in freq_exclusions:
         if freq_min is not None and freq_max is not None:
             if freq >= freq_min and freq <= freq_max:
@@ -160,58 +257,72 @@ def scipy_find_sig_windows(df, width, prominence, threshold):
     return [(df.iloc[peak].freq, df.iloc[peak].db) for peak in peaks]
 
 
-def graph_fft_peaks(
-    graph_path, df, mean_running_df, sample_count_df, signals, last_dfs, scan_config
-):
-    maxdb = df.db.max()
-    df["peaks"] = df.db.min()
-    for peak_freq, _ in signals:
-        df.loc[df.freq == peak_freq, "peaks"] = maxdb
-
-    peak_df = df[df.peaks == maxdb].sort_values("db", ascending=False)[:5]
-    peak_signals = ",".join(
-        ["%.1f MHz %.1f dB" % (row.freq, row.db) for row in peak_df.itertuples()]
-    )
-    if peak_signals:
-        peak_signals = f"strongest peak signals: {peak_signals}"
-
-    matplotlib.use(MPL_BACKEND)
-    plt.figure(figsize=(WIDTH, HEIGHT), dpi=DPI)
-    plt.plot(
-        df.freq,
-        df.db,
-        "b",
-        df.freq,
-        df.peaks,
-        "y",
-        mean_running_df.freq,
-        mean_running_df.db,
-        "k",
-        # sample_count_df["freq"],
-        # sample_count_df["size"],
-        # "c",
-    )
-    for x, y in last_dfs:
-        plt.plot(x, y)
-    plt.xlabel("freq (MHz)")
-    plt.ylabel("power (dB)")
-    plt.legend(("power", "peak status", "mean power"), loc="upper right")
-    ts_min = df.ts.min()
-    ts_max = df.ts.max()
-    time_min = time.ctime(ts_min)
-    time_max = time.ctime(ts_max)
-    duration = ts_max - ts_min
-    scan_config_txt = ", ".join([f"{x}: {y}" for x, y in scan_config.items()])
-    title = f"gamutRF scanner FFT {time_min} to {time_max}, {duration}s\n{scan_config_txt}\n{peak_signals}"
-    plt.title(title)
-    real_path = os.path.realpath(graph_path)
-    basename = os.path.basename(real_path)
-    dirname = os.path.dirname(real_path)
-    tmp_graph_path = os.path.join(dirname, "." + basename)
-    plt.savefig(tmp_graph_path)
-    plt.cla()
-    plt.close("all")
-    os.rename(tmp_graph_path, graph_path)
+class FFTGraph:
+    """Graph of the most recent FFT frame and its peaks.
+
+    The figure and its artists are created once, and only their data is
+    updated for each frame rendered.
+    """
+
+    def __init__(self, nfftplots):
+        matplotlib.use(MPL_BACKEND)
+        self.fig = plt.figure(figsize=(WIDTH, HEIGHT), dpi=DPI)
+        self.axes = self.fig.add_subplot(111)
+        (self.power_line,) = self.axes.plot([], [], "b")
+        (self.peaks_line,) = self.axes.plot([], [], "y")
+        (self.mean_line,) = self.axes.plot([], [], "k")
+        self.last_lines = [self.axes.plot([], [])[0] for _ in range(nfftplots)]
+        self.axes.set_xlabel("freq (MHz)")
+        self.axes.set_ylabel("power (dB)")
+        self.axes.legend(
+            (self.power_line, self.peaks_line, self.mean_line),
+            ("power", "peak status", "mean power"),
+            loc="upper right",
+        )
+        self.title = self.axes.set_title("")
+
+    def render(self, graph_path, df, mean_running_df, signals, last_dfs, scan_config):
+        freq = df.freq.to_numpy()
+        db = df.db.to_numpy()
+        maxdb = db.max()
+        peaks = np.full(len(db), db.min())
+        peak_rows = np.isin(freq, [peak_freq for peak_freq, _ in signals])
+        peaks[peak_rows] = maxdb
+        peak_df = df[peak_rows].sort_values("db", ascending=False)[:5]
+        peak_signals = ",".join(
+            ["%.1f MHz %.1f dB" % (row.freq, row.db) for row in peak_df.itertuples()]
+        )
+        if peak_signals:
+            peak_signals = f"strongest peak signals: {peak_signals}"
+
+        self.power_line.set_data(freq, db)
+        self.peaks_line.set_data(freq, peaks)
+        self.mean_line.set_data(mean_running_df.freq, mean_running_df.db)
+        for i, line in enumerate(self.last_lines):
+            if i < len(last_dfs):
+                line.set_data(*last_dfs[i])
+            else:
+                line.set_data([], [])
+        self.axes.relim()
+        self.axes.autoscale_view()
+        ts_min = df.ts.min()
+        ts_max = df.ts.max()
+        time_min = time.ctime(ts_min)
+        time_max = time.ctime(ts_max)
+        duration = ts_max - ts_min
+        scan_config_txt = ", ".join([f"{x}: {y}" for x, y in scan_config.items()])
+        self.title.set_text(
+            f"gamutRF scanner FFT {time_min} to {time_max}, {duration}s\n{scan_config_txt}\n{peak_signals}"
+        )
+        real_path = os.path.realpath(graph_path)
+        basename = os.path.basename(real_path)
+        dirname = os.path.dirname(real_path)
+        tmp_graph_path = os.path.join(dirname, "." + basename)
+        self.fig.savefig(tmp_graph_path)
+        os.rename(tmp_graph_path, graph_path)
+
+    def close(self):
+        plt.close(self.fig)
 
 
 def get_center(signal_mhz, freq_start_mhz, bin_mhz, record_bw):
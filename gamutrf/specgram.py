@@ -16,7 +16,202 @@ from gamutrf.utils import get_nondot_files
 from gamutrf.utils import is_fft
 from gamutrf.utils import parse_filename
 from gamutrf.utils import replace_ext
+from gamutrf.recording_watcher import POLL_INTERVAL
+from gamutrf.recording_watcher import PROCESSED_INDEX
+from gamutrf.recording_watcher import ProcessedIndex
+from gamutrf.recording_watcher import RecordingWatcher
 from gamutrf.sample_reader import read_recording
+from gamutrf.spectrogram_image import write_spectrogram_png
+
+TIME_POOLS = ("none", "max", "mean")
+
+
+class PSDAccumulator:
+    """Accumulate float32 PSD columns, optionally pooled over time.
+
+    If max_columns is set, adjacent FFT windows are pooled (max or mean) so
+    that no more than max_columns columns are kept: whenever the output
+    fills, pairs of columns are pooled and the number of windows per column
+    doubles. Memory use is then bounded by the output size rather than the
+    recording length.
+    """
+
+    def __init__(self, rows, max_columns=None, pool="max"):
+        if max_columns and pool not in TIME_POOLS[1:]:
+            raise ValueError(f"Unknown time pool {pool!r}")
+        self.rows = rows
+        self.pool = pool
+        self.windows = 0
+        self.factor = 1
+        self.columns = 0
+        self.chunks = []
+        self.out = None
+        self.capacity = 0
+        if max_columns:
+            # keep an even capacity, so pairs always pool exactly.
+            self.capacity = max(max_columns - max_columns % 2, 2)
+            self.out = np.empty((rows, self.capacity), dtype=np.float32)
+        self.pending = np.zeros(rows, dtype=np.float32)
+        self.pending_count = 0
+
+    def _reduce(self, x, axis):
+        if self.pool == "max":
+            return x.max(axis=axis)
+        return x.mean(axis=axis)
+
+    def _compact(self):
+        pairs = self.columns // 2
+        self.out[:, :pairs] = self._reduce(
+            np.stack(
+                (self.out[:, 0 : self.columns : 2], self.out[:, 1 : self.columns : 2])
+            ),
+            0,
+        )
+        self.columns = pairs
+        self.factor *= 2
+
+    def _pending_column(self):
+        if self.pool == "max":
+            return self.pending
+        return self.pending / self.pending_count
+
+    def _add_pending(self, psd):
+        if self.pool == "max":
+            column = psd.max(axis=1)
+            if self.pending_count:
+                np.maximum(self.pending, column, out=self.pending)
+            else:
+                self.pending[:] = column
+        else:
+            column = psd.sum(axis=1)
+            if self.pending_count:
+                self.pending += column
+            else:
+                self.pending[:] = column
+        self.pending_count += psd.shape[1]
+        if self.pending_count == self.factor:
+            if self.columns == self.capacity:
+                self._compact()
+                # the pending column is now half of a column at the new factor.
+                return
+            self.out[:, self.columns] = self._pending_column()
+            self.columns += 1
+            self.pending_count = 0
+
+    def add(self, psd):
+        """Add PSD columns (rows x windows, float32)."""
+        self.windows += psd.shape[1]
+        if not self.capacity:
+            self.chunks.append(psd)
+            return
+        while psd.shape[1]:
+            if self.pending_count or psd.shape[1] < self.factor:
+                count = min(psd.shape[1], self.factor - self.pending_count)
+                self._add_pending(psd[:, :count])
+                psd = psd[:, count:]
+                continue
+            if self.columns == self.capacity:
+                self._compact()
+                continue
+            groups = min(psd.shape[1] // self.factor, self.capacity - self.columns)
+            windows = groups * self.factor
+            self.out[:, self.columns : self.columns + groups] = self._reduce(
+                psd[:, :windows].reshape(self.rows, groups, self.factor), 2
+            )
+            self.columns += groups
+            psd = psd[:, windows:]
+
+    def result(self):
+        """Return (PSD, index of the center FFT window of each column)."""
+        if not self.windows:
+            return None, None
+        if not self.capacity:
+            return np.hstack(self.chunks), np.arange(self.windows, dtype=np.float64)
+        out = self.out[:, : self.columns]
+        centers = np.arange(self.columns, dtype=np.float64) * self.factor
+        centers += (self.factor - 1) / 2
+        if self.pending_count:
+            out = np.hstack((out, self._pending_column()[:, np.newaxis]))
+            centers = np.append(
+                centers, self.columns * self.factor + (self.pending_count - 1) / 2
+            )
+        return out, centers
+
+
+def carry_overlap(x, NFFT, noverlap):
+    """Iterate over chunks of x, carrying samples not yet in a complete window
+    over to the next chunk, so that stride_windows over each chunk returns the
+    same windows as over the whole of x."""
+    hop = NFFT - noverlap
+    tail = None
+    for i in x:
+        if i is None:
+            break
+        if tail is not None and len(tail):
+            i = np.concatenate((tail, i))
+        windows = 0
+        if len(i) >= NFFT:
+            windows = (len(i) - noverlap) // hop
+        # copy, since the chunk's buffer may be reused by the reader.
+        tail = i[windows * hop :].copy()
+        if windows:
+            yield i[: (windows - 1) * hop + NFFT]
+
+
+def stream_psd(
+    x,
+    NFFT,
+    Fs,
+    detrend_func,
+    window,
+    noverlap,
+    pad_to,
+    scale_by_freq,
+    skip_fft,
+    numFreqs,
+    freqcenter,
+    max_columns,
+    time_pool,
+):
+    """Compute the PSD of each chunk of x in float32, as it is read."""
+    if scale_by_freq:
+        # MATLAB divides by the sampling frequency so that density function
+        # has units of dB/Hz and can be integrated by the plotted frequency
+        # values. Scale the spectrum by the norm of the window to compensate
+        # for windowing loss; see Bendat & Piersol Sec 11.5.2.
+        scale = np.float32(1 / (Fs * (window**2).sum()))
+    else:
+        # In this case, preserve power in the segment, not amplitude
+        scale = np.float32(1 / window.sum() ** 2)
+    psd_acc = PSDAccumulator(numFreqs, max_columns=max_columns, pool=time_pool)
+    if not skip_fft:
+        x = carry_overlap(x, NFFT, noverlap)
+    for i in x:
+        if i is None:
+            break
+        if skip_fft:
+            # TODO: assume NFFT is factor of sps.
+            result = i.reshape(-1, int(len(i) / NFFT), order="F")
+        else:
+            result = stride_windows(i, NFFT, noverlap, axis=0)
+            result = detrend(result, detrend_func, axis=0)
+            result = fft(result, n=pad_to, axis=0)[
+                :numFreqs, :
+            ]  # pylint: disable=invalid-sequence-index
+        psd = np.square(result.real, dtype=np.float32)
+        psd += np.square(result.imag, dtype=np.float32)
+        psd *= scale
+        psd_acc.add(psd)
+
+    psd, centers = psd_acc.result()
+    if psd is None:
+        return (None, None, None)
+    t = (NFFT / 2 + centers * (NFFT - noverlap)) / Fs
+    freqs = fftfreq(pad_to, 1 / Fs)[:numFreqs]
+    # center the frequency range at zero
+    freqs = np.roll(freqs, -freqcenter, axis=0)
+    psd = np.roll(psd, -freqcenter, axis=0)
+    return psd, freqs, t
 
 
 def spectral_helper(
@@ -30,6 +225,8 @@ def spectral_helper(
     scale_by_freq=None,
     mode=None,
     skip_fft=False,
+    max_columns=None,
+    time_pool="max",
 ):
     if Fs is None:
         Fs = 2
@@ -66,8 +263,27 @@ def spectral_helper(
     else:
         freqcenter = pad_to // 2
 
+    if mode == "psd":
+        return stream_psd(
+            x,
+            NFFT,
+            Fs,
+            detrend_func,
+            window,
+            noverlap,
+            pad_to,
+            scale_by_freq,
+            skip_fft,
+            numFreqs,
+            freqcenter,
+            max_columns,
+            time_pool,
+        )
+
     results = []
 
+    if not skip_fft:
+        x = carry_overlap(x, NFFT, noverlap)
     for i in x:
         if i is None:
             break
@@ -132,6 +348,8 @@ def specgram(
     mode=None,
     scale=None,
     skip_fft=False,
+    max_columns=None,
+    time_pool="max",
 ):
     if NFFT is None:
         NFFT = 256  # same default as in mlab.specgram()
@@ -164,12 +382,15 @@ def specgram(
         scale_by_freq=scale_by_freq,
         mode=mode,
         skip_fft=skip_fft,
+        max_columns=max_columns,
+        time_pool=time_pool,
     )
     if scale == "linear":
         Z = spec
     elif scale == "dB":
         if mode is None or mode == "default" or mode == "psd":
-            Z = 10.0 * np.log10(spec)
+            Z = np.log10(spec, out=spec)
+            Z *= 10.0
         else:
             Z = 20.0 * np.log10(spec)
     else:
@@ -180,6 +401,9 @@ def specgram(
     if xextent is None:
         # padding is needed for first and last segment:
         pad_xextent = (NFFT - noverlap) / Fs / 2
+        if len(t) > 1:
+            # columns may be pooled over several windows.
+            pad_xextent = (t[1] - t[0]) / 2
         xextent = np.min(t) - pad_xextent, np.max(t) + pad_xextent
     xmin, xmax = xextent
     freqs += Fc
@@ -189,6 +413,55 @@ def specgram(
     return Z, extent
 
 
+class SpectrogramFigure:
+    """A spectrogram figure, which can be reused to plot many spectrograms."""
+
+    def __init__(self, cmap, ytics, bare, width, height):
+        self.cmap = cmap
+        self.ytics = ytics
+        self.bare = bare
+        self.fig = plt.figure()
+        self.fig.set_size_inches(width, height)
+        self.axes = self.fig.add_subplot(111)
+        self.axes.set_xlabel("time (s)")
+        self.axes.set_ylabel("freq (MHz)")
+        self.im = None
+
+    def plot(self, Z, extent, spectrogram_filename, dpi):
+        if self.im is None:
+            self.im = self.axes.imshow(Z, cmap=self.cmap, extent=extent, origin="upper")
+            self.axes.axis("auto")
+            self.axes.minorticks_on()
+            self.axes.locator_params(axis="y", nbins=self.ytics)
+            if self.bare:
+                self.axes.set_axis_off()
+                self.fig.subplots_adjust(
+                    top=1, bottom=0, right=1, left=0, hspace=0, wspace=0
+                )
+                self.axes.margins(0, 0)
+                self.axes.xaxis.set_major_locator(plt.NullLocator())
+                self.axes.yaxis.set_major_locator(plt.NullLocator())
+        else:
+            self.im.set_data(Z)
+            self.im.set_extent(extent)
+            self.im.autoscale()
+        # write atomically, so a partial image is never seen.
+        tmp_filename = os.path.join(
+            os.path.dirname(spectrogram_filename),
+            "." + os.path.basename(spectrogram_filename),
+        )
+        self.fig.savefig(tmp_filename, dpi=dpi)
+        os.replace(tmp_filename, spectrogram_filename)
+        print(f"wrote {spectrogram_filename}")
+
+    def close(self):
+        # must call this in specific order to avoid pyplot leak
+        if self.im is not None:
+            self.im.remove()
+        self.fig.clear()
+        plt.close(self.fig)
+
+
 def plot_spectrogram(
     x,
     spectrogram_filename,
@@ -203,40 +476,56 @@ def plot_spectrogram(
     width,
     height,
     dpi,
+    time_pool="none",
+    figure=None,
+    direct_png=False,
+    db_min=None,
+    db_max=None,
+    db_percentile=0,
 ):
-    fig = plt.figure()
-    fig.set_size_inches(width, height)
-    axes = fig.add_subplot(111)
-    axes.set_xlabel("time (s)")
-    axes.set_ylabel("freq (MHz)")
+    max_columns = None
+    if time_pool != "none":
+        # pool over time to no more than one column per pixel.
+        max_columns = int(width * dpi)
     Z, extent = specgram(
-        x, NFFT=nfft, Fs=fs, Fc=fc, noverlap=noverlap, skip_fft=skip_fft
-    )
-    im = axes.imshow(Z, cmap=cmap, extent=extent, origin="upper")
-    axes.axis("auto")
-    axes.minorticks_on()
-    plt.locator_params(axis="y", nbins=ytics)
-
-    if bare:
-        axes.set_axis_off()
-        plt.subplots_adjust(top=1, bottom=0, right=1, left=0, hspace=0, wspace=0)
-        plt.margins(0, 0)
-        axes.xaxis.set_major_locator(plt.NullLocator())
-        axes.yaxis.set_major_locator(plt.NullLocator())
-
-    plt.sci(im)
-    plt.savefig(spectrogram_filename, dpi=dpi)
-    print(f"wrote {spectrogram_filename}")
-    # must call this in specific order to avoid pyplot leak
-    # axes.images.remove(im)
-    im.remove()
-    fig.clear()
-    plt.close()
-    plt.cla()
-    plt.clf()
-
-
-def process_recording(args, recording):
+        x,
+        NFFT=nfft,
+        Fs=fs,
+        Fc=fc,
+        noverlap=noverlap,
+        skip_fft=skip_fft,
+        max_columns=max_columns,
+        time_pool=time_pool,
+    )
+    if bare and direct_png:
+        # no axes to draw, so colormap Z straight to an image of the same size.
+        write_spectrogram_png(
+            spectrogram_filename,
+            Z,
+            cmap,
+            size=(int(width * dpi), int(height * dpi)),
+            vmin=db_min,
+            vmax=db_max,
+            percentile=db_percentile,
+        )
+        print(f"wrote {spectrogram_filename}")
+        return
+    if figure is not None:
+        figure.plot(Z, extent, spectrogram_filename, dpi)
+        return
+    figure = SpectrogramFigure(cmap, ytics, bare, width, height)
+    figure.plot(Z, extent, spectrogram_filename, dpi)
+    figure.close()
+
+
+def output_current(recording, spectrogram_filename):
+    return os.path.exists(spectrogram_filename) and os.path.getmtime(
+        spectrogram_filename
+    ) >= os.path.getmtime(recording)
+
+
+def process_recording(args, recording, figure=None):
+    """Plot a spectrogram of a recording, returning the recording's size if processed."""
     (
         freq_center,
         sample_rate,
@@ -248,17 +537,20 @@ def process_recording(args, recording):
     spectrogram_filename = replace_ext(recording, args.iext, all_ext=True)
     if args.skip_exist and os.path.exists(spectrogram_filename):
         print(f"skipping {recording}")
-        return
+        return None
+    if args.batch and output_current(recording, spectrogram_filename):
+        print(f"skipping {recording}, {spectrogram_filename} is newer")
+        return None
     if is_fft(recording):
         # always in complex float format.
         sample_dtype = np.dtype([("i", "float32"), ("q", "float32")])
         if not args.skip_fft:
             print(f"skipping precomputed FFT {recording}")
-            return
+            return None
     else:
         if args.skip_fft:
             print(f"{recording} not a precomputed FFT, skipping")
-            return
+            return None
     print(f"processing {recording}")
     samples = read_recording(
         recording,
@@ -267,6 +559,9 @@ def process_recording(args, recording):
         sample_len,
         skip_sample_secs=args.skip_sample_secs,
         max_sample_secs=args.max_sample_secs,
+        # skip_fft returns views of each chunk, so they must not be overwritten.
+        reuse_buffer=not args.skip_fft,
+        read_ahead_workers=args.read_ahead_workers,
     )
     plot_spectrogram(
         samples,
@@ -282,14 +577,74 @@ def process_recording(args, recording):
         args.width,
         args.height,
         args.dpi,
+        time_pool=args.time_pool,
+        figure=figure,
+        direct_png=args.direct_png,
+        db_min=args.db_min,
+        db_max=args.db_max,
+        db_percentile=args.db_percentile,
+    )
+    return os.path.getsize(recording)
+
+
+# In batch mode, each worker process plots with one figure.
+WORKER_FIGURE = None
+
+
+def init_batch_worker(args):
+    global WORKER_FIGURE
+    if args.bare and args.direct_png:
+        WORKER_FIGURE = None
+        return
+    WORKER_FIGURE = SpectrogramFigure(
+        args.cmap, args.ytics, args.bare, args.width, args.height
     )
 
 
+def batch_process_recording(args, recording):
+    try:
+        return process_recording(args, recording, figure=WORKER_FIGURE)
+    except Exception as err:  # pylint: disable=broad-except
+        print(f"failed to process {recording}: {err}")
+        return None
+
+
 def process_all_recordings(args):
     if os.path.isdir(args.recording):
         recordings = get_nondot_files(args.recording)
     else:
         recordings = [args.recording]
+    if args.batch:
+        start_time = time.time()
+        results = []
+        if args.workers == 1:
+            init_batch_worker(args)
+            for recording in sorted(recordings):
+                results.append(batch_process_recording(args, recording))
+            if WORKER_FIGURE is not None:
+                WORKER_FIGURE.close()
+        else:
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=args.workers,
+                initializer=init_batch_worker,
+                initargs=(args,),
+            ) as executor:
+                results = list(
+                    executor.map(
+                        batch_process_recording,
+                        [args] * len(recordings),
+                        sorted(recordings),
+                    )
+                )
+        elapsed = time.time() - start_time
+        processed = [result for result in results if result is not None]
+        mbytes = sum(processed) / 1e6
+        print(
+            f"processed {len(processed)} of {len(recordings)} recordings "
+            f"({mbytes:.1f}MB) in {elapsed:.1f}s: "
+            f"{len(processed) / elapsed:.2f} recordings/sec, {mbytes / elapsed:.2f} MB/sec"
+        )
+        return results
     if args.workers == 1:
         for recording in sorted(recordings):
             process_recording(args, recording)
@@ -300,6 +655,66 @@ def process_all_recordings(args):
             for recording in sorted(recordings):
                 executor.submit(process_recording, args, recording)
             executor.shutdown(wait=True)
+    return None
+
+
+def process_new_recordings(args, recordings, index, executor=None):
+    """Process recordings not yet in index, adding them to it (even if they fail)."""
+    recordings = sorted(recording for recording in recordings if recording not in index)
+    if executor is None:
+        for recording in recordings:
+            batch_process_recording(args, recording)
+            index.add(recording)
+        return recordings
+    futures = {
+        executor.submit(batch_process_recording, args, recording): recording
+        for recording in recordings
+    }
+    for future in concurrent.futures.as_completed(futures):
+        index.add(futures[future])
+    return recordings
+
+
+def watch_recordings(args, polls=None):
+    """Process each recording once, as it is completed.
+
+    If polls is set, stop after that many polls for new recordings.
+    """
+    index_file = args.watch_index
+    if not index_file:
+        index_file = os.path.join(args.recording, PROCESSED_INDEX)
+    index = ProcessedIndex(index_file, args.recording)
+    watcher = RecordingWatcher(
+        args.recording, poll_interval=args.watch_poll, use_inotify=args.watch_inotify
+    )
+    executor = None
+    if args.workers == 1:
+        init_batch_worker(args)
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=args.workers,
+            initializer=init_batch_worker,
+            initargs=(args,),
+        )
+    print(f"watching {args.recording}, {len(index)} recordings already processed")
+    try:
+        # the first poll lists all existing recordings.
+        recordings = watcher.poll()
+        index.retain(recordings)
+        while True:
+            process_new_recordings(args, recordings, index, executor)
+            if polls is not None:
+                if not polls:
+                    break
+                polls -= 1
+            recordings = watcher.poll()
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
+        elif WORKER_FIGURE is not None:
+            WORKER_FIGURE.close()
+        watcher.close()
+        index.close()
 
 
 def argument_parser():
@@ -361,7 +776,41 @@ def argument_parser():
         "--no-skip-fft", dest="skip_fft", action="store_false", help="calculate FFT"
     )
     parser.add_argument(
-        "--loop", dest="loop", default=0, type=int, help="if > 0, run in a loop"
+        "--loop",
+        dest="loop",
+        default=0,
+        type=int,
+        help="if > 0, rescan all recordings every loop seconds (see --watch)",
+    )
+    parser.add_argument(
+        "--watch",
+        dest="watch",
+        action="store_true",
+        help="watch the recording directory, processing each recording once when completed",
+    )
+    parser.add_argument(
+        "--watch_index",
+        default="",
+        type=str,
+        help=f"with --watch, file listing recordings already processed (default {PROCESSED_INDEX} in the recording directory)",
+    )
+    parser.add_argument(
+        "--watch_poll",
+        default=POLL_INTERVAL,
+        type=float,
+        help="with --watch, seconds between polls of the recording directory",
+    )
+    parser.add_argument(
+        "--watch_inotify",
+        dest="watch_inotify",
+        action="store_true",
+        help="with --watch, use inotify where available",
+    )
+    parser.add_argument(
+        "--no-watch_inotify",
+        dest="watch_inotify",
+        action="store_false",
+        help="with --watch, poll directory mtimes instead of using inotify",
     )
     parser.add_argument("--width", default=11, type=int, help="plot width")
     parser.add_argument("--height", default=8, type=int, help="plot height")
@@ -378,13 +827,66 @@ def argument_parser():
         type=float,
         help="max n seconds worth of samples (default all samples)",
     )
-    parser.set_defaults(bare=False, skip_exist=False, skip_fft=False)
+    parser.add_argument(
+        "--read_ahead_workers",
+        default=1,
+        type=int,
+        help="number of threads decompressing recordings ahead of FFT processing (more than 1 only used for seekable zst recordings)",
+    )
+    parser.add_argument(
+        "--batch",
+        dest="batch",
+        action="store_true",
+        help="batch mode: reuse one figure per worker, skip recordings with newer spectrograms, and report throughput",
+    )
+    parser.add_argument(
+        "--time_pool",
+        default="none",
+        choices=TIME_POOLS,
+        help="pool FFT windows over time (max or mean) to the image width, bounding memory use for long recordings",
+    )
+    parser.add_argument(
+        "--direct_png",
+        dest="direct_png",
+        action="store_true",
+        help="with --bare, write images directly with a colormap lookup table instead of plotting them",
+    )
+    parser.add_argument(
+        "--db_min",
+        default=None,
+        type=float,
+        help="with --direct_png, dB value mapped to the bottom of the colormap (default from --db_percentile)",
+    )
+    parser.add_argument(
+        "--db_max",
+        default=None,
+        type=float,
+        help="with --direct_png, dB value mapped to the top of the colormap (default from --db_percentile)",
+    )
+    parser.add_argument(
+        "--db_percentile",
+        default=0,
+        type=float,
+        help="with --direct_png, percentile of dB values clipped at each end of the colormap when --db_min/--db_max are not set",
+    )
+    parser.set_defaults(
+        bare=False,
+        skip_exist=False,
+        skip_fft=False,
+        batch=False,
+        direct_png=False,
+        watch=False,
+        watch_inotify=True,
+    )
     return parser
 
 
 def main():
     parser = argument_parser()
     args = parser.parse_args()
+    if args.watch:
+        watch_recordings(args)
+        return
     while True:
         process_all_recordings(args)
         if not args.loop:
@@ -0,0 +1,75 @@
+import functools
+import os
+
+import matplotlib
+import numpy as np
+from PIL import Image
+
+LUT_SIZE = 256
+
+
+@functools.lru_cache(maxsize=None)
+def colormap_lut(cmap):
+    """Return a LUT_SIZE x 3 uint8 RGB lookup table for a matplotlib colormap."""
+    colors = matplotlib.colormaps[cmap](np.linspace(0, 1, LUT_SIZE))
+    return np.round(colors[:, :3] * 255).astype(np.uint8)
+
+
+def value_range(values, vmin=None, vmax=None, percentile=0):
+    """Return the range of values to map to the colormap.
+
+    Unset bounds are taken from the finite values, at percentile and
+    100 - percentile (so 0 is the same as matplotlib's autoscaling).
+    """
+    if vmin is None or vmax is None:
+        finite = values[np.isfinite(values)]
+        if not finite.size:
+            return (0, 1)
+        if percentile:
+            low, high = np.percentile(finite, (percentile, 100 - percentile))
+        else:
+            low, high = finite.min(), finite.max()
+        if vmin is None:
+            vmin = low
+        if vmax is None:
+            vmax = high
+    return (vmin, vmax)
+
+
+def quantize(values, vmin, vmax):
+    """Quantize values to uint8 LUT indexes (non-finite values map to 0)."""
+    scale = (LUT_SIZE - 1) / (vmax - vmin) if vmax > vmin else 0
+    index = np.nan_to_num((values - vmin) * scale, nan=0, posinf=LUT_SIZE - 1, neginf=0)
+    np.clip(index, 0, LUT_SIZE - 1, out=index)
+    return index.astype(np.uint8)
+
+
+def write_spectrogram_png(
+    filename, values, cmap, size=None, vmin=None, vmax=None, percentile=0
+):
+    """Write a 2D array as a colormapped image, without matplotlib figures.
+
+    Args:
+        filename: str, image to write (atomically, via a dotfile).
+        values: 2D numpy array, first row at the top of the image.
+        cmap: str, matplotlib colormap name.
+        size: (width, height) in pixels to resize to (bilinear), or None.
+        vmin, vmax: float, fixed range of values to map to the colormap.
+        percentile: float, percentile range of values to use when vmin or vmax are not set.
+    """
+    values = np.asarray(values, dtype=np.float32)
+    vmin, vmax = value_range(values, vmin, vmax, percentile)
+    if size is not None and (size[1], size[0]) != values.shape:
+        values = np.nan_to_num(values, nan=vmin, posinf=vmax, neginf=vmin)
+        values = np.asarray(
+            Image.fromarray(values, mode="F").resize(size, Image.BILINEAR)
+        )
+    rgb = colormap_lut(cmap)[quantize(values, vmin, vmax)]
+    tmp_filename = os.path.join(
+        os.path.dirname(filename), "." + os.path.basename(filename)
+    )
+    image_format = Image.registered_extensions().get(os.path.splitext(filename)[1])
+    Image.fromarray(rgb, mode="RGB").save(
+        tmp_filename, format=image_format, compress_level=1
+    )
+    os.replace(tmp_filename, filename)
@@ -1,4 +1,5 @@
 #!/usr/bin/python3
+import fnmatch
 import os
 import re
 from pathlib import Path
@@ -17,7 +18,11 @@ SCAN_FROLL = 1e6
 # UHD_IMAGES_DIR=/usr/share/uhd/images ./examples/rx_samples_to_file --args num_recv_frames=128,recv_frame_size=16360 --file test.gz --nsamps 200000000 --rate 20000000 --freq 101e6 --spb 20000000
 ETTUS_ARGS = "num_recv_frames=960,recv_frame_size=16360"
 ETTUS_ANT = "TX/RX"
+ZST_INDEX_EXT = ".idx"
+RECORDING_GLOB = "*.s*.*"
 SAMPLE_FILENAME_RE = re.compile(r"^.+_([0-9]+)Hz_([0-9]+)sps\.(s\d+|raw).*$")
+# uncompressed recordings, which RECORDING_GLOB does not match.
+UNCOMPRESSED_RECORDING_RE = re.compile(r"^.+_[0-9]+Hz_[0-9]+sps\.(s\d+|raw)$")
 SAMPLE_DTYPES = {
     "s8": ("<i1", "signed-integer"),
     "s16": ("<i2", "signed-integer"),
@@ -97,9 +102,18 @@ def parse_filename(filename):
     )
 
 
-def get_nondot_files(filedir, glob="*.s*.*"):
-    return [
-        str(path)
-        for path in Path(filedir).rglob(glob)
-        if not os.path.basename(path).startswith(".")
-    ]
+def is_nondot_file(filename, glob=RECORDING_GLOB):
+    basename = os.path.basename(filename)
+    if basename.startswith(".") or basename.endswith(ZST_INDEX_EXT):
+        return False
+    if fnmatch.fnmatchcase(basename, glob):
+        return True
+    return glob == RECORDING_GLOB and bool(UNCOMPRESSED_RECORDING_RE.match(basename))
+
+
+def get_nondot_files(filedir, glob=RECORDING_GLOB):
+    if glob == RECORDING_GLOB:
+        paths = (path for path in Path(filedir).rglob("*") if path.is_file())
+    else:
+        paths = Path(filedir).rglob(glob)
+    return [str(path) for path in paths if is_nondot_file(path, glob)]
@@ -1,8 +1,12 @@
 import time
+
+import numpy as np
 import pytest
 from falcon import testing
+from prometheus_client import CollectorRegistry
 
 from gamutrf import api
+from gamutrf.birdseye_rssi import RSSI_HEADER
 
 
 class FakeArgs:
@@ -10,6 +14,8 @@ class FakeArgs:
         self.name = "test"
         self.mqtt_server = ""
         self.qsize = 2
+        self.post_qsize = 2
+        self.post_workers = 1
         self.sdr = "/dev/null"
         self.path = ""
         self.gain = -40
@@ -20,12 +26,23 @@ class FakeArgs:
         self.antenna = "0"
         self.rssi_throttle = 1
         self.rssi_threshold = -100
+        self.rssi_interval = 0
         self.mean_window = 100
+        self.zst_frame_secs = 0
+        self.request_ttl = 0
+        self.compression = "zstd"
+        self.zst_level = 1
+        self.zst_threads = 0
+        self.zst_long = False
+
+
+def fake_api():
+    return api.API(FakeArgs(), api.init_prom_vars(CollectorRegistry()))
 
 
 @pytest.fixture(scope="module")
 def client():
-    app = api.API(FakeArgs())
+    app = fake_api()
     return testing.TestClient(app.app)
 
 
@@ -38,20 +55,133 @@ def test_routes(client):
     assert result.status_code == 200
 
 
+def test_record_coalesced():
+    app = fake_api()
+    client = testing.TestClient(app.app)
+    result = client.simulate_get("/v1/record/100000000/20000000/20000000")
+    assert result.json["status"] == "Requsted recording"
+    result = client.simulate_get("/v1/record/105000000/40000000/20000000")
+    assert result.json["status"] == "Coalesced with queued recording"
+    result = client.simulate_get("/v1/record/200000000/20000000/20000000")
+    assert result.status_code == 200
+    result = client.simulate_get("/v1/record/300000000/20000000/20000000")
+    assert result.status_code == 400
+    result = client.simulate_get(
+        "/v1/record/300000000/20000000/20000000", params={"priority": "1"}
+    )
+    assert result.status_code == 200
+    assert app.q.get()["center_freq"] == 300000000
+    request = app.q.get()
+    assert request["center_freq"] == 100000000
+    assert request["sample_count"] == 40000000
+    assert app.q.empty()
+
+
+def test_request_scheduler():
+    prom_vars = api.init_prom_vars(CollectorRegistry())
+    scheduler = api.RequestScheduler(2, prom_vars, ttl=0.1)
+    request = {"center_freq": 1e8, "sample_count": 1e6, "sample_rate": 1e6}
+    assert scheduler.put(dict(request)) == api.REQUEST_QUEUED
+    time.sleep(0.2)
+    assert scheduler.empty()
+    assert scheduler.put(dict(request)) == api.REQUEST_QUEUED
+    assert scheduler.get() == request
+    record_requests = prom_vars["record_requests"]
+    assert record_requests.labels(outcome="expired")._value.get() == 1
+    assert record_requests.labels(outcome="queued")._value.get() == 2
+    assert prom_vars["request_queue_depth"]._value.get() == 0
+    # requests at different sample rates are not coalesced.
+    assert scheduler.put(dict(request)) == api.REQUEST_QUEUED
+    wide_request = dict(request, sample_count=2e6, sample_rate=2e6)
+    assert scheduler.put(dict(wide_request)) == api.REQUEST_QUEUED
+    assert scheduler.get() == request
+    assert scheduler.get() == wide_request
+
+
+def test_observe_compression():
+    registry = CollectorRegistry()
+    app = api.API(FakeArgs(), api.init_prom_vars(registry))
+    app.observe_compression(None)
+    app.observe_compression(
+        {"raw_bytes": int(4e6), "compressed_bytes": int(1e6), "seconds": 0.04}
+    )
+    assert registry.get_sample_value("recording_raw_bytes_total") == 4e6
+    assert registry.get_sample_value("recording_compression_ratio_sum") == 4
+    assert registry.get_sample_value("recording_compression_mbps_sum") == 100
+
+
+class FakeRSSISocket:
+    def __init__(self, datagrams, q):
+        self.datagrams = datagrams
+        self.q = q
+
+    def recv_into(self, buffer):
+        datagram = self.datagrams.pop(0)
+        buffer[: len(datagram)] = datagram
+        if not self.datagrams:
+            self.q.put({"center_freq": 2e6, "sample_count": 1e6})
+        return len(datagram)
+
+
 def test_report_rssi():
-    app = api.API(FakeArgs())
-    app.report_rssi({"center_freq": 1e6}, -35, time.time())
+    app = fake_api()
+    app.report_rssi({"center_freq": 1e6}, {"rssi": -35}, time.time())
+
+
+def test_rssi_stats():
+    rssi_stats = api.RSSIStats(-50)
+    assert rssi_stats.summary() is None
+    rssi_stats.add(np.array([-60, -70, np.nan, 1000], dtype=np.float32))
+    assert rssi_stats.summary() is None
+    rssi_stats.add(np.arange(-100, 0, dtype=np.float32))
+    rssi_stats.add(np.array([np.inf], dtype=np.float32))
+    summary = rssi_stats.summary()
+    assert summary["rssi"] == -1
+    assert summary["rssi_count"] == 100
+    assert summary["rssi_mean"] == -50.5
+    assert summary["rssi_p50"] == -50.5
+    assert rssi_stats.summary() is None
+
+
+def rssi_datagram(seq, timestamp, values):
+    return RSSI_HEADER.pack(seq, timestamp, len(values)) + values.tobytes()
+
+
+def test_process_rssi():
+    app = fake_api()
+    reports = []
+    app.report_rssi = lambda _record_args, stats, reported_time: reports.append(
+        (stats, reported_time)
+    )
+    values = np.arange(-100, 0, dtype=np.float32)
+    datagrams = [
+        rssi_datagram(0, 1.0, values[:50]),
+        # malformed, and then a gap in sequence numbers.
+        rssi_datagram(1, 2.0, values[50:])[:-1],
+        rssi_datagram(3, 3.0, values[50:]),
+    ]
+    app.process_rssi({"center_freq": 1e6}, FakeRSSISocket(datagrams, app.q))
+    assert [stats["rssi"] for stats, _ in reports] == [-51, -1]
+    assert [stats["rssi_count"] for stats, _ in reports] == [50, 50]
+    assert [reported_time for _, reported_time in reports] == [1.0, 3.0]
+    assert app.prom_vars["rssi_datagrams_lost"]._value.get() == 2
 
 
-def test_serve_recording():
-    app = api.API(FakeArgs())
+def test_serve_recording(tmp_path):
+    app = fake_api()
     app.q.put({"center_freq": 1e6, "sample_count": 1e6})
     app.sdr_recorder = app.sdr_recorder()
+    app.arguments.path = str(tmp_path)
+    app.arguments.sdr = "null"
     app.serve_recording(app.record)
+    assert app.prom_vars["post_process_backlog"]._value.get() == 1
+    assert app.prom_vars["recording_raw_bytes"]._value.get() == 0
+    app.post_process(*app.post_q.get())
+    assert app.prom_vars["post_process_backlog"]._value.get() == 0
 
 
 def test_serve_rssi():
-    app = api.API(FakeArgs())
+    app = fake_api()
     app.q.put({"center_freq": 1e6, "sample_count": 1e6, "sample_rate": 1e6})
     app.sdr_recorder = app.sdr_recorder()
     app.serve_rssi()
@@ -0,0 +1,138 @@
+#!/usr/bin/python3
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import zstandard
+
+from gamutrf.capture_worker import capture
+from gamutrf.capture_worker import FileSource
+from gamutrf.capture_worker import SoapySource
+from gamutrf.seekable_zstd import read_zst_index
+
+
+class FakeStreamResult:
+    def __init__(self, ret):
+        self.ret = ret
+
+
+class FakeSoapyDevice:
+    def __init__(self, args):
+        self.args = args
+        # samples (or error code) to return from each read.
+        self.reads = []
+        self.gains = []
+
+    def setupStream(self, direction, fmt, channels):
+        return "stream"
+
+    def setSampleRate(self, direction, channel, rate):
+        return
+
+    def setBandwidth(self, direction, channel, bw):
+        return
+
+    def setFrequency(self, direction, channel, freq):
+        return
+
+    def setGainMode(self, direction, channel, agc):
+        return
+
+    def setGain(self, direction, channel, gain):
+        self.gains.append(gain)
+
+    def activateStream(self, stream):
+        return
+
+    def deactivateStream(self, stream):
+        return
+
+    def closeStream(self, stream):
+        return
+
+    def readStream(self, stream, buffers, samples, timeoutUs=0):
+        ret = self.reads.pop(0)
+        if ret > 0:
+            ret = min(ret, samples)
+            buffers[0][: ret * 2] = 1
+        return FakeStreamResult(ret)
+
+
+class FakeSoapySDR:
+    SOAPY_SDR_RX = 1
+    SOAPY_SDR_CS16 = "CS16"
+    SOAPY_SDR_TIMEOUT = -1
+    SOAPY_SDR_STREAM_ERROR = -2
+    SOAPY_SDR_OVERFLOW = -4
+    Device = FakeSoapyDevice
+
+    @staticmethod
+    def errToStr(err):
+        return f"error {err}"
+
+
+class CaptureWorkerTestCase(unittest.TestCase):
+    def test_capture(self):
+        samples = np.arange(1000 * 2, dtype=np.int16)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            sample_file = os.path.join(tmpdir, "samples.s16")
+            samples.tofile(sample_file)
+            recording = os.path.join(tmpdir, "recording.s16.zst")
+            # more samples than the file has, so the source starts again at EOF.
+            for zst_frame_bytes in (0, 1024):
+                source = FileSource(sample_file)
+                request = {
+                    "file": recording,
+                    "freq": 100e6,
+                    "rate": 1e6,
+                    "count": 2500,
+                    "zst_frame_bytes": zst_frame_bytes,
+                }
+                samples_recorded, stats = capture(source, request)
+                self.assertEqual(2500, samples_recorded)
+                self.assertEqual(2500 * 4, stats["raw_bytes"])
+                self.assertEqual(os.path.getsize(recording), stats["compressed_bytes"])
+                with open(recording, "rb") as f:
+                    data = zstandard.ZstdDecompressor().stream_reader(f).read()
+                self.assertTrue(
+                    np.array_equal(
+                        np.concatenate((samples, samples, samples[:1000])),
+                        np.frombuffer(data, dtype=np.int16),
+                    )
+                )
+                source.close()
+            self.assertEqual(2500 * 4, read_zst_index(recording)["total_bytes"])
+
+    def test_soapy_source(self):
+        source = SoapySource("fake", soapy=FakeSoapySDR)
+        source.tune(100e6, 1e6, None, False)
+        source.tune(100e6, 1e6, 30, False)
+        self.assertEqual([30], source.device.gains)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            recording = os.path.join(tmpdir, "recording.s16.zst")
+            request = {"file": recording, "freq": 100e6, "rate": 1e6, "count": 2500}
+            # an overflow and a timeout partway through are counted, not fatal.
+            source.device.reads = [1000, FakeSoapySDR.SOAPY_SDR_OVERFLOW, 1000]
+            source.device.reads += [FakeSoapySDR.SOAPY_SDR_TIMEOUT, 1000]
+            samples_recorded, stats = capture(source, request)
+            self.assertEqual(2500, samples_recorded)
+            self.assertEqual(2500 * 4, stats["raw_bytes"])
+            self.assertEqual(1, source.overflows)
+            self.assertEqual(1, source.timeouts)
+            with open(recording, "rb") as f:
+                data = zstandard.ZstdDecompressor().stream_reader(f).read()
+            self.assertTrue(
+                np.array_equal(
+                    np.ones(2500 * 2, dtype=np.int16),
+                    np.frombuffer(data, dtype=np.int16),
+                )
+            )
+            source.device.reads = [1000, FakeSoapySDR.SOAPY_SDR_STREAM_ERROR]
+            with self.assertRaises(IOError):
+                capture(source, request)
+        source.close()
+
+
+if __name__ == "__main__":  # pragma: no cover
+    unittest.main()
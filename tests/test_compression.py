@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import zstandard
+
+from gamutrf.compression import CompressionOptions
+from gamutrf.sample_reader import get_reader
+from gamutrf.seekable_zstd import read_zst_index
+
+
+class CompressionTestCase(unittest.TestCase):
+    def test_options(self):
+        options = CompressionOptions(level=3, threads=2, long_distance=True)
+        self.assertEqual(".zst", options.ext())
+        self.assertEqual(
+            options.request(),
+            CompressionOptions.from_request(options.request()).request(),
+        )
+        self.assertEqual("", CompressionOptions(codec="none").ext())
+        with self.assertRaises(ValueError):
+            CompressionOptions(codec="gzip")
+
+    def test_writer(self):
+        samples = np.arange(2**16, dtype=np.int16) % 256
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for options, frame_bytes in (
+                (CompressionOptions(), 0),
+                (CompressionOptions(level=3, threads=2, long_distance=True), 0),
+                (CompressionOptions(threads=2), 2**14),
+                (CompressionOptions(codec="none"), 0),
+            ):
+                recording = os.path.join(tmpdir, "recording.s16" + options.ext())
+                writer = options.writer(recording, frame_bytes)
+                for chunk in np.split(samples, 4):
+                    writer.write(chunk)
+                stats = writer.close()
+                self.assertEqual(samples.nbytes, stats["raw_bytes"])
+                self.assertEqual(os.path.getsize(recording), stats["compressed_bytes"])
+                self.assertGreater(stats["seconds"], 0)
+                if options.codec == "none":
+                    self.assertEqual(samples.nbytes, stats["compressed_bytes"])
+                else:
+                    self.assertLess(stats["compressed_bytes"], samples.nbytes)
+                    # every frame is checksummed.
+                    with open(recording, "rb") as f:
+                        params = zstandard.get_frame_parameters(f.read(18))
+                    self.assertTrue(params.has_checksum)
+                if frame_bytes:
+                    self.assertEqual(
+                        samples.nbytes // frame_bytes,
+                        len(read_zst_index(recording)["frames"]),
+                    )
+                with get_reader(recording)(recording) as infile:
+                    self.assertTrue(
+                        np.array_equal(
+                            samples, np.frombuffer(infile.read(), dtype=np.int16)
+                        )
+                    )
+                os.remove(recording)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    unittest.main()
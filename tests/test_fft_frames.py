@@ -0,0 +1,261 @@
+#!/usr/bin/python3
+import json
+import os
+import tempfile
+import time
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from gamutrf.fft_frames import decode_json_lines
+from gamutrf.fft_frames import FFTFrameAccumulator
+from gamutrf.fft_frames import fft_df
+from gamutrf.fft_frames import resample_fft
+from gamutrf.fft_frames import RunningFFTMean
+from gamutrf.utils import SCAN_FRES
+
+# timings are only run (and printed) if set, as they take seconds.
+BENCHMARK = os.getenv("GAMUTRF_BENCHMARK", "")
+
+
+def legacy_decode_json_lines(lines):
+    records = []
+    scan_config = None
+    for line in lines:
+        record = json.loads(line.strip())
+        ts = float(record["ts"])
+        sweep_start = float(record["sweep_start"])
+        scan_config = record["config"]
+        records.extend(
+            [
+                {
+                    "ts": ts,
+                    "freq": float(freq),
+                    "db": float(db),
+                    "sweep_start": sweep_start,
+                }
+                for freq, db in record["buckets"].items()
+            ]
+        )
+    return (pd.DataFrame(records), scan_config)
+
+
+def legacy_resample_fft(df):
+    df["freq"] = (df["freq"] / SCAN_FRES).round() * SCAN_FRES / 1e6
+    df = df.set_index("freq")
+    df["db"] = df.groupby(["freq"])["db"].mean()
+    df = df.reset_index().drop_duplicates(subset=["freq"])
+    return df.sort_values("freq")
+
+
+def write_scan_log(scan_log, frames, freq_start, freq_end, step, line_buckets):
+    scan_config = {"freq_start": freq_start, "freq_end": freq_end}
+    rng = np.random.default_rng(seed=0)
+    with open(scan_log, "w", encoding="utf-8") as f:
+        for frame in range(frames):
+            sweep_start = 1000 + frame
+            freqs = np.arange(freq_start, freq_end, step)
+            for i in range(0, len(freqs), line_buckets):
+                line_freqs = freqs[i : i + line_buckets]
+                output = {
+                    "ts": sweep_start + i / len(freqs),
+                    "sweep_start": sweep_start,
+                    "config": scan_config,
+                    "buckets": {
+                        str(freq): float(db)
+                        for freq, db in zip(
+                            line_freqs, rng.uniform(-80, -20, len(line_freqs))
+                        )
+                    },
+                }
+                f.write(json.dumps(output) + "\n")
+
+
+def read_scan_log_frames(scan_log):
+    frames = {}
+    with open(scan_log, "r", encoding="utf-8") as f:
+        for line in f:
+            sweep_start = json.loads(line)["sweep_start"]
+            frames.setdefault(sweep_start, []).append(line)
+    return list(frames.values())
+
+
+class FFTFramesTestCase(unittest.TestCase):
+    def test_decode_json_lines(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            scan_log = os.path.join(tempdir, "scan.log")
+            write_scan_log(scan_log, 2, 100e6, 110e6, 1e4, 256)
+            for lines in read_scan_log_frames(scan_log):
+                df, scan_config = decode_json_lines(lines)
+                legacy_df, legacy_scan_config = legacy_decode_json_lines(lines)
+                self.assertEqual(legacy_scan_config, scan_config)
+                self.assertEqual(list(legacy_df.columns), list(df.columns))
+                self.assertEqual(np.float32, df["db"].dtype)
+                for col in ("ts", "freq", "sweep_start"):
+                    self.assertTrue(np.array_equal(legacy_df[col], df[col]), col)
+                self.assertTrue(np.allclose(legacy_df["db"], df["db"], atol=1e-4))
+
+    def test_decode_json_lines_invalid(self):
+        self.assertRaises(ValueError, decode_json_lines, ["not json"])
+        self.assertRaises(
+            ValueError,
+            decode_json_lines,
+            [
+                json.dumps(
+                    {"ts": 1, "sweep_start": 1, "config": {}, "buckets": {"x": 1}}
+                )
+            ],
+        )
+
+    def test_frame_accumulator(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            scan_log = os.path.join(tempdir, "scan.log")
+            # FFT buckets finer than SCAN_FRES, so several share each slot.
+            write_scan_log(scan_log, 3, 100e6, 110e6, 4e3, 256)
+            frames = read_scan_log_frames(scan_log)
+            accumulator = FFTFrameAccumulator()
+            accumulated_frames = []
+            for lines in frames:
+                for line in lines:
+                    df, scan_config = decode_json_lines([line])
+                    accumulated_frames.extend(accumulator.add(df, scan_config))
+            # last sweep not complete until the next starts.
+            self.assertEqual(len(frames) - 1, len(accumulated_frames))
+            for lines, frame_df in zip(frames, accumulated_frames):
+                df, _ = decode_json_lines(lines)
+                df["freq"] = (df["freq"] / SCAN_FRES).round() * SCAN_FRES
+                expected_df = df.groupby("freq")["db"].mean().reset_index()
+                self.assertTrue(np.array_equal(expected_df.freq, frame_df.freq))
+                self.assertTrue(np.allclose(expected_df.db, frame_df.db))
+                self.assertEqual(1, len(frame_df.sweep_start.unique()))
+                self.assertEqual(df.ts.max(), frame_df.ts.max())
+
+    def test_frame_accumulator_rollover(self):
+        scan_config = {"freq_start": 1e6, "freq_end": 2e6}
+        accumulator = FFTFrameAccumulator()
+        df = fft_df(
+            np.array([1.0, 1.0, 2.0, 2.0]),
+            np.array([1e6, 1.5e6, 1e6, 3e6]),
+            np.array([-10.0, -20.0, -30.0, -40.0]),
+            np.array([1.0, 1.0, 2.0, 2.0]),
+        )
+        frames = accumulator.add(df, scan_config)
+        self.assertEqual(1, len(frames))
+        self.assertEqual([1e6, 1.5e6], list(frames[0].freq))
+        self.assertEqual([-10, -20], list(frames[0].db))
+        self.assertEqual(1, accumulator.out_of_range)
+        late_df = fft_df(
+            np.array([1.0]), np.array([1e6]), np.array([-10.0]), np.array([1.0])
+        )
+        self.assertEqual([], accumulator.add(late_df, scan_config))
+        self.assertEqual(1, accumulator.late)
+        # config change drops partial sweep.
+        self.assertEqual(
+            [], accumulator.add(late_df, {"freq_start": 1e6, "freq_end": 3e6})
+        )
+        self.assertEqual(1.0, accumulator.sweep_start)
+
+    def test_resample_fft(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            scan_log = os.path.join(tempdir, "scan.log")
+            write_scan_log(scan_log, 2, 100e6, 110e6, 4e3, 256)
+            for lines in read_scan_log_frames(scan_log):
+                # overlapping retunes, out of frequency order.
+                df, _ = decode_json_lines(lines[::-1] + lines[:3])
+                expected_df = legacy_resample_fft(df.copy())
+                resampled_df = resample_fft(df)
+                self.assertEqual(list(expected_df.columns), list(resampled_df.columns))
+                for col in ("freq", "ts", "sweep_start"):
+                    self.assertTrue(
+                        np.array_equal(expected_df[col], resampled_df[col]), col
+                    )
+                self.assertTrue(np.allclose(expected_df.db, resampled_df.db))
+
+    @unittest.skipUnless(BENCHMARK, "set GAMUTRF_BENCHMARK=1 to run benchmarks")
+    def test_resample_fft_benchmark(self):
+        buckets = int(1e6)
+        rng = np.random.default_rng(seed=0)
+        df = fft_df(
+            np.full(buckets, 1.0),
+            rng.uniform(70e6, 6e9, buckets),
+            rng.uniform(-80, -20, buckets).astype(np.float32),
+            np.full(buckets, 1.0),
+        )
+        resampled = {}
+        for name, resampler in (
+            ("legacy", legacy_resample_fft),
+            ("bincount", resample_fft),
+        ):
+            start_time = time.time()
+            resampled[name] = resampler(df.copy())
+            elapsed = time.time() - start_time
+            print(f"{name} resample of {buckets} buckets: {elapsed * 1e3:.1f}ms")
+        expected_df, resampled_df = resampled["legacy"], resampled["bincount"]
+        self.assertEqual(list(expected_df.columns), list(resampled_df.columns))
+        for col in ("freq", "ts", "sweep_start"):
+            self.assertTrue(np.array_equal(expected_df[col], resampled_df[col]), col)
+        self.assertTrue(np.allclose(expected_df.db, resampled_df.db))
+
+    def test_running_fft_mean(self):
+        scan_config = {"freq_start": 1e6, "freq_end": 2e6}
+        running_mean = RunningFFTMean(60)
+        self.assertEqual(0, len(running_mean.mean()))
+
+        def frame(ts, freq, db):
+            return pd.DataFrame({"ts": ts, "freq": freq, "db": db})
+
+        running_mean.add(frame(100, [1, 1.01], [-10.0, -20.0]), scan_config)
+        running_mean.add(frame(130, [1.01, 1.02], [-30.0, -40.0]), scan_config)
+        mean_df = running_mean.mean()
+        self.assertEqual([1, 1.01, 1.02], list(mean_df.freq))
+        self.assertEqual([-10, -25, -40], list(mean_df.db))
+        # first frame expires from the window.
+        running_mean.add(frame(170, [1.02, 3], [-20.0, -50.0]), scan_config)
+        mean_df = running_mean.mean()
+        self.assertEqual([1.01, 1.02], list(mean_df.freq))
+        self.assertEqual([-30, -30], list(mean_df.db))
+        self.assertEqual(2, len(running_mean.slots))
+        # memory bounded by slots.
+        running_mean = RunningFFTMean(60, max_slots=2)
+        with self.assertLogs(level="WARNING"):
+            for ts in range(3):
+                running_mean.add(frame(ts, [1], [float(ts)]), scan_config)
+        self.assertEqual([1.5], list(running_mean.mean().db))
+        running_mean = RunningFFTMean(60, max_slots=0)
+        for ts in range(3):
+            running_mean.add(frame(ts, [1], [float(ts)]), scan_config)
+        self.assertEqual([1], list(running_mean.mean().db))
+
+    def test_decode_json_lines_legacy(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            scan_log = os.path.join(tempdir, "scan.log")
+            write_scan_log(scan_log, 2, 70e6, 170e6, 1e4, 2048)
+            for lines in read_scan_log_frames(scan_log):
+                df, scan_config = decode_json_lines(lines)
+                legacy_df, legacy_scan_config = legacy_decode_json_lines(lines)
+                self.assertEqual(legacy_scan_config, scan_config)
+                # the same, but for dB decoded directly to float32.
+                pd.testing.assert_frame_equal(
+                    legacy_df.astype({"db": np.float32}), df, check_exact=True
+                )
+
+    @unittest.skipUnless(BENCHMARK, "set GAMUTRF_BENCHMARK=1 to run benchmarks")
+    def test_decode_json_lines_benchmark(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            scan_log = os.path.join(tempdir, "scan.log")
+            write_scan_log(scan_log, 3, 70e6, 1070e6, 1e4, 2048)
+            frames = read_scan_log_frames(scan_log)
+            for name, decoder in (
+                ("legacy", legacy_decode_json_lines),
+                ("columnar", decode_json_lines),
+            ):
+                start_time = time.time()
+                for lines in frames:
+                    decoder(lines)
+                elapsed = time.time() - start_time
+                print(f"{name} JSON decode: {len(frames) / elapsed:.2f} frames/sec")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    unittest.main()
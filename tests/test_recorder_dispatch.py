@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+from prometheus_client import CollectorRegistry
+from prometheus_client import Counter
+from prometheus_client import Gauge
+from prometheus_client import Histogram
+
+from gamutrf.recorder_dispatch import RecorderDispatcher
+from gamutrf.recorder_dispatch import RecorderStateTable
+from gamutrf.sigwindows import FreqExclusions
+
+
+def fake_prom_vars():
+    registry = CollectorRegistry()
+    return {
+        "recorder_request_latency": Histogram(
+            "recorder_request_latency",
+            "",
+            labelnames=("worker", "request"),
+            registry=registry,
+        ),
+        "recorder_request_failures": Counter(
+            "recorder_request_failures",
+            "",
+            labelnames=("worker", "request"),
+            registry=registry,
+        ),
+        "recorder_in_flight": Gauge(
+            "recorder_in_flight", "", labelnames=("worker",), registry=registry
+        ),
+        "worker_record_request": Gauge(
+            "worker_record_request", "", labelnames=("worker",), registry=registry
+        ),
+    }
+
+
+class FakeRecorderHandler(BaseHTTPRequestHandler):
+    info_requests = 0
+    # if set, record requests wait for it.
+    record_release = None
+    reject = False
+    invalid = False
+
+    def do_GET(self):
+        status = 200
+        if self.path == "/v1/info":
+            FakeRecorderHandler.info_requests += 1
+            body = json.dumps({"freq_excluded": ["100000000-200000000"]})
+        elif self.reject:
+            status = 400
+            body = json.dumps({"status": "Request queue is full"})
+        elif self.invalid:
+            status = 400
+            body = json.dumps({"status": "Requested frequency is excluded"})
+        else:
+            if self.record_release is not None:
+                self.record_release.wait(10)
+            body = "ok"
+        self.send_response(status)
+        self.end_headers()
+        self.wfile.write(body.encode("utf8"))
+
+    def log_message(self, *args):
+        return
+
+
+class RecorderDispatchTestCase(unittest.TestCase):
+    def setUp(self):
+        FakeRecorderHandler.info_requests = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeRecorderHandler)
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.start()
+        self.recorder = f"http://127.0.0.1:{self.server.server_address[1]}"
+        # Nothing listens on port 9 (discard), so requests fail fast.
+        self.dead_recorder = "http://127.0.0.1:9"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.server_thread.join()
+
+    def test_freq_exclusions_cached(self):
+        prom_vars = fake_prom_vars()
+        dispatcher = RecorderDispatcher(
+            [self.recorder, self.dead_recorder], prom_vars, info_ttl=60
+        )
+        for _ in range(3):
+            self.assertEqual(
+                {self.recorder: FreqExclusions(((100000000, 200000000),))},
+                dispatcher.freq_exclusions(),
+            )
+        self.assertEqual(1, FakeRecorderHandler.info_requests)
+        failures = prom_vars["recorder_request_failures"]
+        self.assertEqual(
+            1, failures.labels(worker=self.dead_recorder, request="info")._value.get()
+        )
+        dispatcher.invalidate(self.recorder)
+        dispatcher.freq_exclusions()
+        self.assertEqual(2, FakeRecorderHandler.info_requests)
+        dispatcher.close()
+
+    def test_record_does_not_block(self):
+        FakeRecorderHandler.record_release = threading.Event()
+        prom_vars = fake_prom_vars()
+        dispatcher = RecorderDispatcher([self.recorder], prom_vars)
+        futures = [
+            dispatcher.record(self.recorder, 100e6 + i, 1000, 1000, 5) for i in range(4)
+        ]
+        # record() returned while the recorder is still holding every request.
+        self.assertFalse(any(future.done() for future in futures))
+        FakeRecorderHandler.record_release.set()
+        self.assertTrue(all(future.result() for future in futures))
+        dispatcher.close()
+        FakeRecorderHandler.record_release = None
+
+    def test_record_rejected(self):
+        FakeRecorderHandler.reject = True
+        dispatcher = RecorderDispatcher([self.recorder], fake_prom_vars())
+        self.assertEqual({self.recorder: 3}, dispatcher.recorder_states.free())
+        self.assertFalse(dispatcher.record(self.recorder, 100e6, 10, 1, 5).result())
+        self.assertEqual({self.recorder: 0}, dispatcher.recorder_states.free())
+        self.assertEqual(1, dispatcher.recorder_states.failure_rate(self.recorder))
+        dispatcher.close()
+        FakeRecorderHandler.reject = False
+
+    def test_record_invalid(self):
+        FakeRecorderHandler.invalid = True
+        dispatcher = RecorderDispatcher([self.recorder], fake_prom_vars())
+        self.assertFalse(dispatcher.record(self.recorder, 100e6, 10, 1, 5).result())
+        # a validation failure doesn't mean the recorder is busy.
+        self.assertEqual({self.recorder: 3}, dispatcher.recorder_states.free())
+        self.assertEqual(1, dispatcher.recorder_states.failure_rate(self.recorder))
+        dispatcher.close()
+        FakeRecorderHandler.invalid = False
+
+    def test_recorder_state_table(self):
+        states = RecorderStateTable(["r1", "r2"], qsize=1)
+        now = time.time()
+        states.record_requested("r1", 10, now=now)
+        states.record_requested("r1", 10, now=now)
+        self.assertEqual({"r1": 0, "r2": 2}, states.free(now=now))
+        # Recordings complete serially, the second 10s after the first.
+        self.assertEqual({"r1": 1, "r2": 2}, states.free(now=now + 11))
+        self.assertEqual({"r1": 2, "r2": 2}, states.free(now=now + 21))
+        states.record_response("r2", False, 0.1, 10)
+        rank = states.rank()
+        self.assertLess(rank["r1"], rank["r2"])
+        # a failure releases its own reservation, not the latest one.
+        first = states.record_requested("r1", 10, now=now)
+        states.record_requested("r1", 20, now=now)
+        states.record_response("r1", False, 0.1, 10, token=first)
+        self.assertEqual({"r1": 1, "r2": 2}, states.free(now=now))
+        self.assertEqual({"r1": 1, "r2": 2}, states.free(now=now + 25))
+        self.assertEqual({"r1": 2, "r2": 2}, states.free(now=now + 31))
+
+
+if __name__ == "__main__":  # pragma: no cover
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+import os
+import tempfile
+import unittest
+
+from gamutrf.compression import CompressionOptions
+from gamutrf.recording_watcher import ProcessedIndex
+from gamutrf.recording_watcher import RecordingWatcher
+
+
+def write_recording(dirname, name):
+    # written like the API, to a dotfile renamed when complete.
+    dotfile = os.path.join(dirname, "." + name)
+    with open(dotfile, "wb") as f:
+        f.write(b"\x00" * 16)
+    recording = os.path.join(dirname, name)
+    os.rename(dotfile, recording)
+    return recording
+
+
+class RecordingWatcherTestCase(unittest.TestCase):
+    def _test_watcher(self, use_inotify):
+        with tempfile.TemporaryDirectory() as tempdir:
+            existing = write_recording(tempdir, "existing_100Hz_1000sps.s16.zst")
+            with RecordingWatcher(
+                tempdir, poll_interval=0.1, use_inotify=use_inotify
+            ) as watcher:
+                self.assertEqual(use_inotify, watcher.inotify is not None)
+                self.assertEqual([existing], watcher.poll())
+                self.assertEqual([], watcher.poll())
+                new = write_recording(tempdir, "new_100Hz_1000sps.s16.zst")
+                with open(os.path.join(tempdir, "new.png"), "wb") as f:
+                    f.write(b"")
+                self.assertEqual([new], watcher.poll())
+                subdir = os.path.join(tempdir, "subdir")
+                os.mkdir(subdir)
+                sub = write_recording(subdir, "sub_100Hz_1000sps.s16.zst")
+                self.assertEqual([sub], watcher.poll())
+                self.assertEqual([], watcher.poll())
+                # recordings made with no compression are found too.
+                ext = CompressionOptions(codec="none").ext()
+                uncompressed = write_recording(
+                    tempdir, f"uncompressed_100Hz_1000sps.s16{ext}"
+                )
+                self.assertEqual([uncompressed], watcher.poll())
+
+    def test_watcher_inotify(self):
+        self._test_watcher(True)
+
+    def test_watcher_poll(self):
+        self._test_watcher(False)
+
+    def test_processed_index(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            index_file = os.path.join(tempdir, ".index")
+            recordings = [os.path.join(tempdir, f"r{i}.s16.zst") for i in range(3)]
+            index = ProcessedIndex(index_file, tempdir)
+            for recording in recordings:
+                index.add(recording)
+            index.add(recordings[0])
+            index.close()
+            with open(index_file, "a", encoding="utf8") as f:
+                f.write("partial")
+            index = ProcessedIndex(index_file, tempdir)
+            self.assertEqual(3, len(index))
+            self.assertIn(recordings[1], index)
+            index.add(os.path.join(tempdir, "r3.s16.zst"))
+            index.close()
+            index = ProcessedIndex(index_file, tempdir)
+            self.assertEqual(4, len(index))
+            self.assertIn(os.path.join(tempdir, "r3.s16.zst"), index)
+            index.retain(recordings[1:])
+            index.add(os.path.join(tempdir, "r4.s16.zst"))
+            index.close()
+            with open(index_file, encoding="utf8") as f:
+                self.assertEqual(
+                    ["r1.s16.zst", "r2.s16.zst", "r4.s16.zst"], f.read().splitlines()
+                )
+
+
+if __name__ == "__main__":  # pragma: no cover
+    unittest.main()
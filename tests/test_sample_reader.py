@@ -1,10 +1,16 @@
 #!/usr/bin/python3
+import gzip
+import itertools
 import os
 import tempfile
 import unittest
 import numpy as np
+import zstandard
 
+from gamutrf.sample_reader import ReadAhead
 from gamutrf.sample_reader import read_recording
+from gamutrf.seekable_zstd import SeekableZstdWriter
+from gamutrf.seekable_zstd import zst_index_file
 from gamutrf.utils import parse_filename
 
 
@@ -78,6 +84,152 @@ class ReadRecordingTestCase(unittest.TestCase):
                 self.assertEqual(0, sample_chunk[0])
                 self.assertEqual(0, i)
 
+    def test_mmap_read_recording(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            rng = np.random.default_rng(seed=0)
+            for sample_type in ("s16", "raw"):
+                recording = os.path.join(
+                    str(tempdir), f"testrecording_100Hz_1000sps.{sample_type}"
+                )
+                _, sample_rate, sample_dtype, sample_len, _, _ = parse_filename(
+                    recording
+                )
+                x1d = np.empty(int(sample_rate * 3.5), dtype=sample_dtype)
+                x1d["i"] = rng.integers(-1000, 1000, len(x1d))
+                x1d["q"] = rng.integers(-1000, 1000, len(x1d))
+                x1d.tofile(recording)
+                with open(recording + ".zst", "wb") as f:
+                    f.write(zstandard.ZstdCompressor().compress(x1d.tobytes()))
+                expected = x1d["i"] + np.csingle(1j) * x1d["q"]
+                for kwargs, expected_samples in (
+                    ({}, expected),
+                    ({"skip_sample_secs": 1}, expected[1000:]),
+                    (
+                        {"skip_sample_secs": 1, "max_sample_secs": 1.5},
+                        expected[1000:2500],
+                    ),
+                ):
+                    for reuse_buffer in (True, False):
+                        chunks = [
+                            chunk.copy()
+                            for chunk in read_recording(
+                                recording,
+                                sample_rate,
+                                sample_dtype,
+                                sample_len,
+                                reuse_buffer=reuse_buffer,
+                                **kwargs,
+                            )
+                        ]
+                        self.assertEqual(np.csingle, chunks[0].dtype)
+                        self.assertTrue(
+                            np.array_equal(expected_samples, np.concatenate(chunks))
+                        )
+                        zst_chunks = list(
+                            read_recording(
+                                recording + ".zst",
+                                sample_rate,
+                                sample_dtype,
+                                sample_len,
+                                **kwargs,
+                            )
+                        )
+                        self.assertEqual(
+                            [len(chunk) for chunk in zst_chunks],
+                            [len(chunk) for chunk in chunks],
+                        )
+                self.assertEqual(
+                    [],
+                    list(
+                        read_recording(
+                            recording,
+                            sample_rate,
+                            sample_dtype,
+                            sample_len,
+                            skip_sample_secs=4,
+                        )
+                    ),
+                )
+            empty_recording = os.path.join(str(tempdir), "empty_100Hz_1000sps.s16")
+            open(empty_recording, "wb").close()
+            self.assertEqual(
+                [], list(read_recording(empty_recording, 1000, sample_dtype, 4))
+            )
+
+    def test_read_ahead(self):
+        data = np.random.default_rng(seed=0).bytes(100003)
+        with tempfile.TemporaryDirectory() as tempdir:
+            gz_file = os.path.join(tempdir, "test.gz")
+            with gzip.open(gz_file, "wb") as f:
+                f.write(data)
+            zst_file = os.path.join(tempdir, "test.zst")
+            with open(zst_file, "wb") as f:
+                f.write(zstandard.ZstdCompressor().compress(data))
+            seekable_file = os.path.join(tempdir, "seekable.zst")
+            with open(seekable_file, "wb") as f:
+                writer = SeekableZstdWriter(f, 4096)
+                writer.write(data)
+                writer.flush()
+            writer.write_index(zst_index_file(seekable_file))
+            for filename in (gz_file, zst_file, seekable_file):
+                for workers in (1, 3):
+                    for skip_bytes, max_bytes in ((0, 0), (5000, 0), (5000, 50000)):
+                        with ReadAhead(
+                            filename,
+                            1000,
+                            skip_bytes=skip_bytes,
+                            max_bytes=max_bytes,
+                            workers=workers,
+                        ) as chunks:
+                            content = b"".join(bytes(chunk) for chunk in chunks)
+                        end = len(data)
+                        if max_bytes:
+                            end = skip_bytes + max_bytes
+                        self.assertEqual(data[skip_bytes:end], content, filename)
+                # stopping early must not leave threads blocked.
+                with ReadAhead(filename, 1000, workers=3) as chunks:
+                    for chunk in chunks:
+                        break
+            with self.assertRaises(FileNotFoundError):
+                with ReadAhead(os.path.join(tempdir, "missing.gz"), 1000) as chunks:
+                    list(chunks)
+
+    def test_mmap_read_recording_legacy(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            recording = os.path.join(str(tempdir), "testrecording_100Hz_1000000sps.s16")
+            _, sample_rate, sample_dtype, sample_len, _, _ = parse_filename(recording)
+            # a partial last second.
+            np.random.default_rng(seed=0).integers(
+                -(2**15), 2**15, int(sample_rate * 2.5) * 2, dtype=np.int16
+            ).tofile(recording)
+
+            def legacy_read_recording():
+                read_size = sample_rate * sample_len
+                with open(recording, "rb") as infile:
+                    while True:
+                        sample_buffer = infile.read(read_size)
+                        if not sample_buffer:
+                            break
+                        x1d = np.frombuffer(sample_buffer, dtype=sample_dtype)
+                        yield x1d["i"] + np.csingle(1j) * x1d["q"]
+
+            chunks = 0
+            # compared as read, as the mmap reader reuses its buffer.
+            for legacy_samples, samples in itertools.zip_longest(
+                legacy_read_recording(),
+                read_recording(
+                    recording,
+                    sample_rate,
+                    sample_dtype,
+                    sample_len,
+                    reuse_buffer=True,
+                ),
+            ):
+                self.assertIsNotNone(samples)
+                self.assertTrue(np.array_equal(legacy_samples, samples))
+                chunks += 1
+            self.assertEqual(3, chunks)
+
 
 if __name__ == "__main__":  # pragma: no cover
     unittest.main()
@@ -3,12 +3,104 @@ import os
 import tempfile
 import unittest
 
+import numpy as np
+
+from gamutrf.compression import CompressionOptions
+from gamutrf.sdr_recorder import FileCaptureRecorder
 from gamutrf.sdr_recorder import get_recorder
+from gamutrf.sdr_recorder import read_fft_columns
+from gamutrf.seekable_zstd import read_zst_index
+from gamutrf.sigwindows import FreqExclusions
 
 
 class SDRRecorderTestCase(unittest.TestCase):
     SAMPLES = 1e3 * 4
 
+    def test_capture_worker_recorder(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            sdr_recorder = FileCaptureRecorder("file:/dev/zero")
+            for zst_frame_secs in (0, 0, 0.25):
+                record_status, sample_file = sdr_recorder.run_recording(
+                    tmpdir,
+                    self.SAMPLES,
+                    self.SAMPLES,
+                    self.SAMPLES,
+                    0,
+                    False,
+                    0,
+                    sigmf_=False,
+                    sdr="zero",
+                    antenna="omni",
+                    zst_frame_secs=zst_frame_secs,
+                )
+                self.assertEqual(0, record_status)
+                self.assertTrue(os.path.exists(sample_file))
+                os.remove(sample_file)
+            # the same worker made every recording.
+            self.assertIsNotNone(sdr_recorder.worker_subprocess)
+            index = read_zst_index(sample_file)
+            self.assertEqual(self.SAMPLES * 4, index["total_bytes"])
+            self.assertEqual(4, len(index["frames"]))
+            record_status, sample_file = sdr_recorder.run_recording(
+                tmpdir,
+                self.SAMPLES,
+                self.SAMPLES,
+                self.SAMPLES,
+                0,
+                False,
+                0,
+                sigmf_=False,
+                sdr="zero",
+                antenna="omni",
+                compression=CompressionOptions(codec="none"),
+            )
+            self.assertEqual(0, record_status)
+            self.assertTrue(sample_file.endswith(".s16"))
+            self.assertEqual(self.SAMPLES * 4, os.path.getsize(sample_file))
+            self.assertEqual(
+                self.SAMPLES * 4, sdr_recorder.compression_stats["compressed_bytes"]
+            )
+            sdr_recorder.stop_worker()
+            sdr_recorder.tmpdir.cleanup()
+
+            # if the worker cannot open the SDR, record with the CLI tool instead.
+            sdr_recorder = FileCaptureRecorder("file:/dev/zero")
+            sdr_recorder.capture_sdr = "file:/does/not/exist"
+            record_status, sample_file = sdr_recorder.run_recording(
+                tmpdir,
+                self.SAMPLES,
+                self.SAMPLES,
+                self.SAMPLES,
+                0,
+                False,
+                0,
+                sigmf_=False,
+                sdr="zero",
+                antenna="omni",
+            )
+            self.assertEqual(0, record_status)
+            self.assertTrue(sdr_recorder.worker_failed)
+            self.assertTrue(os.path.exists(sample_file))
+            sdr_recorder.tmpdir.cleanup()
+
+    def test_read_fft_columns(self):
+        nfft = 16
+        frames = np.random.default_rng(seed=0).random((1001, nfft), dtype=np.float32)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fft_file = os.path.join(tmpdir, "fft.dat")
+            frames.tofile(fft_file)
+            expected = np.roll(frames.swapaxes(0, 1), nfft // 2, 0)
+            for chunk_frames in (7, 100, 4096):
+                i = read_fft_columns(fft_file, nfft, 2000, chunk_frames=chunk_frames)
+                self.assertTrue(np.array_equal(expected, i))
+                # 1001 frames pooled 16 at a time, the last of 9 frames.
+                i = read_fft_columns(fft_file, nfft, 63, chunk_frames=chunk_frames)
+                self.assertEqual((nfft, 63), i.shape)
+                self.assertTrue(np.array_equal(expected[:, :16].max(axis=1), i[:, 0]))
+                self.assertTrue(np.array_equal(expected[:, 992:].max(axis=1), i[:, -1]))
+            open(fft_file, "wb").close()
+            self.assertIsNone(read_fft_columns(fft_file, nfft, 63))
+
     def test_sdr_recorder(self):
         with tempfile.TemporaryDirectory() as tmpdir:
             sdr_recorder = get_recorder("file:/dev/zero")()
@@ -17,6 +109,24 @@ class SDRRecorderTestCase(unittest.TestCase):
             with open(fft_file, "wb") as f:
                 f.write(b"\x00" * 4 * 2048 * 10)
             sdr_recorder.fft_spectrogram(sample_file, fft_file, 2048, 1e6, 1e6, 2048)
+            self.assertFalse(os.path.exists(fft_file))
+            # the FFT is removed even if the spectrogram cannot be written.
+            with open(fft_file, "wb") as f:
+                f.write(b"\x00" * 4 * 2048 * 10)
+            with self.assertRaises(OSError):
+                sdr_recorder.fft_spectrogram(
+                    os.path.join(tmpdir, "missing", "test_file.zst"),
+                    fft_file,
+                    2048,
+                    1e6,
+                    1e6,
+                    2048,
+                )
+            self.assertFalse(os.path.exists(fft_file))
+            self.assertEqual(
+                "/dev/shm/fft.test_file.zst.dat",
+                sdr_recorder.get_fft_file(sample_file),
+            )
         with tempfile.TemporaryDirectory() as tmpdir:
             sdr_recorder = get_recorder("file:/dev/zero")()
             record_status, sample_file = sdr_recorder.run_recording(
@@ -37,7 +147,7 @@ class SDRRecorderTestCase(unittest.TestCase):
         with tempfile.TemporaryDirectory() as tmpdir:
             sdr_recorder = get_recorder("file:/dev/zero")()
             # TODO: sigmf 1.0.0 can't parse .zst files, but it can write the metadata fine.
-            record_status, sample_file = sdr_recorder.run_recording(
+            record_status, sample_file, post_args = sdr_recorder.capture_recording(
                 tmpdir,
                 self.SAMPLES,
                 self.SAMPLES,
@@ -51,13 +161,71 @@ class SDRRecorderTestCase(unittest.TestCase):
             )
             self.assertTrue(os.path.exists(sample_file))
             self.assertGreater(os.path.getsize(sample_file), 0)
+            self.assertFalse(os.path.exists(sample_file + ".sigmf-meta"))
+            sdr_recorder.post_process_recording(**post_args)
             self.assertTrue(os.path.exists(sample_file + ".sigmf-meta"))
             sdr_recorder.tmpdir.cleanup()
 
+        with tempfile.TemporaryDirectory() as tmpdir:
+            sdr_recorder = get_recorder("file:/dev/zero")()
+            record_status, sample_file = sdr_recorder.run_recording(
+                tmpdir,
+                self.SAMPLES,
+                self.SAMPLES,
+                self.SAMPLES,
+                0,
+                False,
+                0,
+                sigmf_=False,
+                sdr="zero",
+                antenna="omni",
+                zst_frame_secs=1,
+            )
+            self.assertEqual(0, record_status)
+            index = read_zst_index(sample_file)
+            self.assertEqual(self.SAMPLES**2, index["total_bytes"])
+            self.assertEqual(self.SAMPLES / 4, len(index["frames"]))
+            sdr_recorder.tmpdir.cleanup()
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            sdr_recorder = get_recorder("file:/dev/zero")()
+            for compression in (
+                CompressionOptions(level=3, threads=2, long_distance=True),
+                CompressionOptions(codec="none"),
+            ):
+                record_status, sample_file = sdr_recorder.run_recording(
+                    tmpdir,
+                    self.SAMPLES,
+                    self.SAMPLES,
+                    self.SAMPLES,
+                    0,
+                    False,
+                    0,
+                    sigmf_=False,
+                    sdr="zero",
+                    antenna="omni",
+                    compression=compression,
+                )
+                self.assertEqual(0, record_status)
+                stats = sdr_recorder.compression_stats
+                self.assertEqual(self.SAMPLES**2, stats["raw_bytes"])
+                self.assertEqual(
+                    os.path.getsize(sample_file), stats["compressed_bytes"]
+                )
+            self.assertTrue(sample_file.endswith(".s16"))
+            self.assertEqual(self.SAMPLES**2, os.path.getsize(sample_file))
+            sdr_recorder.tmpdir.cleanup()
+
         sdr_recorder = get_recorder("file:/dev/zero")()
         self.assertNotEqual(None, sdr_recorder.validate_request([], 1e6, 0, 0))
         self.assertNotEqual(None, sdr_recorder.validate_request([], 1e6, 1, 1))
         self.assertEqual(None, sdr_recorder.validate_request([], 1e6, 1e6, 1e6))
+        self.assertNotEqual(
+            None,
+            sdr_recorder.validate_request(
+                FreqExclusions.parse(["100-2000000"]), 1e6, 1e6, 1e6
+            ),
+        )
         sdr_recorder.tmpdir.cleanup()
 
 
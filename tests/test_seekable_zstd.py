@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+import io
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import zstandard
+
+from gamutrf.sample_reader import get_reader
+from gamutrf.sample_reader import read_recording
+from gamutrf.seekable_zstd import read_zst_index
+from gamutrf.seekable_zstd import SeekableZstdReader
+from gamutrf.seekable_zstd import SeekableZstdWriter
+from gamutrf.seekable_zstd import zst_index_file
+from gamutrf.utils import get_nondot_files
+from gamutrf.utils import parse_filename
+
+
+def write_seekable(filename, data, frame_bytes, write_size=1000):
+    with open(filename, "wb") as outfile:
+        writer = SeekableZstdWriter(outfile, frame_bytes)
+        for i in range(0, len(data), write_size):
+            writer.write(data[i : i + write_size])
+        writer.flush()
+    writer.write_index(zst_index_file(filename))
+
+
+class SeekableZstdTestCase(unittest.TestCase):
+    def test_seekable_zstd(self):
+        data = np.random.default_rng(seed=0).bytes(10007)
+        with tempfile.TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, "test.zst")
+            write_seekable(filename, data, 1024)
+            index = read_zst_index(filename)
+            self.assertEqual(len(data), index["total_bytes"])
+            self.assertEqual(10, len(index["frames"]))
+            # independent frames are also a valid zstd stream.
+            with open(filename, "rb") as f:
+                self.assertEqual(
+                    data,
+                    zstandard.ZstdDecompressor()
+                    .stream_reader(f, read_across_frames=True)
+                    .read(),
+                )
+            with SeekableZstdReader(filename, index) as reader:
+                self.assertEqual(data, reader.read())
+                for offset, size in ((0, 10), (1000, 100), (5000, 3000), (10000, 100)):
+                    reader.seek(offset)
+                    self.assertEqual(data[offset : offset + size], reader.read(size))
+                    self.assertEqual(min(offset + size, len(data)), reader.tell())
+                reader.seek(-7, io.SEEK_END)
+                self.assertEqual(data[-7:], reader.read())
+                self.assertEqual(b"", reader.read(10))
+            with get_reader(filename)(filename) as reader:
+                self.assertTrue(isinstance(reader, SeekableZstdReader))
+            self.assertEqual([filename], get_nondot_files(tempdir, glob="*.zst*"))
+
+    def test_seekable_read_recording(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            recording = os.path.join(tempdir, "test_100Hz_1000sps.s16.zst")
+            _, sample_rate, sample_dtype, sample_len, _, _ = parse_filename(recording)
+            x1d = np.empty(int(sample_rate * 5.5), dtype=sample_dtype)
+            x1d["i"] = np.arange(len(x1d))
+            x1d["q"] = -np.arange(len(x1d))
+            write_seekable(recording, x1d.tobytes(), sample_rate * sample_len)
+            samples = np.concatenate(
+                list(
+                    read_recording(
+                        recording,
+                        sample_rate,
+                        sample_dtype,
+                        sample_len,
+                        skip_sample_secs=2.5,
+                        max_sample_secs=2,
+                    )
+                )
+            )
+            expected = x1d[2500:4500]
+            self.assertTrue(
+                np.array_equal(expected["i"] + np.csingle(1j) * expected["q"], samples)
+            )
+
+    def test_seekable_zstd_stream(self):
+        sample_rate = int(1e5)
+        sample_len = 4
+        secs = 5
+        data = (
+            np.random.default_rng(seed=0)
+            .integers(-200, 200, sample_rate * 2 * secs, dtype=np.int16)
+            .tobytes()
+        )
+        with tempfile.TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, "test.zst")
+            write_seekable(filename, data, sample_rate * sample_len, len(data))
+            stream_filename = os.path.join(tempdir, "stream.zst")
+            with open(stream_filename, "wb") as f:
+                f.write(zstandard.ZstdCompressor(level=1).compress(data))
+            # the last second, and a read across frames.
+            for offset in (
+                (secs - 1) * sample_rate * sample_len,
+                int(1.5 * sample_rate * sample_len),
+            ):
+                reads = []
+                for reader in (
+                    get_reader(stream_filename)(stream_filename),
+                    get_reader(filename)(filename),
+                ):
+                    with reader:
+                        reader.seek(offset)
+                        reads.append(reader.read(sample_rate * sample_len))
+                self.assertIsInstance(reader, SeekableZstdReader)
+                self.assertEqual(
+                    data[offset : offset + sample_rate * sample_len], reads[0]
+                )
+                self.assertEqual(reads[0], reads[1])
+
+
+if __name__ == "__main__":  # pragma: no cover
+    unittest.main()
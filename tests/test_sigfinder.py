@@ -1,18 +1,19 @@
 #!/usr/bin/python3
 
 import json
+import multiprocessing
 import os
 import pathlib
+import queue
 import tempfile
 import threading
 import time
 import unittest
-import concurrent.futures
 import zmq
-import zstandard
 
 from gamutrf.sigfinder import Result
 from gamutrf.sigfinder import argument_parser
+from gamutrf.sigfinder import decode_fft_buffer
 from gamutrf.sigfinder import error_response
 from gamutrf.sigfinder import falcon_response
 from gamutrf.sigfinder import fft_proxy
@@ -23,9 +24,11 @@ from gamutrf.sigwindows import ROLLING_FACTOR
 from gamutrf.utils import rotate_file_n
 
 
-def null_proxy():
-    for i in range(10):
-        time.sleep(1)
+class FakeProxy:
+    exitcode = None
+
+    def is_alive(self):
+        return True
 
 
 class FakeResponse:
@@ -111,9 +114,13 @@ class FakeArgs:
         self.nfftgraph = nfftgraph
         self.max_recorder_signals = max_recorder_signals
         self.running_fft_secs = running_fft_secs
+        self.running_fft_max_slots = 64
         self.nfftplots = nfftplots
         self.skip_tune_step_fft = skip_tune_step_fft
         self.db_rolling_factor = ROLLING_FACTOR
+        self.recorder_connect_timeout = 1
+        self.recorder_info_ttl = 60
+        self.recorder_qsize = 2
 
 
 class SigFinderTestCase(unittest.TestCase):
@@ -146,83 +153,94 @@ class SigFinderTestCase(unittest.TestCase):
     def test_argument_parser(self):
         argument_parser()
 
+    def test_decode_fft_buffer(self):
+        output = {
+            "ts": 1,
+            "sweep_start": 1,
+            "config": {"freq_start": 100e6, "freq_end": 200e6},
+            "buckets": {"100000000.0": -50, "100010000.0": -40},
+        }
+        line = bytes(json.dumps(output) + "\n", encoding="utf8")
+        consumed, df, scan_config = decode_fft_buffer(line + line[:10])
+        self.assertEqual(len(line), consumed)
+        self.assertEqual([-50, -40], list(df.db))
+        self.assertEqual(output["config"], scan_config)
+        self.assertEqual((0, None, None), decode_fft_buffer(line[:10]))
+
     def test_process_fft_lines(self):
-        with concurrent.futures.ProcessPoolExecutor() as executor:
-            proxy_result = executor.submit(null_proxy)
-            with tempfile.TemporaryDirectory() as tempdir:
-                test_log = os.path.join(str(tempdir), "test.csv")
-                test_fftlog = os.path.join(str(tempdir), "fft.csv")
-                test_fftgraph = os.path.join(str(tempdir), "fft.png")
-                buff_file = os.path.join(str(tempdir), "buff_file")
-                live_file = pathlib.Path(os.path.join(str(tempdir), "live_file"))
-                args = FakeArgs(
-                    test_log,
-                    60,
-                    4,
-                    -40,
-                    test_fftlog,
-                    1,
-                    5,
-                    20,
-                    21,
-                    1,
-                    "",
-                    test_fftgraph,
-                    "127.0.0.1",
-                    9999,
-                    10,
-                    1,
-                    1,
-                    1,
-                    0,
-                )
-                prom_vars = init_prom_vars()
-                context = zstandard.ZstdCompressor()
-                freq_start = 100e6
-                freq_end = 400e6
-                scan_config = {
-                    "freq_start": freq_start,
-                    "freq_end": freq_end,
+        # the log is not rotated, so nothing is submitted to an executor.
+        proxy = FakeProxy()
+        with tempfile.TemporaryDirectory() as tempdir:
+            test_log = os.path.join(str(tempdir), "test.csv")
+            test_fftlog = os.path.join(str(tempdir), "fft.csv")
+            test_fftgraph = os.path.join(str(tempdir), "fft.png")
+            fft_queue = multiprocessing.Queue()
+            live_file = pathlib.Path(os.path.join(str(tempdir), "live_file"))
+            args = FakeArgs(
+                test_log,
+                60,
+                4,
+                -40,
+                test_fftlog,
+                1,
+                5,
+                20,
+                21,
+                1,
+                "",
+                test_fftgraph,
+                "127.0.0.1",
+                9999,
+                10,
+                1,
+                1,
+                1,
+                0,
+            )
+            prom_vars = init_prom_vars()
+            freq_start = 100e6
+            freq_end = 400e6
+            scan_config = {
+                "freq_start": freq_start,
+                "freq_end": freq_end,
+            }
+            for _ in range(2):
+                output = {
+                    "ts": int(time.time()),
+                    "sweep_start": int(time.time()),
+                    "config": {
+                        "freq_start": freq_start,
+                        "freq_end": freq_end,
+                    },
+                    "buckets": {},
                 }
-                with open(buff_file, "wb") as zbf:
-                    with context.stream_writer(zbf) as bf:
-                        for _ in range(2):
-                            output = {
-                                "ts": int(time.time()),
-                                "sweep_start": int(time.time()),
-                                "config": {
-                                    "freq_start": freq_start,
-                                    "freq_end": freq_end,
-                                },
-                                "buckets": {},
-                            }
-                            freq = freq_start
-                            while freq < freq_end:
-                                output["buckets"][str(freq)] = -50
-                                freq += 1e5
-                            bf.write(bytes(json.dumps(output) + "\n", encoding="utf8"))
-                            time.sleep(1)
-                live_file.touch()
-                process_thread = threading.Thread(
-                    target=process_fft_lines,
-                    args=(
-                        args,
-                        prom_vars,
-                        buff_file,
-                        executor,
-                        proxy_result,
-                        live_file,
-                    ),
-                )
-                process_thread.start()
-                for i in range(10):
-                    if os.path.exists(test_fftlog) and os.path.exists(test_fftgraph):
-                        break
-                    time.sleep(1)
-                live_file.unlink()
-                process_thread.join()
-                self.assertTrue(os.path.exists(test_fftlog))
-                self.assertTrue(os.path.exists(test_fftgraph))
+                freq = freq_start
+                while freq < freq_end:
+                    output["buckets"][str(freq)] = -50
+                    freq += 1e5
+                fft_queue.put(bytes(json.dumps(output) + "\n", encoding="utf8"))
+                time.sleep(1)
+            live_file.touch()
+            process_thread = threading.Thread(
+                target=process_fft_lines,
+                args=(
+                    args,
+                    prom_vars,
+                    fft_queue,
+                    None,
+                    proxy,
+                    live_file,
+                ),
+            )
+            process_thread.start()
+            for i in range(10):
+                if os.path.exists(test_fftlog) and os.path.exists(test_fftgraph):
+                    break
+                time.sleep(1)
+            live_file.unlink()
+            process_thread.join()
+            self.assertTrue(os.path.exists(test_fftlog))
+            self.assertTrue(os.path.exists(test_fftgraph))
 
     def test_fft_proxy(self):
         args = FakeArgs(
@@ -246,33 +264,33 @@ class SigFinderTestCase(unittest.TestCase):
             1,
             0,
         )
-        zstd_context = zstandard.ZstdDecompressor()
 
         with tempfile.TemporaryDirectory() as tempdir:
             live_file = pathlib.Path(os.path.join(tempdir, "live_file"))
             live_file.touch()
-            buff_file = os.path.join(tempdir, "buff_file")
+            fft_queue = multiprocessing.Queue()
             test_bytes = b"1, 2, 3\n4, 5, 6\n"
-            shutdown_str = b"shutdown\n"
             context = zmq.Context()
             socket = context.socket(zmq.PUB)
             socket.bind(f"tcp://{args.logaddr}:{args.logport}")
 
-            with concurrent.futures.ProcessPoolExecutor(1) as executor:
-                executor.submit(fft_proxy, args, buff_file, 1, live_file=live_file)
-                for _ in range(5):
-                    socket.send(test_bytes)
-                    if os.path.exists(buff_file):
-                        break
-                    time.sleep(1)
-                live_file.unlink()
-                with open(buff_file, "rb") as zbf:
-                    with zstd_context.stream_reader(zbf) as bf:
-                        content = bf.read()
-                self.assertGreater(
-                    content.find(b"4, 5, 6\n"), -1, (content, test_bytes)
-                )
-                os.remove(buff_file)
+            proxy = multiprocessing.Process(
+                target=fft_proxy,
+                args=(args, fft_queue),
+                kwargs={"live_file": live_file},
+            )
+            proxy.start()
+            content = b""
+            for _ in range(5):
+                socket.send(test_bytes)
+                try:
+                    content += fft_queue.get(timeout=1)
+                    break
+                except queue.Empty:
+                    continue
+            live_file.unlink()
+            proxy.join()
+            self.assertGreater(content.find(b"4, 5, 6\n"), -1, (content, test_bytes))
 
 
 if __name__ == "__main__":  # pragma: no cover
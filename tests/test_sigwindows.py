@@ -1,10 +1,16 @@
 #!/usr/bin/python3
 import os
 import tempfile
+import time
 import unittest
 
+import numpy as np
+import pandas as pd
+
 from gamutrf.sigwindows import choose_record_signal
 from gamutrf.sigwindows import choose_recorders
+from gamutrf.sigwindows import FFTGraph
+from gamutrf.sigwindows import FreqExclusions
 from gamutrf.sigwindows import freq_excluded
 from gamutrf.sigwindows import parse_freq_excluded
 from gamutrf.sigwindows import read_csv
@@ -12,6 +18,36 @@ from gamutrf.sigwindows import ROLLOVERHZ, ROLLING_FACTOR
 
 
 TESTDIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "data")
+# timings are only run (and printed) if set, as they take seconds.
+BENCHMARK = os.getenv("GAMUTRF_BENCHMARK", "")
+
+
+def random_freq_exclusions(signal_count, recorder_count):
+    rng = np.random.default_rng(seed=0)
+    signals = sorted(set(rng.integers(70, 6000, signal_count).tolist()))
+    recorder_freq_exclusions = {}
+    for i in range(recorder_count):
+        freq_mins = rng.integers(70, 6000, 8)
+        recorder_freq_exclusions[f"r{i}"] = tuple(
+            (int(freq_min), int(freq_min) + int(width))
+            for freq_min, width in zip(freq_mins, rng.integers(1, 200, 8))
+        )
+    return (signals, recorder_freq_exclusions)
+
+
+def linear_exclusions(signals, recorder_freq_exclusions):
+    return {
+        recorder: [signal for signal in signals if not freq_excluded(signal, excluded)]
+        for recorder, excluded in recorder_freq_exclusions.items()
+    }
+
+
+def compiled_exclusions(signals, recorder_freq_exclusions):
+    compiled = {}
+    for recorder, excluded in recorder_freq_exclusions.items():
+        mask = FreqExclusions(excluded).mask(signals)
+        compiled[recorder] = np.array(signals)[~mask].tolist()
+    return compiled
 
 
 class FakeArgs:
@@ -79,6 +115,52 @@ class WindowsTestCase(unittest.TestCase):
             choose_recorders([100, 200], recorder_freq_exclusions, 1),
         )
 
+    def test_choose_recorders_state(self):
+        recorder_freq_exclusions = {"c1": (), "c2": (), "c3": ()}
+        self.assertEqual(
+            [(100, "c2"), (200, "c2")],
+            choose_recorders(
+                [100, 200],
+                recorder_freq_exclusions,
+                2,
+                recorder_free={"c1": 0, "c2": 3, "c3": 1},
+                recorder_rank={"c1": (0, 0, 0), "c2": (0, 0, 0), "c3": (1, 0, 0)},
+            ),
+        )
+        # signals are spread over equally ranked recorders.
+        recorders = [
+            recorder
+            for _, recorder in choose_recorders(
+                [100, 200, 300],
+                recorder_freq_exclusions,
+                2,
+                recorder_free={"c1": 3, "c2": 3, "c3": 3},
+                recorder_rank={"c1": (0, 0, 1), "c2": (0, 0, 1), "c3": (0, 0, 1)},
+            )
+        ]
+        self.assertEqual(["c1", "c2", "c3"], sorted(recorders))
+        # a busier recorder gets signals once the others are as busy.
+        recorders = [
+            recorder
+            for _, recorder in choose_recorders(
+                [100, 200, 300],
+                recorder_freq_exclusions,
+                2,
+                recorder_free={"c1": 3, "c2": 3, "c3": 3},
+                recorder_rank={"c1": (0, 0, 1), "c2": (0, 2, 1), "c3": (0.5, 0, 0)},
+            )
+        ]
+        self.assertEqual(["c1", "c1", "c2"], sorted(recorders))
+        self.assertEqual(
+            [(100, "c3")],
+            choose_recorders(
+                [100, 200],
+                recorder_freq_exclusions,
+                2,
+                recorder_free={"c1": 0, "c2": 0, "c3": 1},
+            ),
+        )
+
     def test_freq_excluded(self):
         self.assertTrue(freq_excluded(100, ((100, 200),)))
         self.assertFalse(freq_excluded(99, ((100, 200),)))
@@ -86,12 +168,75 @@ class WindowsTestCase(unittest.TestCase):
         self.assertFalse(freq_excluded(1e6, ((1e9, None),)))
         self.assertFalse(freq_excluded(1e9, ((None, 1e6),)))
 
+    def test_freq_exclusions(self):
+        exclusions = FreqExclusions(((300, 400), (100, 200), (150, 250), (None, 50)))
+        self.assertEqual(((-np.inf, 50), (100, 250), (300, 400)), exclusions.intervals)
+        freqs = [0, 50, 51, 100, 225, 250, 275, 300, 400, 401]
+        expected = [True, True, False, True, True, True, False, True, True, False]
+        self.assertEqual(expected, [exclusions.excluded(freq) for freq in freqs])
+        self.assertEqual(expected, list(exclusions.mask(freqs)))
+        self.assertEqual(
+            FreqExclusions(((1e6, None),)), FreqExclusions.parse(["1000000-"])
+        )
+        self.assertFalse(FreqExclusions().mask([1, 2]).any())
+        self.assertTrue(freq_excluded(350, exclusions))
+
+    def test_freq_exclusions_compiled(self):
+        signals, recorder_freq_exclusions = random_freq_exclusions(200, 4)
+        self.assertEqual(
+            linear_exclusions(signals, recorder_freq_exclusions),
+            compiled_exclusions(signals, recorder_freq_exclusions),
+        )
+
+    @unittest.skipUnless(BENCHMARK, "set GAMUTRF_BENCHMARK=1 to run benchmarks")
+    def test_freq_exclusions_benchmark(self):
+        signals, recorder_freq_exclusions = random_freq_exclusions(5000, 48)
+        start_time = time.time()
+        linear = linear_exclusions(signals, recorder_freq_exclusions)
+        linear_elapsed = time.time() - start_time
+        start_time = time.time()
+        compiled = compiled_exclusions(signals, recorder_freq_exclusions)
+        compiled_elapsed = time.time() - start_time
+        self.assertEqual(linear, compiled)
+        print(
+            f"{len(signals)} signals x {len(recorder_freq_exclusions)} recorders: "
+            f"linear {linear_elapsed * 1e3:.1f}ms, compiled {compiled_elapsed * 1e3:.1f}ms"
+        )
+        start_time = time.time()
+        choose_recorders(signals, recorder_freq_exclusions, 1)
+        print(f"choose_recorders: {(time.time() - start_time) * 1e3:.1f}ms")
+
     def test_parse_excluded(self):
         self.assertEqual(
             ((100, 200), (200, None), (None, 100)),
             parse_freq_excluded(["100-200", "200-", "-100"]),
         )
 
+    def test_fft_graph(self):
+        freq = np.arange(100, 200, 0.01)
+        db = np.full(len(freq), -50.0)
+        df = pd.DataFrame({"freq": freq, "db": db, "ts": np.full(len(freq), 1.0)})
+        mean_running_df = df[["freq", "db"]]
+        scan_config = {"freq_start": 100e6, "freq_end": 200e6}
+        fft_graph = FFTGraph(2)
+        with tempfile.TemporaryDirectory() as tempdir:
+            graph_path = os.path.join(tempdir, "fft.png")
+            fft_graph.render(graph_path, df, mean_running_df, [], [], scan_config)
+            self.assertTrue(os.path.exists(graph_path))
+            os.remove(graph_path)
+            last_dfs = [(freq, db - 1)] * 3
+            fft_graph.render(
+                graph_path,
+                df,
+                mean_running_df,
+                [(freq[10], -50)],
+                last_dfs,
+                scan_config,
+            )
+            self.assertTrue(os.path.exists(graph_path))
+            self.assertFalse(os.path.exists(os.path.join(tempdir, ".fft.png")))
+        fft_graph.close()
+
     def test_choose_record_signal(self):
         # One signal, one recorder.
         self.assertEqual([16], choose_record_signal([16], 1))
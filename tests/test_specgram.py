@@ -1,10 +1,20 @@
 #!/usr/bin/python3
 import os
 import tempfile
+import time
 import unittest
 
+import numpy as np
+import zstandard
+from matplotlib.mlab import window_hanning
+from PIL import Image
+
 from gamutrf.specgram import process_all_recordings
+from gamutrf.specgram import PSDAccumulator
+from gamutrf.specgram import specgram
+from gamutrf.specgram import watch_recordings
 from gamutrf.utils import parse_filename
+from gamutrf.utils import replace_ext
 
 
 class FakeArgs:
@@ -41,6 +51,16 @@ class FakeArgs:
         self.dpi = dpi
         self.skip_sample_secs = 0
         self.max_sample_secs = 0
+        self.read_ahead_workers = 1
+        self.time_pool = "none"
+        self.batch = False
+        self.direct_png = False
+        self.db_min = None
+        self.db_max = None
+        self.db_percentile = 0
+        self.watch_index = ""
+        self.watch_poll = 0.1
+        self.watch_inotify = True
 
 
 class SpecgramTestCase(unittest.TestCase):
@@ -80,6 +100,199 @@ class SpecgramTestCase(unittest.TestCase):
             fakeargs.skip_exist = False
             fakeargs.skip_fft = False
             process_all_recordings(fakeargs)
+            fakeargs.direct_png = True
+            fakeargs.db_percentile = 1
+            process_all_recordings(fakeargs)
+            with Image.open(replace_ext(recording, "png", all_ext=True)) as image:
+                self.assertEqual((11 * 100, 8 * 100), image.size)
+
+    def test_batch(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            rng = np.random.default_rng(seed=0)
+            recordings = []
+            for i in range(3):
+                recording = os.path.join(
+                    str(tempdir), f"testrecording{i}_100Hz_10000sps.s16.zst"
+                )
+                with open(recording, "wb") as f:
+                    f.write(
+                        zstandard.ZstdCompressor().compress(
+                            rng.integers(
+                                -1000, 1000, 10000 * 2, dtype=np.int16
+                            ).tobytes()
+                        )
+                    )
+                recordings.append(recording)
+            fakeargs = FakeArgs(
+                256,
+                "turbo",
+                1,
+                False,
+                0,
+                "png",
+                False,
+                recordings[0],
+                1,
+                False,
+                4,
+                3,
+                50,
+                0,
+                0,
+            )
+            process_all_recordings(fakeargs)
+            with open(recordings[0].replace(".s16.zst", ".png"), "rb") as f:
+                single_png = f.read()
+            os.remove(recordings[0].replace(".s16.zst", ".png"))
+            fakeargs.batch = True
+            fakeargs.recording = tempdir
+            for workers in (1, 2):
+                fakeargs.workers = workers
+                results = process_all_recordings(fakeargs)
+                self.assertEqual(3, len([result for result in results if result]))
+                # a reused figure plots the same image as a new one.
+                with open(recordings[0].replace(".s16.zst", ".png"), "rb") as f:
+                    self.assertEqual(single_png, f.read())
+                self.assertEqual(
+                    [],
+                    [name for name in os.listdir(tempdir) if name.startswith(".")],
+                )
+                # outputs are newer than recordings, so nothing to do.
+                results = process_all_recordings(fakeargs)
+                self.assertEqual([None] * 3, results)
+                future = time.time() + 60
+                os.utime(recordings[1], (future, future))
+                results = process_all_recordings(fakeargs)
+                self.assertEqual([None, os.path.getsize(recordings[1]), None], results)
+                for recording in recordings:
+                    os.utime(recording, (100, 100))
+                    os.utime(recording.replace(".s16.zst", ".png"), (0, 0))
+
+    def test_watch(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            rng = np.random.default_rng(seed=0)
+
+            def write_recording(i):
+                recording = os.path.join(
+                    str(tempdir), f"testrecording{i}_100Hz_10000sps.s16.zst"
+                )
+                with open(recording, "wb") as f:
+                    f.write(
+                        zstandard.ZstdCompressor().compress(
+                            rng.integers(
+                                -1000, 1000, 10000 * 2, dtype=np.int16
+                            ).tobytes()
+                        )
+                    )
+                return recording
+
+            recordings = [write_recording(i) for i in range(2)]
+            fakeargs = FakeArgs(
+                256,
+                "turbo",
+                1,
+                True,
+                0,
+                "png",
+                False,
+                tempdir,
+                1,
+                False,
+                4,
+                3,
+                50,
+                0,
+                0,
+            )
+            fakeargs.direct_png = True
+            watch_recordings(fakeargs, polls=0)
+            pngs = [recording.replace(".s16.zst", ".png") for recording in recordings]
+            self.assertTrue(all(os.path.exists(png) for png in pngs))
+            # recordings already processed are not processed again after a restart.
+            os.remove(pngs[0])
+            recordings.append(write_recording(2))
+            watch_recordings(fakeargs, polls=0)
+            self.assertFalse(os.path.exists(pngs[0]))
+            self.assertTrue(os.path.exists(recordings[2].replace(".s16.zst", ".png")))
+
+    def test_psd_accumulator(self):
+        rng = np.random.default_rng(seed=0)
+        psd = rng.random((8, 1000), dtype=np.float32)
+        for pool, reduce in (("max", np.max), ("mean", np.mean)):
+            for max_columns in (7, 64, 2000):
+                psd_acc = PSDAccumulator(8, max_columns=max_columns, pool=pool)
+                i = 0
+                while i < psd.shape[1]:
+                    size = int(rng.integers(1, 50))
+                    psd_acc.add(psd[:, i : i + size])
+                    i += size
+                out, centers = psd_acc.result()
+                self.assertLessEqual(out.shape[1], max_columns)
+                factor = psd_acc.factor
+                expected = np.stack(
+                    [
+                        reduce(psd[:, j : j + factor], axis=1)
+                        for j in range(0, psd.shape[1], factor)
+                    ],
+                    axis=1,
+                )
+                self.assertTrue(np.allclose(expected, out), (pool, max_columns))
+                self.assertEqual(
+                    [
+                        np.mean(np.arange(psd.shape[1])[j : j + factor])
+                        for j in range(0, psd.shape[1], factor)
+                    ],
+                    list(centers),
+                )
+        psd_acc = PSDAccumulator(8)
+        psd_acc.add(psd[:, :10])
+        psd_acc.add(psd[:, 10:])
+        out, centers = psd_acc.result()
+        self.assertTrue(np.array_equal(psd, out))
+        self.assertEqual(list(range(1000)), list(centers))
+        self.assertEqual((None, None), PSDAccumulator(8, 4).result())
+
+    def test_specgram(self):
+        rng = np.random.default_rng(seed=0)
+        samples = (rng.random(1024 * 64) + 1j * rng.random(1024 * 64)).astype(
+            np.complex64
+        )
+        chunks = [samples[i : i + 1024 * 8] for i in range(0, len(samples), 1024 * 8)]
+        Z, extent = specgram(chunks, NFFT=256, Fs=1e6, Fc=100e6, noverlap=0)
+        window = np.abs(window_hanning(np.ones(256, np.complex64)))
+        expected = np.abs(np.fft.fft(samples.reshape(-1, 256), axis=1).T) ** 2
+        expected = np.fft.fftshift(expected / 1e6 / (window**2).sum(), axes=0)
+        self.assertEqual(np.float32, Z.dtype)
+        self.assertTrue(
+            np.allclose(
+                np.flipud(10 * np.log10(expected)),
+                Z,
+                atol=1e-3,
+            )
+        )
+        self.assertAlmostEqual(0, extent[0])
+        self.assertAlmostEqual(len(samples) / 1e6, extent[1])
+        pooled_Z, pooled_extent = specgram(
+            chunks, NFFT=256, Fs=1e6, noverlap=0, max_columns=16, time_pool="max"
+        )
+        self.assertEqual((256, 16), pooled_Z.shape)
+        self.assertTrue(np.allclose(Z.reshape(256, 16, 16).max(axis=2), pooled_Z))
+        self.assertAlmostEqual(extent[0], pooled_extent[0])
+        self.assertAlmostEqual(extent[1], pooled_extent[1])
+
+    def test_specgram_overlap(self):
+        rng = np.random.default_rng(seed=0)
+        samples = (rng.random(100000) + 1j * rng.random(100000)).astype(np.complex64)
+        Z, extent = specgram([samples], NFFT=256, Fs=1e6, noverlap=100)
+        for chunk_size in (100, 256, 1000, 4321):
+            chunks = [
+                samples[i : i + chunk_size] for i in range(0, len(samples), chunk_size)
+            ]
+            chunk_Z, chunk_extent = specgram(chunks, NFFT=256, Fs=1e6, noverlap=100)
+            self.assertEqual(Z.shape, chunk_Z.shape)
+            self.assertTrue(np.allclose(Z, chunk_Z, atol=1e-3), chunk_size)
+            self.assertEqual(extent, chunk_extent)
+        self.assertEqual((256, (len(samples) - 100) // 156), Z.shape)
 
 
 if __name__ == "__main__":  # pragma: no cover
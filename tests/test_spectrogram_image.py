@@ -0,0 +1,84 @@
+#!/usr/bin/python3
+import os
+import tempfile
+import time
+import unittest
+
+import matplotlib
+import matplotlib.pyplot as plt
+import numpy as np
+from PIL import Image
+
+from gamutrf.spectrogram_image import colormap_lut
+from gamutrf.spectrogram_image import quantize
+from gamutrf.spectrogram_image import value_range
+from gamutrf.spectrogram_image import write_spectrogram_png
+
+# timings are only run (and printed) if set, as they take seconds.
+BENCHMARK = os.getenv("GAMUTRF_BENCHMARK", "")
+
+
+class SpectrogramImageTestCase(unittest.TestCase):
+    def test_colormap_lut(self):
+        lut = colormap_lut("turbo")
+        self.assertEqual((256, 3), lut.shape)
+        expected = matplotlib.colormaps["turbo"](np.linspace(0, 1, 256), bytes=True)
+        self.assertLessEqual(np.abs(lut.astype(int) - expected[:, :3]).max(), 1)
+
+    def test_quantize(self):
+        values = np.array([-np.inf, -10, -5, 0, 10, np.nan, np.inf])
+        self.assertEqual((-10, 10), value_range(values))
+        self.assertEqual(
+            [0, 0, 63, 127, 255, 0, 255], quantize(values, -10, 10).tolist()
+        )
+        self.assertEqual((-2, 0), value_range(values, vmin=-2, vmax=0))
+        values = np.arange(101, dtype=np.float32)
+        self.assertEqual((5, 95), value_range(values, percentile=5))
+
+    def test_write_spectrogram_png(self):
+        rng = np.random.default_rng(seed=0)
+        values = rng.normal(-50, 10, (64, 256)).astype(np.float32)
+        with tempfile.TemporaryDirectory() as tempdir:
+            direct_png = os.path.join(tempdir, "direct.png")
+            write_spectrogram_png(direct_png, values, "turbo_r", size=(110, 80))
+            with Image.open(direct_png) as image:
+                self.assertEqual((110, 80), image.size)
+                self.assertEqual("RGB", image.mode)
+            self.assertEqual(["direct.png"], os.listdir(tempdir))
+
+            # without resizing, each pixel is the LUT color of its value.
+            write_spectrogram_png(direct_png, values[:8, :8], "turbo_r")
+            with Image.open(direct_png) as image:
+                pixels = np.asarray(image)
+            lut = colormap_lut("turbo_r")
+            vmin, vmax = value_range(values[:8, :8])
+            self.assertTrue(
+                np.array_equal(lut[quantize(values[:8, :8], vmin, vmax)], pixels)
+            )
+
+    @unittest.skipUnless(BENCHMARK, "set GAMUTRF_BENCHMARK=1 to run benchmarks")
+    def test_write_spectrogram_png_benchmark(self):
+        rng = np.random.default_rng(seed=0)
+        values = rng.normal(-50, 10, (1024, 4096)).astype(np.float32)
+        with tempfile.TemporaryDirectory() as tempdir:
+            direct_png = os.path.join(tempdir, "direct.png")
+            start_time = time.time()
+            write_spectrogram_png(direct_png, values, "turbo_r", size=(1100, 800))
+            direct_time = time.time() - start_time
+
+            plot_png = os.path.join(tempdir, "plot.png")
+            start_time = time.time()
+            fig = plt.figure()
+            fig.set_size_inches(11, 8)
+            axes = fig.add_subplot(111)
+            axes.set_axis_off()
+            fig.subplots_adjust(top=1, bottom=0, right=1, left=0)
+            axes.imshow(values, cmap="turbo_r", aspect="auto")
+            fig.savefig(plot_png, dpi=100)
+            plt.close(fig)
+            plot_time = time.time() - start_time
+            print(f"direct {direct_time:.3f}s, plot {plot_time:.3f}s")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    unittest.main()
@@ -1,8 +1,12 @@
 #!/usr/bin/python3
+import os
+import tempfile
 import unittest
 
 import numpy as np
 
+from gamutrf.utils import get_nondot_files
+from gamutrf.utils import is_nondot_file
 from gamutrf.utils import parse_filename
 
 
@@ -49,6 +53,25 @@ class UtilsTestCase(unittest.TestCase):
             ),
         )
 
+    def test_get_nondot_files(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            names = [
+                "a_100Hz_1000sps.s16.zst",
+                "b_100Hz_1000sps.s16",
+                "c_100Hz_1000sps.raw",
+                ".d_100Hz_1000sps.s16",
+                "a_100Hz_1000sps.s16.zst.idx",
+                "notes.txt",
+            ]
+            for name in names:
+                with open(os.path.join(tempdir, name), "wb"):
+                    pass
+            self.assertEqual(
+                sorted(os.path.join(tempdir, name) for name in names[:3]),
+                sorted(get_nondot_files(tempdir)),
+            )
+            self.assertFalse(is_nondot_file("b_100Hz_1000sps.s16", glob="*.zst"))
+
 
 if __name__ == "__main__":  # pragma: no cover
     unittest.main()